@@ -0,0 +1,354 @@
+"""Sales rollups for the admin dashboard.
+
+Revenue, units and order counts are kept per hour and per day, for the
+whole store, each category and each product, in ``sales_rollups``. A
+dashboard query reads one document per bucket it shows instead of
+scanning ``orders``.
+
+New orders are folded in by an outbox handler (``apply_order``): one
+unordered bulk of ``$inc`` upserts per order. Outbox delivery is at least
+once, so every applied order leaves a marker in ``sales_rollup_orders``
+and a redelivered order is skipped, so an order is never counted twice.
+Inside a transaction the marker commits with the increments. Without one
+it is written first, flagged ``pending``, and the flag is cleared once the
+increments are acknowledged. A failure that provably applied nothing
+removes the marker again so the retry counts the order; any other failure
+(a timeout, a partly applied bulk, a crash) leaves it pending, because
+the increments may have landed. Such an order may be missing from today's
+buckets, never counted twice, and the next backfill over its day makes
+them exact again.
+
+``backfill`` recomputes every bucket before the current UTC day from the
+orders themselves, a chunk of orders at a time with pandas, and replaces
+those buckets wholesale. Today's buckets are left to the incremental
+path; orders older than the backfill cutoff are from then on skipped by
+``apply_order``, since the backfill has counted them.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError, ServerSelectionTimeoutError
+
+from database import as_utc
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("hour", "day")
+DIMENSIONS = ("total", "category", "product")
+TOTAL_KEY = "all"
+UNCATEGORIZED = "uncategorized"
+STATE_ID = "sales_rollups"
+
+
+def nothing_applied(error: BaseException) -> bool:
+    """True if a failed ``bulk_write`` certainly changed no document."""
+    if isinstance(error, ServerSelectionTimeoutError):
+        # No server was found, so nothing was sent
+        return True
+    if isinstance(error, BulkWriteError):
+        details = error.details
+        return not any(details.get(field) for field in ("nInserted", "nUpserted", "nMatched", "nModified"))
+    return False
+
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    value = as_utc(value)
+    if granularity == "day":
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_id(granularity: str, dimension: str, key: str, bucket: datetime) -> str:
+    return f"{granularity}|{dimension}|{key}|{bucket.strftime('%Y-%m-%dT%H')}"
+
+
+def order_lines(order: Dict[str, Any]) -> Dict[Tuple[str, str], Dict[str, float]]:
+    """Units and revenue of one order per ``(dimension, key)``."""
+    totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+    for item in order.get("items", ()):
+        quantity = item.get("quantity", 0)
+        revenue = item.get("total", item.get("price", 0) * quantity)
+        for key in (
+            ("total", TOTAL_KEY),
+            ("category", item.get("category") or UNCATEGORIZED),
+            ("product", item["product_id"]),
+        ):
+            line = totals.setdefault(key, {"units": 0, "revenue": 0.0})
+            line["units"] += quantity
+            line["revenue"] += revenue
+    return totals
+
+
+class SalesRollups:
+    def __init__(self, collection, applied, state, state_ttl: float = 30.0):
+        self.collection = collection
+        # Markers of orders already folded in, for redelivered events
+        self.applied = applied
+        self.state = state
+        self.state_ttl = state_ttl
+        self._cutoff: Optional[datetime] = None
+        self._cutoff_read = 0.0
+        self.orders_applied = 0
+        self.duplicates_skipped = 0
+        self.backfilled_skipped = 0
+        # Orders whose increments failed ambiguously, left to the backfill
+        self.unconfirmed = 0
+        self.backfills = 0
+
+    async def backfill_cutoff(self) -> Optional[datetime]:
+        """Orders created before this are counted by the last backfill (cached for ``state_ttl``)."""
+        now = asyncio.get_running_loop().time()
+        if now - self._cutoff_read >= self.state_ttl:
+            state = await self.state.find_one({"_id": STATE_ID})
+            self._cutoff = as_utc(state["backfilled_before"]) if state else None
+            self._cutoff_read = now
+        return self._cutoff
+
+    async def apply_order(self, order: Dict[str, Any], session=None) -> bool:
+        """Add one order to its hour and day buckets; False if it was already counted."""
+        cutoff = await self.backfill_cutoff()
+        if cutoff is not None and as_utc(order["created_at"]) < cutoff:
+            self.backfilled_skipped += 1
+            return False
+        # Checked first: inside a transaction a duplicate key error would abort it
+        if await self.applied.find_one({"_id": order["id"]}, {"_id": 1}, session=session):
+            self.duplicates_skipped += 1
+            return False
+        marker = {"_id": order["id"], "applied_at": datetime.now(timezone.utc), "created_at": order["created_at"]}
+        if session is None:
+            # Until the increments are acknowledged they may or may not have landed
+            marker["pending"] = True
+        try:
+            await self.applied.insert_one(marker, session=session)
+        except DuplicateKeyError:
+            self.duplicates_skipped += 1
+            return False
+        operations = []
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(order["created_at"], granularity)
+            for (dimension, key), line in order_lines(order).items():
+                operations.append(UpdateOne(
+                    {"_id": rollup_id(granularity, dimension, key, bucket)},
+                    {
+                        "$inc": {"orders": 1, "units": line["units"], "revenue": line["revenue"]},
+                        "$setOnInsert": {
+                            "granularity": granularity, "dimension": dimension, "key": key, "bucket": bucket,
+                        },
+                    },
+                    upsert=True,
+                ))
+        try:
+            await self.collection.bulk_write(operations, ordered=False, session=session)
+        except BaseException as error:
+            if session is None:
+                if nothing_applied(error):
+                    # Let the retry count it
+                    await self.applied.delete_one({"_id": order["id"]})
+                else:
+                    # A retry would count what may already be counted; the backfill reconciles
+                    self.unconfirmed += 1
+                    logger.warning(
+                        "Sales rollups of order %s may be incomplete until the next backfill: %r",
+                        order["id"], error,
+                    )
+            raise
+        if session is None:
+            try:
+                await self.applied.update_one({"_id": order["id"]}, {"$unset": {"pending": ""}})
+            except PyMongoError:
+                # Counted all the same; the marker stays pending until the backfill
+                logger.warning("Could not confirm the sales rollups of order %s", order["id"], exc_info=True)
+        self.orders_applied += 1
+        return True
+
+    async def backfill(
+        self,
+        orders,
+        categories: Dict[str, str],
+        chunk_size: int = 5000,
+        now: Optional[datetime] = None,
+    ) -> Dict[str, Any]:
+        """Recompute all buckets before today's from ``orders``.
+
+        ``categories`` maps product ids to categories for order lines
+        written before lines carried their category.
+        """
+        cutoff = bucket_start(now or datetime.now(timezone.utc), "day")
+        run = uuid.uuid4().hex
+        # From here on the incremental path leaves older orders to this run
+        await self.state.update_one(
+            {"_id": STATE_ID},
+            {"$set": {"backfilled_before": cutoff, "started_at": datetime.now(timezone.utc), "run": run}},
+            upsert=True,
+        )
+        self._cutoff, self._cutoff_read = cutoff, asyncio.get_running_loop().time()
+
+        projection = {
+            "_id": 0, "id": 1, "created_at": 1,
+            "items.product_id": 1, "items.category": 1, "items.quantity": 1, "items.total": 1,
+        }
+        cursor = orders.find({"created_at": {"$lt": cutoff}}, projection).batch_size(chunk_size)
+        partials: List[pd.DataFrame] = []
+        chunk: List[Dict[str, Any]] = []
+        order_count = 0
+        async for order in cursor:
+            chunk.append(order)
+            if len(chunk) >= chunk_size:
+                partials.append(await asyncio.to_thread(aggregate_orders, chunk, categories))
+                order_count += len(chunk)
+                chunk = []
+                if len(partials) >= 16:
+                    # Bounded by the number of buckets, however many orders there are
+                    partials = [await asyncio.to_thread(merge, partials)]
+        if chunk:
+            partials.append(await asyncio.to_thread(aggregate_orders, chunk, categories))
+            order_count += len(chunk)
+        rollups = combine(partials)
+
+        written = 0
+        for start in range(0, len(rollups), 1000):
+            batch = rollups.iloc[start:start + 1000]
+            operations = [
+                ReplaceOne({"_id": row.id}, {
+                    "_id": row.id,
+                    "granularity": row.granularity,
+                    "dimension": row.dimension,
+                    "key": row.key,
+                    "bucket": row.bucket.to_pydatetime(),
+                    "orders": int(row.orders),
+                    "units": int(row.units),
+                    "revenue": float(row.revenue),
+                    "backfill": run,
+                }, upsert=True)
+                for row in batch.itertuples(index=False)
+            ]
+            await self.collection.bulk_write(operations, ordered=False)
+            written += len(operations)
+        # Buckets this run did not produce (e.g. orders since deleted) are stale
+        removed = await self.collection.delete_many({"bucket": {"$lt": cutoff}, "backfill": {"$ne": run}})
+        # Orders whose increments were unconfirmed are counted exactly now
+        reconciled = await self.applied.delete_many({"pending": True, "created_at": {"$lt": cutoff}})
+        self.backfills += 1
+        logger.info("Sales rollups backfilled from %d orders: %d buckets written", order_count, written)
+        return {
+            "orders": order_count,
+            "rollups": written,
+            "removed": removed.deleted_count,
+            "reconciled": reconciled.deleted_count,
+            "backfilled_before": cutoff,
+        }
+
+    async def series(
+        self, granularity: str, dimension: str, key: str, start: datetime, end: datetime
+    ) -> List[Dict[str, Any]]:
+        """Buckets of one key in ``[start, end)``, oldest first; empty buckets are absent."""
+        cursor = self.collection.find(
+            {
+                "granularity": granularity,
+                "dimension": dimension,
+                "key": key,
+                "bucket": {"$gte": start, "$lt": end},
+            },
+            {"_id": 0, "bucket": 1, "orders": 1, "units": 1, "revenue": 1},
+        ).sort("bucket", 1)
+        return [_rounded(document) async for document in cursor]
+
+    async def top(
+        self, granularity: str, dimension: str, start: datetime, end: datetime, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Keys of ``dimension`` with the most revenue in ``[start, end)``."""
+        pipeline = [
+            {"$match": {"granularity": granularity, "dimension": dimension, "bucket": {"$gte": start, "$lt": end}}},
+            {"$group": {
+                "_id": "$key",
+                "orders": {"$sum": "$orders"},
+                "units": {"$sum": "$units"},
+                "revenue": {"$sum": "$revenue"},
+            }},
+            {"$sort": {"revenue": -1, "_id": 1}},
+            {"$limit": limit},
+        ]
+        results = await self.collection.aggregate(pipeline).to_list(None)
+        return [_rounded({"key": document.pop("_id"), **document}) for document in results]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "orders_applied": self.orders_applied,
+            "duplicates_skipped": self.duplicates_skipped,
+            "backfilled_skipped": self.backfilled_skipped,
+            "unconfirmed": self.unconfirmed,
+            "backfills": self.backfills,
+        }
+
+
+def _rounded(document: Dict[str, Any]) -> Dict[str, Any]:
+    document["revenue"] = round(document["revenue"], 2)
+    return document
+
+
+def aggregate_orders(orders: Iterable[Dict[str, Any]], categories: Dict[str, str]) -> pd.DataFrame:
+    """Rollup rows for a chunk of orders; see ``combine``."""
+    order_ids, created, product_ids, line_categories, quantities, totals = [], [], [], [], [], []
+    for order in orders:
+        for item in order.get("items", ()):
+            order_ids.append(order["id"])
+            created.append(as_utc(order["created_at"]))
+            product_ids.append(item["product_id"])
+            line_categories.append(item.get("category") or categories.get(item["product_id"], UNCATEGORIZED))
+            quantities.append(item.get("quantity", 0))
+            totals.append(item.get("total", 0.0))
+    lines = pd.DataFrame({
+        "order_id": order_ids,
+        "created_at": pd.to_datetime(created, utc=True),
+        "product": product_ids,
+        "category": line_categories,
+        "units": pd.array(quantities, dtype="int64"),
+        "revenue": pd.array(totals, dtype="float64"),
+    })
+    lines["total"] = TOTAL_KEY
+    lines["hour"] = lines["created_at"].dt.floor("h")
+    lines["day"] = lines["created_at"].dt.floor("D")
+    frames = []
+    for granularity in GRANULARITIES:
+        for dimension in DIMENSIONS:
+            # An order is in one chunk only, so per-chunk order counts add up across chunks
+            grouped = lines.groupby([granularity, dimension], sort=False).agg(
+                orders=("order_id", "nunique"), units=("units", "sum"), revenue=("revenue", "sum")
+            ).reset_index()
+            grouped.columns = ["bucket", "key", "orders", "units", "revenue"]
+            grouped["granularity"] = granularity
+            grouped["dimension"] = dimension
+            frames.append(grouped)
+    return pd.concat(frames, ignore_index=True)
+
+
+ROLLUP_KEYS = ["granularity", "dimension", "key", "bucket"]
+
+
+def merge(partials: List[pd.DataFrame]) -> pd.DataFrame:
+    """Sum rollup rows of the same bucket."""
+    merged = pd.concat(partials, ignore_index=True).groupby(ROLLUP_KEYS, sort=False)
+    return merged[["orders", "units", "revenue"]].sum().reset_index()
+
+
+def combine(partials: List[pd.DataFrame]) -> pd.DataFrame:
+    """One row per bucket from per-chunk rollup rows, with its document id."""
+    if not partials:
+        return pd.DataFrame(columns=["id", *ROLLUP_KEYS, "orders", "units", "revenue"])
+    rollups = merge(partials)
+    hours = rollups["bucket"].dt.strftime("%Y-%m-%dT%H")
+    prefix = rollups["granularity"] + "|" + rollups["dimension"] + "|"
+    rollups["id"] = prefix + rollups["key"].astype(str) + "|" + hours
+    return rollups
+
+
+def default_range(granularity: str, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """Last 48 hours or the last 30 days, ending with the current bucket."""
+    end = bucket_start(now or datetime.now(timezone.utc), granularity)
+    end += timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    return end - (timedelta(hours=48) if granularity == "hour" else timedelta(days=30)), end
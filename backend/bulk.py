@@ -0,0 +1,343 @@
+"""Streaming bulk import and export of products.
+
+Imports read the request body incrementally, parse NDJSON or CSV rows,
+validate them a chunk at a time and write each chunk with one unordered
+``bulk_write`` of upserts keyed by ``id``. Only one chunk is parsed while
+the previous one is being written, so memory stays flat however large the
+upload is; lines are capped at ``MAX_LINE_BYTES`` and the error report at
+``max_errors`` for the same reason. Rows identical to the stored product
+are counted as unchanged and not written, so re-importing a catalog does
+not touch ``updated_at`` on every product.
+
+Exports walk a cursor and yield encoded batches, so the catalog is never
+held in memory as a whole.
+"""
+import asyncio
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel, ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+CSV_COLUMNS = (
+    "id", "name", "description", "price", "image_url", "category",
+    "specifications", "stock_quantity", "featured", "created_at",
+)
+
+Row = Tuple[int, Any]
+
+# Longest line (or multi-line CSV record) an import accepts; longer ones are skipped as row errors
+MAX_LINE_BYTES = 1 << 20
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+async def iter_lines(
+    chunks: AsyncIterable[bytes], max_length: int = MAX_LINE_BYTES
+) -> AsyncIterator[Union[bytes, LineTooLong]]:
+    """Split a byte stream into lines, newline excluded.
+
+    A line longer than ``max_length`` yields a ``LineTooLong`` in its place
+    and is discarded as it arrives, so the buffer never grows past one line
+    plus one chunk. Each chunk is only scanned for newlines once.
+    """
+    pending = bytearray()
+    skipping = False
+    async for chunk in chunks:
+        scanned = len(pending)
+        pending += chunk
+        start = 0
+        while (end := pending.find(b"\n", scanned)) >= 0:
+            if skipping:
+                skipping = False
+            elif end - start > max_length:
+                yield LineTooLong(f"Line is longer than {max_length} bytes")
+            else:
+                yield bytes(pending[start:end]).rstrip(b"\r")
+            start = scanned = end + 1
+        del pending[:start]
+        if len(pending) > max_length:
+            if not skipping:
+                yield LineTooLong(f"Line is longer than {max_length} bytes")
+                skipping = True
+            pending.clear()
+    if pending and not skipping:
+        yield bytes(pending).rstrip(b"\r")
+
+
+async def ndjson_rows(chunks: AsyncIterable[bytes], max_length: int = MAX_LINE_BYTES) -> AsyncIterator[Row]:
+    """``(line_number, document)`` per non-blank line; unparsable lines yield the error."""
+    number = 0
+    async for line in iter_lines(chunks, max_length):
+        number += 1
+        if isinstance(line, LineTooLong):
+            yield number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line.decode("utf-8"))
+        except ValueError as exc:
+            # Includes UnicodeDecodeError
+            yield number, exc
+
+
+async def csv_rows(chunks: AsyncIterable[bytes], max_length: int = MAX_LINE_BYTES) -> AsyncIterator[Row]:
+    """``(line_number, row_dict)`` per CSV record, keyed by the header row.
+
+    Quoted fields may span lines: a record is complete once it contains an
+    even number of quote characters (escaped quotes come in pairs). A
+    record longer than ``max_length`` is reported and skipped up to its end.
+    """
+    header: Optional[List[str]] = None
+    record: List[str] = []
+    size = 0
+    quoted = overflow = False
+    start = number = 0
+    async for raw in iter_lines(chunks, max_length):
+        number += 1
+        if not record and not overflow:
+            start = number
+        try:
+            if isinstance(raw, LineTooLong):
+                raise raw
+            line = raw.decode("utf-8")
+        except ValueError as exc:
+            # Includes UnicodeDecodeError
+            if header is not None:
+                yield number, exc
+            record, size, quoted, overflow = [], 0, False, False
+            continue
+        quoted ^= line.count('"') % 2 == 1
+        if overflow:
+            overflow = quoted
+            continue
+        record.append(line)
+        size += len(line) + 1
+        if quoted:
+            if size > max_length:
+                yield start, LineTooLong(f"Record is longer than {max_length} bytes")
+                record, size, overflow = [], 0, True
+            continue
+        text = "\n".join(record)
+        record, size = [], 0
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [column.strip() for column in values]
+            continue
+        yield start, _csv_document(header, values)
+    if record or overflow:
+        yield start, ValueError("Unterminated quoted field")
+
+
+def _csv_document(header: List[str], values: List[str]) -> Any:
+    if len(values) != len(header):
+        return ValueError(f"Expected {len(header)} columns, got {len(values)}")
+    document: Dict[str, Any] = {}
+    for column, value in zip(header, values):
+        if value == "":
+            continue
+        if column == "specifications":
+            try:
+                value = json.loads(value)
+            except ValueError:
+                return ValueError("specifications must be a JSON object")
+        document[column] = value
+    return document
+
+
+class ImportReport:
+    def __init__(self, max_errors: int):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.valid = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def error(self, row: int, product_id: Optional[str], errors: List[str]):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "id": product_id, "errors": errors})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "valid": self.valid,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _validation_messages(exc: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}" for error in exc.errors()]
+
+
+Operation = Tuple[int, str, Dict[str, Any], UpdateOne]
+
+
+def _prepare(rows: List[Row], model: Type[BaseModel], report: ImportReport) -> List[Operation]:
+    now = datetime.now(timezone.utc)
+    operations = []
+    for number, document in rows:
+        if isinstance(document, Exception):
+            report.error(number, None, [str(document)])
+            continue
+        if not isinstance(document, dict):
+            report.error(number, None, ["row must be an object"])
+            continue
+        product_id = document.get("id")
+        if product_id is not None and (not isinstance(product_id, str) or not product_id.strip()):
+            report.error(number, None, ["id must be a non-empty string"])
+            continue
+        try:
+            product = model.model_validate(document)
+        except ValidationError as exc:
+            report.error(number, product_id, _validation_messages(exc))
+            continue
+        created_at = document.get("created_at") or now
+        if isinstance(created_at, str):
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except ValueError:
+                report.error(number, product_id, ["created_at must be an ISO 8601 timestamp"])
+                continue
+        product_id = product_id or str(uuid.uuid4())
+        fields = product.model_dump()
+        report.valid += 1
+        operations.append((number, product_id, fields, UpdateOne(
+            {"id": product_id},
+            {
+                "$set": fields,
+                "$setOnInsert": {"id": product_id, "created_at": created_at},
+                "$currentDate": {"updated_at": True},
+            },
+            upsert=True,
+        )))
+    return operations
+
+
+async def _changed(collection, operations: List[Operation], report: ImportReport) -> List[Operation]:
+    """Drop operations whose fields already match the stored product, counting them as unchanged."""
+    fields = {name for _, _, values, _ in operations for name in values}
+    projection = {"_id": 0, "id": 1, **{name: 1 for name in fields}}
+    ids = list({product_id for _, product_id, _, _ in operations})
+    stored = {document["id"]: document async for document in collection.find({"id": {"$in": ids}}, projection)}
+    changed = []
+    for operation in operations:
+        _, product_id, values, _ = operation
+        current = stored.get(product_id)
+        if current is not None and all(current.get(name) == value for name, value in values.items()):
+            report.unchanged += 1
+        else:
+            changed.append(operation)
+    return changed
+
+
+async def _write(collection, operations: List[Operation], report: ImportReport):
+    operations = await _changed(collection, operations, report) if operations else operations
+    if not operations:
+        return
+    try:
+        result = await collection.bulk_write([operation for *_, operation in operations], ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as exc:
+        details = exc.details
+        for error in details.get("writeErrors", []):
+            number, product_id, *_ = operations[error["index"]]
+            report.error(number, product_id, [error.get("errmsg", "write failed")])
+    # Every matched product differs (identical ones were dropped above), so $currentDate modifies it
+    report.inserted += details.get("nUpserted", 0)
+    report.updated += details.get("nModified", 0)
+
+
+async def import_products(
+    rows: AsyncIterable[Row],
+    collection,
+    model: Type[BaseModel],
+    chunk_size: int = 1000,
+    max_errors: int = 1000,
+) -> Dict[str, Any]:
+    """Validate and upsert ``rows``; returns counts and the first ``max_errors`` row errors."""
+    report = ImportReport(max_errors)
+    writing: Optional[asyncio.Task] = None
+    chunk: List[Row] = []
+
+    async def flush():
+        nonlocal writing, chunk
+        operations = _prepare(chunk, model, report)
+        chunk = []
+        if writing is not None:
+            await writing
+        writing = asyncio.ensure_future(_write(collection, operations, report))
+
+    try:
+        async for row in rows:
+            report.rows += 1
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                await flush()
+        await flush()
+        await writing
+    finally:
+        if writing is not None and not writing.done():
+            writing.cancel()
+    return report.as_dict()
+
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def export_ndjson(cursor) -> AsyncIterator[bytes]:
+    batch: List[str] = []
+    async for document in cursor:
+        batch.append(json.dumps(document, default=_json_default, separators=(",", ":")))
+        if len(batch) >= 500:
+            yield ("\n".join(batch) + "\n").encode()
+            batch = []
+    if batch:
+        yield ("\n".join(batch) + "\n").encode()
+
+
+async def export_csv(cursor) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    rows = 0
+    async for document in cursor:
+        values = []
+        for column in CSV_COLUMNS:
+            value = document.get(column)
+            if column == "specifications":
+                value = json.dumps(value or {}, default=_json_default)
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            elif isinstance(value, bool):
+                value = "true" if value else "false"
+            values.append("" if value is None else value)
+        writer.writerow(values)
+        rows += 1
+        if rows % 500 == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
@@ -0,0 +1,347 @@
+"""Process-local, versioned copy of the product catalog.
+
+The whole ``products`` collection is held in memory and kept fresh by a
+change stream. Standalone servers cannot open change streams, so the cache
+falls back to polling. Every product write stamps ``updated_at`` with the
+server's ``$currentDate``, so a poll reads the newest ``updated_at`` from its
+index, how many products carry it and the collection's estimated count, and
+only reloads when one of those moves. Writes that bypass the API must set
+``updated_at`` too, or the poll will not notice them.
+
+Every applied change bumps ``version``, a per-process monotonic counter that
+responses can expose and that other in-memory structures key off. Because
+the version differs between processes, the cache also keeps a content
+``digest`` (an XOR of per-product hashes, updated incrementally) that is
+identical in every process holding the same catalog.
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+ChangeListener = Callable[[List[Dict[str, Any]], List[str]], None]
+
+
+def _sort_key(value: Any) -> Tuple:
+    # Mongo orders missing/null values before everything else
+    return (0,) if value is None else (1, value)
+
+
+def content_hash(document: Dict[str, Any]) -> int:
+    raw = json.dumps(document, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=16).digest(), "big")
+
+
+async def collection_signature(collection) -> Tuple:
+    """A value that moves whenever a product is written or deleted; see the module docstring."""
+    # All three are answered from indexes and collection metadata
+    latest = await collection.find_one({}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", DESCENDING)])
+    updated_at = latest.get("updated_at") if latest else None
+    return (
+        await collection.estimated_document_count(),
+        updated_at,
+        # A second write within the same millisecond leaves the maximum where it was
+        await collection.count_documents({"updated_at": updated_at}) if updated_at else 0,
+    )
+
+
+class SignatureTracker:
+    """The last ``collection_signature`` seen, for pollers that act only when it moves."""
+
+    def __init__(self):
+        self.signature: Optional[Tuple] = None
+
+    async def changed(self, collection) -> bool:
+        """Read the signature; True when it differs from the previous read (always on the first)."""
+        signature = await collection_signature(collection)
+        changed = signature != self.signature
+        self.signature = signature
+        return changed
+
+
+class CatalogCache:
+    """In-memory products keyed by ``id`` with filtered, keyset-paged listings."""
+
+    def __init__(self, collection, poll_interval: float = 10.0, change_streams: bool = True):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.change_streams = change_streams
+        self.version = 0
+        self.ready = False
+        self.mode: Optional[str] = None
+        self._products: Dict[str, Dict[str, Any]] = {}
+        self._object_ids: Dict[Any, str] = {}
+        self._revisions: Dict[str, int] = {}
+        self._hashes: Dict[str, int] = {}
+        self.digest = 0
+        self._sorted: Dict[str, List[Tuple[Tuple, str]]] = {}
+        self._listeners: List[ChangeListener] = []
+        self._task: Optional[asyncio.Task] = None
+        self._signature = SignatureTracker()
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def subscribe(self, listener: ChangeListener):
+        """Call ``listener(upserted_docs, removed_ids)`` after every change."""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    # Reads
+
+    def get(self, product_id: str) -> Optional[Dict[str, Any]]:
+        return self._products.get(product_id)
+
+    def get_many(self, product_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        products = self._products
+        return {product_id: products[product_id] for product_id in product_ids if product_id in products}
+
+    def product_hash(self, product_id: str) -> Optional[int]:
+        """Content hash of one product, stable across processes."""
+        return self._hashes.get(product_id)
+
+    def revision(self, product_id: str) -> int:
+        """Catalog version at which ``product_id`` last changed (0 if unknown)."""
+        return self._revisions.get(product_id, 0)
+
+    def products(self) -> List[Dict[str, Any]]:
+        return list(self._products.values())
+
+    def query(
+        self,
+        category: Optional[str] = None,
+        featured: Optional[bool] = None,
+        sort: str = "created_at",
+        direction: int = ASCENDING,
+        after: Optional[Tuple[Any, str]] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """Products matching the filters in (sort, id) order, after ``after``."""
+        ordered = self._sorted.get(sort)
+        if ordered is None:
+            ordered = sorted(
+                (_sort_key(product.get(sort)), product_id) for product_id, product in self._products.items()
+            )
+            self._sorted[sort] = ordered
+        ascending = direction == ASCENDING
+        if after is None:
+            positions = range(len(ordered)) if ascending else range(len(ordered) - 1, -1, -1)
+        else:
+            pivot = (_sort_key(after[0]), after[1])
+            if ascending:
+                positions = range(bisect.bisect_right(ordered, pivot), len(ordered))
+            else:
+                positions = range(bisect.bisect_left(ordered, pivot) - 1, -1, -1)
+        results = []
+        for position in positions:
+            product = self._products[ordered[position][1]]
+            if category is not None and product.get("category") != category:
+                continue
+            if featured is not None and product.get("featured") != featured:
+                continue
+            results.append(product)
+            if len(results) >= limit:
+                break
+        return results
+
+    # Loading and invalidation
+
+    async def load(self):
+        """Replace the cache with the collection's current contents.
+
+        The version only moves when something actually changed, so a poll
+        that finds the catalog as it was does not invalidate anything.
+        """
+        products = {}
+        object_ids = {}
+        async for document in self.collection.find({}):
+            object_ids[document.pop("_id")] = document["id"]
+            products[document["id"]] = document
+        upserted = [product for product_id, product in products.items() if self._products.get(product_id) != product]
+        removed = [product_id for product_id in self._products if product_id not in products]
+        self._products = products
+        self._object_ids = object_ids
+        if upserted or removed or not self.ready:
+            self.version += 1
+            for product in upserted:
+                self._rehash(product["id"], product)
+            for product_id in removed:
+                self._rehash(product_id, None)
+            for product_id in [product["id"] for product in upserted] + removed:
+                self._revisions[product_id] = self.version
+            self._sorted = {}
+            self._notify(upserted, removed)
+            logger.info("Catalog cache loaded %d products (version %d)", len(products), self.version)
+        self.ready = True
+
+    def apply(self, upserted: Iterable[Dict[str, Any]] = (), removed_object_ids: Iterable[Any] = ()):
+        upserted = list(upserted)
+        removed = []
+        for object_id in removed_object_ids:
+            product_id = self._object_ids.pop(object_id, None)
+            if product_id is not None and self._products.pop(product_id, None) is not None:
+                removed.append(product_id)
+        if not upserted and not removed:
+            return
+        self.version += 1
+        for document in upserted:
+            document = dict(document)
+            self._object_ids[document.pop("_id", None)] = document["id"]
+            previous = self._products.get(document["id"])
+            self._products[document["id"]] = document
+            self._revisions[document["id"]] = self.version
+            self._rehash(document["id"], document)
+            # Stock updates are frequent; only re-sort when a sort key moved
+            for sort in list(self._sorted):
+                if previous is None or previous.get(sort) != document.get(sort):
+                    del self._sorted[sort]
+        for product_id in removed:
+            self._revisions[product_id] = self.version
+            self._rehash(product_id, None)
+        if removed:
+            self._sorted = {}
+        self._notify([self._products[document["id"]] for document in upserted], removed)
+
+    def _rehash(self, product_id: str, document: Optional[Dict[str, Any]]):
+        self.digest ^= self._hashes.pop(product_id, 0)
+        if document is not None:
+            self._hashes[product_id] = content_hash(document)
+            self.digest ^= self._hashes[product_id]
+
+    def _notify(self, upserted: List[Dict[str, Any]], removed: List[str]):
+        for listener in self._listeners:
+            try:
+                listener(upserted, removed)
+            except Exception:
+                logger.exception("Catalog change listener failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="catalog-cache")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        if not self.change_streams:
+            await self._poll()
+        while True:
+            try:
+                await self._watch()
+            except OperationFailure as exc:
+                # Change streams need a replica set or sharded cluster
+                logger.info("Catalog change stream unavailable (%s); polling every %ss", exc, self.poll_interval)
+                await self._poll()
+            except Exception:
+                logger.exception("Catalog change stream failed; reloading")
+                await asyncio.sleep(1)
+                try:
+                    await self.load()
+                except PyMongoError:
+                    logger.exception("Catalog reload failed")
+
+    async def _watch(self):
+        async with self.collection.watch(full_document="updateLookup") as stream:
+            self.mode = "change_stream"
+            # Changes made between load() and the stream opening would be lost
+            await self.load()
+            async for change in stream:
+                operation = change["operationType"]
+                if operation in ("insert", "update", "replace") and change.get("fullDocument"):
+                    self.apply(upserted=[change["fullDocument"]])
+                elif operation == "delete":
+                    self.apply(removed_object_ids=[change["documentKey"]["_id"]])
+                elif operation in ("drop", "rename", "dropDatabase", "invalidate"):
+                    await self.load()
+                    return
+
+    async def _poll(self):
+        self.mode = "polling"
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await self._signature.changed(self.collection):
+                    await self.load()
+            except PyMongoError:
+                logger.exception("Catalog poll failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "mode": self.mode,
+            "version": self.version,
+            "digest": f"{self.digest:032x}",
+            "products": len(self._products),
+        }
+
+
+class CatalogWatcher:
+    """Calls ``on_change`` when the products collection changes, without caching it.
+
+    For processes that run with the catalog cache disabled but still keep
+    indexes derived from the catalog. Polls the same signature as the
+    cache's polling fallback; ``wake()`` checks right away, for writes the
+    process made itself.
+    """
+
+    def __init__(self, collection, on_change: Callable[[], Awaitable[None]], poll_interval: float = 60.0):
+        self.collection = collection
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self._signature = SignatureTracker()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.polls = 0
+        self.refreshes = 0
+
+    async def changed(self) -> bool:
+        return await self._signature.changed(self.collection)
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="catalog-watcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            self.polls += 1
+            try:
+                if await self.changed():
+                    self.refreshes += 1
+                    await self.on_change()
+            except Exception:
+                logger.exception("Catalog refresh failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"polls": self.polls, "refreshes": self.refreshes, "poll_interval_seconds": self.poll_interval}
@@ -0,0 +1,100 @@
+"""The Motor client, created at startup instead of at import.
+
+``Database`` holds the connection settings until ``connect()`` is called
+from the application's lifespan, warms the pool up before traffic is
+accepted, answers health pings and closes the client on shutdown.
+``client_factory`` replaces the real client (tests and benchmarks pass
+mongomock's).
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+def as_utc(value: datetime) -> datetime:
+    """``value`` as an aware UTC datetime; Motor returns naive UTC ones unless the client is tz_aware."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+class Database:
+    def __init__(
+        self,
+        url: str,
+        name: str,
+        client_factory: Optional[Callable[[], Any]] = None,
+        warmup_connections: int = 0,
+        **client_options: Any,
+    ):
+        self.url = url
+        self.name = name
+        self.client_factory = client_factory
+        self.warmup_connections = warmup_connections
+        self.client_options = client_options
+        self.client = None
+        self.db = None
+        self.last_ping_seconds: Optional[float] = None
+
+    def connect(self):
+        if self.client is None:
+            if self.client_factory is not None:
+                self.client = self.client_factory()
+            else:
+                self.client = AsyncIOMotorClient(self.url, **self.client_options)
+            self.db = self.client[self.name]
+        return self.db
+
+    async def ping(self) -> float:
+        """Round-trip time of a ``ping`` command, in seconds."""
+        started = time.perf_counter()
+        await self.client.admin.command("ping")
+        self.last_ping_seconds = time.perf_counter() - started
+        return self.last_ping_seconds
+
+    async def warmup(self):
+        """Open ``warmup_connections`` pool connections before serving traffic.
+
+        Concurrent pings each need their own connection, so the pool grows
+        to that size now instead of during the first burst of requests.
+        """
+        try:
+            await self.ping()
+            if self.warmup_connections > 1:
+                await asyncio.gather(*(self.ping() for _ in range(self.warmup_connections)))
+        except NotImplementedError:
+            # Client stand-ins without admin commands have nothing to warm
+            return
+        logger.info(
+            "Mongo pool warmed with %d connections (ping %.1f ms)",
+            self.warmup_connections, self.last_ping_seconds * 1000,
+        )
+
+    async def check(self, timeout: float) -> Dict[str, Any]:
+        """Health summary: ``ok`` and the ping latency, or the error."""
+        try:
+            latency = await asyncio.wait_for(self.ping(), timeout)
+        except asyncio.TimeoutError:
+            return {"ok": False, "error": f"ping timed out after {timeout}s"}
+        except (PyMongoError, NotImplementedError) as exc:
+            return {"ok": False, "error": str(exc)}
+        return {"ok": True, "latency_ms": round(latency * 1000, 3)}
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connected": self.client is not None,
+            "max_pool_size": self.client_options.get("maxPoolSize"),
+            "min_pool_size": self.client_options.get("minPoolSize"),
+            "last_ping_ms": None if self.last_ping_seconds is None else self.last_ping_seconds * 1000,
+        }
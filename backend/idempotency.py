@@ -0,0 +1,181 @@
+"""Idempotency keys for retried mutations.
+
+A client that retries a request with the same ``Idempotency-Key`` gets the
+response of the first attempt instead of running the handler again. Each
+key has one record in a TTL-indexed collection. The first attempt inserts
+it as ``in_progress`` with a lease and stores the response on completion.
+A retry that finds a completed record replays it. A retry that finds the
+first attempt still running waits for it: in the same process it awaits
+the running call directly, across processes it polls the record.
+
+A key is bound to a fingerprint of its request. Reusing it for a different
+request raises ``IdempotencyKeyReused`` rather than replaying an unrelated
+response. The store alone decides what is retryable: handlers that raise,
+or answer with a 5xx, release the key so the client's next retry runs them
+again; any other status is stored and replayed. If a process dies mid-request,
+the record's lease runs out and the next retry takes the key over.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from database import as_utc
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# (status code, JSON body)
+StoredResponse = Tuple[int, bytes]
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with different parameters."""
+
+
+class IdempotencyInProgress(Exception):
+    """Another process is still running the first request for this key."""
+
+
+def fingerprint(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class IdempotencyStore:
+    """Runs each (scope, key) once and stores its response for replay."""
+
+    def __init__(
+        self,
+        collection,
+        lease_seconds: float = 60.0,
+        wait_seconds: float = 10.0,
+        poll_interval: float = 0.05,
+    ):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        # Retries of a request still running here share its call; a different request
+        # under the same key gets its own and finds the record's fingerprint
+        self._inflight = SingleFlight()
+        self.executed = 0
+        self.replayed = 0
+        self.waited = 0
+        self.taken_over = 0
+        self.released = 0
+        self.reused = 0
+        self.conflicts = 0
+
+    async def run(
+        self, scope: str, key: str, request_fingerprint: str, execute: Callable[[], Awaitable[StoredResponse]]
+    ) -> Tuple[int, bytes, bool]:
+        """Return ``(status_code, body, replayed)`` for the first request made with ``key`` in ``scope``."""
+        record_id = f"{scope}:{key}"
+        ran = False
+
+        async def first() -> Tuple[int, bytes, bool]:
+            nonlocal ran
+            ran = True
+            return await self._run(record_id, request_fingerprint, execute)
+
+        status_code, body, replayed = await self._inflight.do((record_id, request_fingerprint), first)
+        # Only the call that ran ``first`` answers with a fresh response
+        return status_code, body, replayed or not ran
+
+    async def _run(
+        self, record_id: str, request_fingerprint: str, execute: Callable[[], Awaitable[StoredResponse]]
+    ) -> Tuple[int, bytes, bool]:
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                await self.collection.insert_one({
+                    "_id": record_id,
+                    "fingerprint": request_fingerprint,
+                    "status": "in_progress",
+                    "token": token,
+                    "locked_until": now + timedelta(seconds=self.lease_seconds),
+                    "created_at": now,
+                })
+                break
+            except DuplicateKeyError:
+                pass
+            record = await self.collection.find_one({"_id": record_id})
+            if record is None:
+                # Expired or released between the insert and the read
+                continue
+            if record["fingerprint"] != request_fingerprint:
+                self.reused += 1
+                raise IdempotencyKeyReused(record_id)
+            if record["status"] == "completed":
+                self.replayed += 1
+                return record["status_code"], record["body"], True
+            if as_utc(record["locked_until"]) <= now:
+                taken = await self.collection.find_one_and_update(
+                    {"_id": record_id, "token": record["token"]},
+                    {"$set": {"token": token, "locked_until": now + timedelta(seconds=self.lease_seconds)}},
+                )
+                if taken is not None:
+                    self.taken_over += 1
+                    logger.warning("Idempotency key %s outlived its lease; running it again", record_id)
+                    break
+                continue
+            if time.monotonic() >= deadline:
+                self.conflicts += 1
+                raise IdempotencyInProgress(record_id)
+            self.waited += 1
+            await asyncio.sleep(self.poll_interval)
+
+        self.executed += 1
+        try:
+            status_code, body = await execute()
+        except BaseException:
+            await self._release(record_id, token)
+            raise
+        if status_code >= 500:
+            await self._release(record_id, token)
+            return status_code, body, False
+        try:
+            await self.collection.update_one(
+                {"_id": record_id, "token": token},
+                {"$set": {
+                    "status": "completed",
+                    "status_code": status_code,
+                    "body": body,
+                    "completed_at": datetime.now(timezone.utc),
+                }, "$unset": {"locked_until": ""}},
+            )
+        except PyMongoError:
+            # The work is done; answer it, and let the lease decide what a retry does
+            logger.exception("Could not store the response for idempotency key %s", record_id)
+        return status_code, body, False
+
+    async def _release(self, record_id: str, token: str):
+        self.released += 1
+        try:
+            await self.collection.delete_one({"_id": record_id, "token": token})
+        except Exception:
+            # The lease still lets a later retry take the key over
+            logger.exception("Could not release idempotency key %s", record_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "collapsed": self._inflight.stats()["coalesced"],
+            "waited": self.waited,
+            "taken_over": self.taken_over,
+            "released": self.released,
+            "reused": self.reused,
+            "conflicts": self.conflicts,
+            "in_flight": self._inflight.stats()["in_flight"],
+        }
+
@@ -0,0 +1,123 @@
+"""Readiness and graceful drain.
+
+``Lifecycle`` tracks whether the app has finished starting, whether it is
+shutting down and how many requests are in flight. Its middleware counts
+requests and, once draining has begun, turns new ones away with 503 and
+``Connection: close`` so load balancers retry them on another instance,
+while the requests already running are allowed to finish.
+
+uvicorn stops accepting connections as soon as it receives SIGTERM and only
+then runs the app's shutdown, so a drain started there is never seen by a
+load balancer. ``drain_on_sigterm`` starts draining on SIGTERM itself and
+hands the signal on after a grace period, long enough for the instance to
+be taken out of rotation.
+"""
+import asyncio
+import logging
+import signal
+import time
+from typing import Any, Callable, Dict, FrozenSet, Optional
+
+logger = logging.getLogger(__name__)
+
+DRAINING_BODY = b'{"detail":"Server is shutting down"}'
+
+
+class Lifecycle:
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._hand_off: Optional[asyncio.TimerHandle] = None
+
+    def request_started(self):
+        self.in_flight += 1
+        self._idle.clear()
+
+    def request_finished(self):
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self._idle.set()
+
+    def begin_drain(self):
+        self.ready = False
+        self.draining = True
+
+    def drain_on_sigterm(self, grace_seconds: float, hand_off: Optional[Callable[[], None]] = None) -> bool:
+        """On SIGTERM, start draining and call ``hand_off`` ``grace_seconds`` later.
+
+        The default ``hand_off`` raises SIGINT, which uvicorn handles as the
+        same graceful shutdown it would have started on SIGTERM. A second
+        SIGTERM hands off at once. Returns False where the handler cannot be
+        installed (outside the main thread, or on Windows).
+        """
+        loop = asyncio.get_running_loop()
+
+        def shut_down():
+            if self._hand_off is not None:
+                self._hand_off.cancel()
+                self._hand_off = None
+            (hand_off or (lambda: signal.raise_signal(signal.SIGINT)))()
+
+        def on_sigterm():
+            if self.draining:
+                shut_down()
+                return
+            logger.info("SIGTERM received; draining for %.1fs before shutting down", grace_seconds)
+            self.begin_drain()
+            self._hand_off = loop.call_later(grace_seconds, shut_down)
+
+        try:
+            loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        except (NotImplementedError, RuntimeError, ValueError):
+            logger.warning("Cannot handle SIGTERM here; draining starts only at shutdown")
+            return False
+        return True
+
+    async def drain(self, timeout: float) -> bool:
+        """Stop admitting requests and wait for in-flight ones; False on timeout."""
+        self.begin_drain()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown drain timed out with %d requests in flight", self.in_flight)
+            return False
+        logger.info("Drained in-flight requests in %.2fs", time.perf_counter() - started)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "draining": self.draining, "in_flight": self.in_flight}
+
+
+class LifecycleMiddleware:
+    def __init__(self, app, lifecycle: Lifecycle, exempt_paths: FrozenSet[str] = frozenset()):
+        self.app = app
+        self.lifecycle = lifecycle
+        # Probes and metrics keep answering while draining
+        self.exempt_paths = exempt_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        if self.lifecycle.draining:
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(DRAINING_BODY)).encode()),
+                    (b"connection", b"close"),
+                    (b"retry-after", b"1"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": DRAINING_BODY})
+            return
+        self.lifecycle.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.lifecycle.request_finished()
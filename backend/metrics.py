@@ -0,0 +1,336 @@
+"""Minimal Prometheus-style metrics: counters, gauges, histograms.
+
+Only what the server needs, with the text exposition format served from
+``/metrics``. Every metric takes a lock per update because the Mongo
+command listener reports from pymongo's worker threads.
+
+Also here: an ASGI middleware recording per-route request counts and
+latencies, pymongo listeners timing queries per collection and command and
+connection pool check-outs, and a task that measures event-loop lag.
+"""
+import asyncio
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            items = sorted(
+                (labels, [list(series[0]), series[1], series[2]]) for labels, series in self._series.items()
+            )
+        lines = self.header()
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Count and time HTTP requests per route template (not raw path)."""
+
+    def __init__(self, app, requests: Counter, latency: Histogram, in_flight: Optional[Gauge] = None):
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.in_flight = in_flight
+        self._active = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self._active += 1
+        if self.in_flight is not None:
+            self.in_flight.set(self._active)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self._active -= 1
+            if self.in_flight is not None:
+                self.in_flight.set(self._active)
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners cannot blow up cardinality;
+            # requests rejected before routing (rate limits) get their own
+            path = getattr(route, "path", None) or ("rate_limited" if status_code == 429 else "unmatched")
+            method = scope["method"]
+            self.requests.inc(method, path, str(status_code))
+            self.latency.observe(time.perf_counter() - started, method, path)
+
+
+# Commands that are connection housekeeping rather than application queries
+_IGNORED_COMMANDS = frozenset(
+    {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"}
+)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Count and time Mongo commands per collection and command name."""
+
+    def __init__(self, commands: Counter, latency: Histogram):
+        self.commands = commands
+        self.latency = latency
+        self._pending: Dict[Tuple[int, object], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        name = "collection" if event.command_name == "getMore" else event.command_name
+        target = event.command.get(name)
+        collection = target if isinstance(target, str) else ""
+        with self._lock:
+            self._pending[(event.request_id, event.connection_id)] = (collection, event.command_name)
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            labels = self._pending.pop((event.request_id, event.connection_id), None)
+        if labels is None:
+            return
+        self.commands.inc(labels[0], labels[1], outcome)
+        self.latency.observe(event.duration_micros / 1_000_000, *labels)
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+
+class ConnectionPoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection counts and how long operations wait to check a connection out.
+
+    Check-out happens synchronously on the pymongo thread running the
+    operation, so the start and end events are paired by thread.
+    """
+
+    def __init__(self, wait: Histogram, connections: Gauge, failures: Counter):
+        self.wait = wait
+        self.connections = connections
+        self.failures = failures
+        self._started: Dict[int, float] = {}
+        self._open = 0
+        self._checked_out = 0
+        self._lock = threading.Lock()
+
+    def _set_gauges(self):
+        self.connections.set(self._open, "open")
+        self.connections.set(self._checked_out, "checked_out")
+
+    def connection_check_out_started(self, event):
+        self._started[threading.get_ident()] = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = self._started.pop(threading.get_ident(), None)
+        if started is not None:
+            self.wait.observe(time.perf_counter() - started)
+        with self._lock:
+            self._checked_out += 1
+            self._set_gauges()
+
+    def connection_check_out_failed(self, event):
+        started = self._started.pop(threading.get_ident(), None)
+        if started is not None:
+            self.wait.observe(time.perf_counter() - started)
+        self.failures.inc(str(event.reason))
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._checked_out = max(0, self._checked_out - 1)
+            self._set_gauges()
+
+    def connection_created(self, event):
+        with self._lock:
+            self._open += 1
+            self._set_gauges()
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._open = max(0, self._open - 1)
+            self._set_gauges()
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+class EventLoopLagMonitor:
+    """Measure how late a periodic sleep wakes up, i.e. event-loop blocking."""
+
+    def __init__(self, gauge: Gauge, histogram: Optional[Histogram] = None, interval: float = 0.5):
+        self.gauge = gauge
+        self.histogram = histogram
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="event-loop-lag")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.gauge.set(lag)
+            if self.histogram is not None:
+                self.histogram.observe(lag)
+
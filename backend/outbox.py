@@ -0,0 +1,283 @@
+"""Transactional outbox for work that follows an order.
+
+Checkout writes one ``order_events`` document alongside the order, in the
+same transaction (or the same compensated step without one), and returns.
+Side effects such as confirmation emails, inventory sync or analytics are
+handlers registered here and run by ``Outbox``'s worker, so checkout
+latency does not grow with the number of consumers.
+
+The worker claims a batch of due events by stamping them with a lease,
+runs every handler for each event's type and marks the event ``done``. A
+failing handler puts the event back with exponential backoff; handlers that
+already succeeded are recorded and skipped on retry. After ``max_attempts``
+the event is parked as ``failed`` until ``requeue_failed`` is called.
+
+Delivery is at least once: a worker that dies mid-batch, or outlives its
+lease, leaves events to be claimed again, so handlers must be idempotent.
+Several workers (in the API processes or ``python outbox.py``) can share
+the collection; the lease keeps them from processing an event concurrently.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from database import as_utc
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class Outbox:
+    def __init__(
+        self,
+        collection,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+        lease_seconds: float = 120.0,
+        handler_timeout: float = 30.0,
+        max_attempts: int = 10,
+        retry_base_seconds: float = 1.0,
+        retry_max_seconds: float = 600.0,
+        backlog_interval: float = 5.0,
+        lag=None,
+        events=None,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.handler_timeout = handler_timeout
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.backlog_interval = backlog_interval
+        # Optional metrics: delivery lag histogram and events counter by type and outcome
+        self.lag = lag
+        self.events = events
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers: Dict[str, List[Tuple[str, Handler]]] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+        self.batches = 0
+        self.pending: Optional[int] = None
+        self.oldest_pending_seconds: Optional[float] = None
+        self.last_lag_seconds: Optional[float] = None
+
+    def register(self, event_type: str, handler: Handler, name: Optional[str] = None):
+        """Run ``handler(event)`` for every event of ``event_type``; ``name`` must be stable."""
+        name = name or f"{handler.__module__}.{handler.__qualname__}"
+        handlers = self.handlers.setdefault(event_type, [])
+        if all(existing != name for existing, _ in handlers):
+            handlers.append((name, handler))
+
+    def handler(self, event_type: str, name: Optional[str] = None):
+        def decorator(handler: Handler) -> Handler:
+            self.register(event_type, handler, name)
+            return handler
+        return decorator
+
+    @staticmethod
+    def event(event_type: str, aggregate_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """A new event document, to be inserted next to the write it describes."""
+        now = datetime.now(timezone.utc)
+        return {
+            "_id": str(uuid.uuid4()),
+            "type": event_type,
+            "aggregate_id": aggregate_id,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "handled": [],
+            "created_at": now,
+            "available_at": now,
+        }
+
+    def notify(self):
+        """Wake the local worker now instead of at the next poll."""
+        self._wake.set()
+
+    def _claimable(self, now: datetime) -> Dict[str, Any]:
+        return {
+            "status": "pending",
+            "available_at": {"$lte": now},
+            "$or": [{"locked_until": None}, {"locked_until": {"$lte": now}}],
+        }
+
+    async def claim(self) -> Tuple[str, List[Dict[str, Any]]]:
+        """Lease up to ``batch_size`` due events; returns the lease token and the events."""
+        now = datetime.now(timezone.utc)
+        candidates = self.collection.find(self._claimable(now), {"_id": 1}).sort("available_at", ASCENDING)
+        ids = [document["_id"] async for document in candidates.limit(self.batch_size)]
+        if not ids:
+            return "", []
+        token = f"{self.worker_id}:{uuid.uuid4().hex}"
+        # Re-checked on update, so events another worker leased meanwhile are skipped
+        await self.collection.update_many(
+            {"_id": {"$in": ids}, **self._claimable(now)},
+            {"$set": {"locked_by": token, "locked_until": now + timedelta(seconds=self.lease_seconds)}},
+        )
+        claimed = await self.collection.find({"_id": {"$in": ids}, "locked_by": token}).to_list(None)
+        claimed.sort(key=lambda event: event["available_at"])
+        return token, claimed
+
+    async def _deliver(self, event: Dict[str, Any]) -> Tuple[List[str], Optional[str]]:
+        """Run the handlers not yet recorded as done; returns those that succeeded and the first error."""
+        succeeded = []
+        for name, handler in self.handlers.get(event["type"], ()):
+            if name in event.get("handled", ()):
+                continue
+            try:
+                await asyncio.wait_for(handler(event), self.handler_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Outbox handler %s failed for event %s: %r", name, event["_id"], exc)
+                return succeeded, f"{name}: {exc!r}"
+            succeeded.append(name)
+        return succeeded, None
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (attempts - 1))
+
+    async def run_once(self) -> int:
+        """Claim and process one batch; returns how many events were claimed."""
+        token, batch = await self.claim()
+        if not batch:
+            return 0
+        self.batches += 1
+        results = await asyncio.gather(*(self._deliver(event) for event in batch))
+        now = datetime.now(timezone.utc)
+        delivered = [event for event, (_, error) in zip(batch, results) if error is None]
+        if delivered:
+            await self.collection.update_many(
+                {"_id": {"$in": [event["_id"] for event in delivered]}, "locked_by": token},
+                {"$set": {"status": "done", "processed_at": now, "locked_until": None}},
+            )
+        for event in delivered:
+            lag = (now - as_utc(event["created_at"])).total_seconds()
+            self.last_lag_seconds = lag
+            self.delivered += 1
+            if self.lag is not None:
+                self.lag.observe(lag)
+            if self.events is not None:
+                self.events.inc(event["type"], "delivered")
+        for event, (succeeded, error) in zip(batch, results):
+            if error is None:
+                continue
+            attempts = event.get("attempts", 0) + 1
+            dead = attempts >= self.max_attempts
+            await self.collection.update_one(
+                {"_id": event["_id"], "locked_by": token},
+                {
+                    "$set": {
+                        "status": "failed" if dead else "pending",
+                        "attempts": attempts,
+                        "available_at": now + timedelta(seconds=self.backoff(attempts)),
+                        "last_error": error[:1000],
+                        "locked_until": None,
+                    },
+                    "$addToSet": {"handled": {"$each": succeeded}},
+                },
+            )
+            if dead:
+                self.dead += 1
+                logger.error("Outbox event %s (%s) failed %d times; parked", event["_id"], event["type"], attempts)
+            else:
+                self.retried += 1
+            if self.events is not None:
+                self.events.inc(event["type"], "dead" if dead else "retried")
+        return len(batch)
+
+    async def measure_backlog(self):
+        """Refresh the pending count and the age of the oldest pending event."""
+        self.pending = await self.collection.count_documents({"status": "pending"})
+        oldest = await self.collection.find_one(
+            {"status": "pending"}, {"created_at": 1}, sort=[("available_at", ASCENDING)]
+        )
+        self.oldest_pending_seconds = (
+            (datetime.now(timezone.utc) - as_utc(oldest["created_at"])).total_seconds() if oldest else 0.0
+        )
+
+    async def requeue_failed(self) -> int:
+        """Give parked events another ``max_attempts`` tries."""
+        result = await self.collection.update_many(
+            {"status": "failed"},
+            {"$set": {"status": "pending", "attempts": 0, "available_at": datetime.now(timezone.utc)}},
+        )
+        if result.modified_count:
+            self.notify()
+        return result.modified_count
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="outbox-worker")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        measured = 0.0
+        while True:
+            # Cleared before claiming, so a notify() during the batch triggers another pass
+            self._wake.clear()
+            claimed = 0
+            try:
+                claimed = await self.run_once()
+                if time.monotonic() - measured >= self.backlog_interval:
+                    measured = time.monotonic()
+                    await self.measure_backlog()
+            except PyMongoError:
+                logger.exception("Outbox worker iteration failed")
+            if claimed >= self.batch_size:
+                # More may be waiting; go again without sleeping
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "handlers": sum(len(handlers) for handlers in self.handlers.values()),
+            "batches": self.batches,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead": self.dead,
+            "pending": self.pending,
+            "oldest_pending_seconds": self.oldest_pending_seconds,
+            "last_lag_seconds": self.last_lag_seconds,
+        }
+
+
+def main():
+    """Run only the outbox worker, e.g. next to API workers started with OUTBOX_WORKER_ENABLED=false."""
+    import server
+
+    async def start():
+        server.app.state.index_report = await server.ensure_indexes()
+        server.outbox.start()
+
+    server.run_standalone(f"Outbox worker {server.outbox.worker_id}", start, server.outbox.stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Token-bucket rate limiting as ASGI middleware.
+
+A request is matched against an ordered list of rules (method + path
+prefix); the first match decides the bucket it draws from. Buckets are
+keyed by rule and by either the client address or the authenticated
+subject. Each bucket holds up to ``burst`` tokens and refills at ``rate``
+tokens per second; a request takes one token or is answered with 429 and
+a ``Retry-After`` header before it reaches routing, dependencies or the
+database.
+
+Buckets normally live in process memory, which limits each worker on its
+own. ``MongoBucketStore`` keeps them in a shared collection instead, so
+the quota holds across workers at the cost of one round-trip per limited
+request; if Mongo is unavailable it falls back to the local buckets rather
+than failing requests.
+"""
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+TOO_MANY_REQUESTS_BODY = b'{"detail":"Too many requests"}'
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    """``burst`` requests at once, then ``rate`` per second, per key."""
+
+    name: str
+    path_prefix: str
+    rate: float
+    burst: int
+    key: str = "ip"  # "ip" or "user"; "user" falls back to "ip" for anonymous requests
+    methods: Optional[FrozenSet[str]] = None
+
+    def matches(self, method: str, path: str) -> bool:
+        return path.startswith(self.path_prefix) and (self.methods is None or method in self.methods)
+
+
+def refill(tokens: float, updated: float, now: float, rule: RateLimitRule) -> float:
+    return min(float(rule.burst), tokens + max(0.0, now - updated) * rule.rate)
+
+
+def retry_after(tokens: float, rule: RateLimitRule) -> float:
+    """Seconds until the bucket holds a whole token again."""
+    return (1 - tokens) / rule.rate if rule.rate > 0 else math.inf
+
+
+class MemoryBucketStore:
+    """Buckets in a bounded LRU dict; evicting a bucket resets it to full."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take_now(self, key: str, rule: RateLimitRule, now: float) -> Tuple[bool, float]:
+        tokens, updated = self._buckets.get(key, (float(rule.burst), now))
+        tokens = refill(tokens, updated, now, rule)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else retry_after(tokens, rule)
+
+    async def take(self, key: str, rule: RateLimitRule, now: float) -> Tuple[bool, float]:
+        return self.take_now(key, rule, now)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "buckets": len(self._buckets)}
+
+
+class MongoBucketStore:
+    """Buckets shared through a collection, updated atomically server-side.
+
+    Each bucket is one document ``{_id, tokens, updated, expires_at}``; the
+    refill-and-take is a single pipeline update, so concurrent workers
+    cannot both spend the last token. ``expires_at`` is for a TTL index that
+    drops buckets once they would be full again anyway.
+    """
+
+    def __init__(self, collection, fallback: Optional[MemoryBucketStore] = None):
+        self.collection = collection
+        self.fallback = fallback or MemoryBucketStore()
+        self.fallbacks = 0
+
+    async def take(self, key: str, rule: RateLimitRule, now: float) -> Tuple[bool, float]:
+        refilled = {"$min": [
+            float(rule.burst),
+            {"$add": [
+                {"$ifNull": ["$tokens", float(rule.burst)]},
+                {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]}, rule.rate]},
+            ]},
+        ]}
+        full_after = rule.burst / rule.rate if rule.rate > 0 else 86400
+        pipeline = [
+            {"$set": {"tokens": refilled, "updated": now}},
+            {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+            {"$set": {
+                "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                "expires_at": datetime.fromtimestamp(now, timezone.utc) + timedelta(seconds=full_after),
+            }},
+        ]
+        try:
+            bucket = await self.collection.find_one_and_update(
+                {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError:
+            # Includes servers too old for pipeline updates (before 4.2); anything else is a bug
+            if not self.fallbacks:
+                logger.exception("Shared rate-limit store unavailable; limiting per process")
+            self.fallbacks += 1
+            return self.fallback.take_now(key, rule, now)
+        allowed = bool(bucket["allowed"])
+        return allowed, 0.0 if allowed else retry_after(bucket["tokens"], rule)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "mongo", "fallbacks": self.fallbacks, "fallback_buckets": len(self.fallback)}
+
+
+def client_address(scope, proxy_hops: int = 0) -> str:
+    """The client IP, taken from ``X-Forwarded-For`` when behind ``proxy_hops`` proxies.
+
+    Only the entry appended by the outermost trusted proxy is used; anything
+    to its left was supplied by the client and can be forged.
+    """
+    if proxy_hops > 0:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                hops = [hop.strip() for hop in value.decode("latin-1").split(",") if hop.strip()]
+                if hops:
+                    return hops[-min(proxy_hops, len(hops))]
+                break
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def bearer_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" and token.strip() else None
+    return None
+
+
+class RateLimiter:
+    """Rules plus a bucket store; ``check`` decides one request."""
+
+    def __init__(
+        self,
+        rules: Sequence[RateLimitRule],
+        store=None,
+        subject: Optional[Callable[[str], Optional[str]]] = None,
+        proxy_hops: int = 0,
+    ):
+        self.rules: List[RateLimitRule] = list(rules)
+        self.store = store or MemoryBucketStore()
+        self.subject = subject
+        self.proxy_hops = proxy_hops
+        self.allowed: Dict[str, int] = {rule.name: 0 for rule in self.rules}
+        self.rejected: Dict[str, int] = {rule.name: 0 for rule in self.rules}
+
+    def match(self, method: str, path: str) -> Optional[RateLimitRule]:
+        for rule in self.rules:
+            if rule.matches(method, path):
+                return rule
+        return None
+
+    def bucket_key(self, rule: RateLimitRule, scope) -> str:
+        if rule.key == "user" and self.subject is not None:
+            token = bearer_token(scope)
+            subject = self.subject(token) if token else None
+            if subject is not None:
+                return f"{rule.name}:user:{subject}"
+        return f"{rule.name}:ip:{client_address(scope, self.proxy_hops)}"
+
+    async def check(self, scope) -> Tuple[bool, float]:
+        """``(allowed, retry_after_seconds)`` for an HTTP request scope."""
+        rule = self.match(scope["method"], scope["path"])
+        if rule is None:
+            return True, 0.0
+        allowed, wait = await self.store.take(self.bucket_key(rule, scope), rule, time.time())
+        if allowed:
+            self.allowed[rule.name] += 1
+        else:
+            self.rejected[rule.name] += 1
+        return allowed, wait
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "store": self.store.stats(),
+            "allowed": dict(self.allowed),
+            "rejected": dict(self.rejected),
+        }
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        allowed, wait = await self.limiter.check(scope)
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(TOO_MANY_REQUESTS_BODY)).encode()),
+                (b"retry-after", str(max(1, math.ceil(min(wait, 86400)))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": TOO_MANY_REQUESTS_BODY})
+
+
+def apply_overrides(rules: Sequence[RateLimitRule], spec: str) -> List[RateLimitRule]:
+    """Override quotas with ``"name=rate/burst,..."``, e.g. ``"auth_login=0.5/20"``."""
+    overrides = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, separator, quota = entry.partition("=")
+        rate, slash, burst = quota.partition("/")
+        try:
+            if not separator or not slash:
+                raise ValueError
+            overrides[name.strip()] = (float(rate), int(burst))
+        except ValueError:
+            raise ValueError(f"Malformed rate limit entry: {entry!r}") from None
+    unknown = set(overrides) - {rule.name for rule in rules}
+    if unknown:
+        raise ValueError(f"Unknown rate limit rules: {', '.join(sorted(unknown))}")
+    return [
+        RateLimitRule(rule.name, rule.path_prefix, *overrides[rule.name], key=rule.key, methods=rule.methods)
+        if rule.name in overrides else rule
+        for rule in rules
+    ]
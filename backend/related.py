@@ -0,0 +1,395 @@
+"""Related products from vectorized product similarity.
+
+Every product becomes three feature blocks: a TF-IDF vector over its name,
+description and specification values (same tokenizer and field weights as
+search), its category and a logarithmic price bucket. Similarity is a
+weighted sum of the blocks' cosines::
+
+    text_weight * cos(tfidf_a, tfidf_b)
+    + category_weight * (category_a == category_b)
+    + price_weight * (1 if same price bucket, 0.5 if adjacent, else 0)
+
+The TF-IDF rows are stored column-wise like a CSC matrix (``indptr`` into
+flat ``rows``/``values`` arrays per term), so scoring one product against
+the whole catalog only touches the postings of that product's terms, one
+vectorized scatter-add per term. Terms found in more than ``max_df`` of the
+products (e.g. "robot") say little about similarity and are left out, which
+also keeps the longest postings lists out of every query. Category and
+price are dense per-row arrays.
+
+Products changed since the last build live in a small delta (a dict
+inverted index) and are scored from there instead; once the delta grows
+past ``compact_ratio`` of the catalog the arrays are rebuilt from the
+per-product term frequencies, which also refreshes the IDF weights.
+Changes that do not touch the features (stock, featured flag, image)
+are ignored. Answers are memoized per product until the index changes,
+since shoppers keep landing on the same popular products.
+
+As with search, ``export`` and ``mapped`` let worker processes share one
+index's arrays through a catalog snapshot instead of each building its own.
+"""
+import hashlib
+import json
+import logging
+import math
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from search import product_terms
+
+logger = logging.getLogger(__name__)
+
+FEATURE_FIELDS = ("name", "description", "specifications", "category", "price")
+
+# Score of a price bucket distance of 0, 1, and anything further
+PRICE_KERNEL = np.array([1.0, 0.5, 0.0], dtype=np.float32)
+
+
+def feature_fingerprint(product: Dict[str, Any]) -> bytes:
+    raw = json.dumps([product.get(field) for field in FEATURE_FIELDS], sort_keys=True, default=str).encode()
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+class RelatedProductsIndex:
+    """Top-k similar products by id; rows are rebuilt in bulk or patched per product."""
+
+    def __init__(
+        self,
+        text_weight: float = 0.6,
+        category_weight: float = 0.25,
+        price_weight: float = 0.15,
+        price_buckets_per_decade: int = 4,
+        max_df: float = 0.5,
+        compact_ratio: float = 0.05,
+        min_compact_rows: int = 256,
+        cache_size: int = 4096,
+    ):
+        self.text_weight = text_weight
+        self.category_weight = category_weight
+        self.price_weight = price_weight
+        self.price_buckets_per_decade = price_buckets_per_decade
+        self.max_df = max_df
+        self.compact_ratio = compact_ratio
+        self.min_compact_rows = min_compact_rows
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, int], List[Tuple[str, float]]]" = OrderedDict()
+        self._cache_version = -1
+        self.cache_hits = 0
+        self.version = 0
+        self.builds = 0
+        self.patches = 0
+        # Mapped indexes serve views they do not own
+        self.read_only = False
+        self.clear()
+
+    def clear(self):
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._fingerprints: Dict[str, bytes] = {}
+        self._terms: Dict[str, int] = {}
+        self._categories: Dict[Any, int] = {}
+        # Per row: term ids and sublinear term frequencies, the source of every rebuild
+        self._row_terms: List[Optional[Tuple[np.ndarray, np.ndarray]]] = []
+        self._category_codes = np.zeros(0, dtype=np.int32)
+        self._price_buckets = np.zeros(0, dtype=np.int32)
+        self._live = np.zeros(0, dtype=bool)
+        self._df = np.zeros(0, dtype=np.int64)
+        self._idf = np.zeros(0, dtype=np.float32)
+        # Column-major TF-IDF postings as of the last build
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._posting_rows = np.zeros(0, dtype=np.int32)
+        self._posting_values = np.zeros(0, dtype=np.float32)
+        # Rows added or changed since the last build: term id -> {row: weight}
+        self._delta: Dict[int, Dict[int, float]] = {}
+        self._dirty: Set[int] = set()
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # Features
+
+    def _price_bucket(self, price: Any) -> int:
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            return -1000
+        return int(math.floor(math.log10(max(price, 0.01)) * self.price_buckets_per_decade))
+
+    def _extract(self, product: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, int, int]:
+        terms = product_terms(product)
+        term_ids = np.fromiter(
+            (self._terms.setdefault(term, len(self._terms)) for term in terms), dtype=np.int32, count=len(terms)
+        )
+        tf = np.fromiter((1.0 + math.log(count) for count in terms.values()), dtype=np.float32, count=len(terms))
+        category = self._categories.setdefault(product.get("category"), len(self._categories))
+        return term_ids, tf, category, self._price_bucket(product.get("price"))
+
+    def _vector(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Unit-length TF-IDF weights of ``row`` under the current IDF."""
+        term_ids, tf = self._row_terms[row]
+        values = tf * self._idf[term_ids]
+        norm = float(np.sqrt(np.dot(values, values)))
+        return term_ids, values / norm if norm else values
+
+    # Building
+
+    def build(self, products: Iterable[Dict[str, Any]]):
+        """Index ``products`` from scratch."""
+        self.clear()
+        extracted = []
+        for product in products:
+            if product["id"] in self._rows:
+                continue
+            self._rows[product["id"]] = len(self._ids)
+            self._ids.append(product["id"])
+            self._fingerprints[product["id"]] = feature_fingerprint(product)
+            extracted.append(self._extract(product))
+        self._row_terms = [(term_ids, tf) for term_ids, tf, _, _ in extracted]
+        self._category_codes = np.fromiter((item[2] for item in extracted), dtype=np.int32, count=len(extracted))
+        self._price_buckets = np.fromiter((item[3] for item in extracted), dtype=np.int32, count=len(extracted))
+        self._live = np.ones(len(extracted), dtype=bool)
+        self._compact()
+
+    def _compact(self):
+        """Rebuild the postings from live rows, renumbering them and refreshing the IDF."""
+        live = np.flatnonzero(self._live)
+        self._ids = [self._ids[row] for row in live]
+        self._rows = {product_id: row for row, product_id in enumerate(self._ids)}
+        self._row_terms = [self._row_terms[row] for row in live]
+        self._category_codes = self._category_codes[live]
+        self._price_buckets = self._price_buckets[live]
+        self._live = np.ones(len(live), dtype=bool)
+        self._delta = {}
+        self._dirty = set()
+        self._dead = 0
+
+        row_count, vocabulary = len(self._ids), len(self._terms)
+        lengths = np.fromiter((len(term_ids) for term_ids, _ in self._row_terms), dtype=np.int64, count=row_count)
+        if row_count:
+            term_ids = np.concatenate([term_ids for term_ids, _ in self._row_terms])
+            tf = np.concatenate([tf for _, tf in self._row_terms])
+        else:
+            term_ids, tf = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        rows = np.repeat(np.arange(row_count, dtype=np.int32), lengths)
+
+        self._df = np.bincount(term_ids, minlength=vocabulary)
+        # Smoothed IDF, as in scikit-learn; zero for terms too common to matter
+        self._idf = (np.log((1 + row_count) / (1 + self._df)) + 1).astype(np.float32)
+        self._idf[self._df > max(self.max_df * row_count, 10)] = 0
+        values = tf * self._idf[term_ids]
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=row_count)).astype(np.float32)
+        norms[norms == 0] = 1
+        values /= norms[rows]
+
+        kept = values != 0
+        term_ids, rows, values = term_ids[kept], rows[kept], values[kept]
+        order = np.argsort(term_ids, kind="stable")
+        self._posting_rows = rows[order]
+        self._posting_values = values[order]
+        self._indptr = np.zeros(vocabulary + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=vocabulary), out=self._indptr[1:])
+        self.version += 1
+        self.builds += 1
+
+    # Incremental updates
+
+    def update(self, upserted: Iterable[Dict[str, Any]] = (), removed: Iterable[str] = ()):
+        """Apply catalog changes; products whose features did not change are skipped."""
+        if self.read_only:
+            raise RuntimeError("A mapped related-products index is read-only")
+        changed = False
+        for product_id in removed:
+            changed |= self._remove(product_id)
+        added = []
+        for product in upserted:
+            fingerprint = feature_fingerprint(product)
+            if self._fingerprints.get(product["id"]) == fingerprint:
+                continue
+            self._remove(product["id"])
+            added.append((product, fingerprint))
+        if not changed and not added:
+            return
+        self.patches += 1
+        rows = self._append(added)
+        pending = len(self._dirty) + len(rows) + self._dead
+        if not self.builds or pending > max(self.min_compact_rows, self.compact_ratio * len(self._rows)):
+            self._compact()
+            return
+        for row in rows:
+            self._dirty.add(row)
+            for term, value in zip(*(array.tolist() for array in self._vector(row))):
+                self._delta.setdefault(term, {})[row] = value
+        self.version += 1
+
+    def _remove(self, product_id: str) -> bool:
+        row = self._rows.pop(product_id, None)
+        if row is None:
+            return False
+        del self._fingerprints[product_id]
+        self._live[row] = False
+        self._dead += 1
+        if row in self._dirty:
+            self._dirty.discard(row)
+            for term in self._row_terms[row][0].tolist():
+                self._delta[term].pop(row, None)
+        return True
+
+    def _append(self, added: List[Tuple[Dict[str, Any], bytes]]) -> range:
+        """Add rows for ``added`` products (one array resize for the lot); returns their row numbers."""
+        first = len(self._ids)
+        categories, buckets = [], []
+        for product, fingerprint in added:
+            term_ids, tf, category, bucket = self._extract(product)
+            self._rows[product["id"]] = len(self._ids)
+            self._ids.append(product["id"])
+            self._fingerprints[product["id"]] = fingerprint
+            self._row_terms.append((term_ids, tf))
+            categories.append(category)
+            buckets.append(bucket)
+            # Terms first seen since the last build get an IDF from the current counts
+            known = len(self._idf)
+            if len(self._terms) > known:
+                grown = len(self._terms) - known
+                self._df = np.concatenate([self._df, np.zeros(grown, dtype=np.int64)])
+                self._idf = np.concatenate([self._idf, np.zeros(grown, dtype=np.float32)])
+            self._df[term_ids] += 1
+            fresh = term_ids[term_ids >= known]
+            self._idf[fresh] = np.log((1 + len(self._rows)) / (1 + self._df[fresh])) + 1
+        self._category_codes = np.concatenate([self._category_codes, np.array(categories, dtype=np.int32)])
+        self._price_buckets = np.concatenate([self._price_buckets, np.array(buckets, dtype=np.int32)])
+        self._live = np.concatenate([self._live, np.ones(len(added), dtype=bool)])
+        return range(first, len(self._ids))
+
+    # Sharing
+
+    def export(self, ids: List[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Query-time arrays with row ``i`` holding ``ids[i]``, and the weights that go with them.
+
+        ``ids`` must name every indexed product once; pending changes are compacted first.
+        """
+        if self._dirty or self._dead or not self.builds:
+            self._compact()
+        rows = np.fromiter((self._rows.get(product_id, -1) for product_id in ids), dtype=np.int64, count=len(ids))
+        if len(ids) != len(self._rows) or (rows < 0).any():
+            raise ValueError("ids do not match the indexed products")
+        positions = np.empty(len(rows), dtype=np.int32)
+        positions[rows] = np.arange(len(rows), dtype=np.int32)
+        row_terms = [self._row_terms[row] for row in rows.tolist()]
+        counts = np.fromiter((len(term_ids) for term_ids, _ in row_terms), dtype=np.int64, count=len(row_terms))
+        sections = {
+            "indptr": self._indptr,
+            "posting_rows": positions[self._posting_rows],
+            "posting_values": self._posting_values,
+            "idf": self._idf,
+            "category_codes": self._category_codes[rows],
+            "price_buckets": self._price_buckets[rows],
+            "row_indptr": np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            "row_term_ids": np.concatenate([term_ids for term_ids, _ in row_terms] or [np.zeros(0, dtype=np.int32)]),
+            "row_tf": np.concatenate([tf for _, tf in row_terms] or [np.zeros(0, dtype=np.float32)]),
+        }
+        weights = {
+            "text_weight": self.text_weight,
+            "category_weight": self.category_weight,
+            "price_weight": self.price_weight,
+        }
+        return sections, weights
+
+    @classmethod
+    def mapped(cls, sections: Dict[str, Any], settings: Dict[str, Any], ids, version: int) -> "RelatedProductsIndex":
+        """A read-only index over ``export``-ed arrays; ``ids`` maps rows to product ids and back with ``get``."""
+        index = cls(**settings)
+        index.read_only = True
+        index._ids = index._rows = ids
+        index._row_terms = _RowTerms(sections["row_indptr"], sections["row_term_ids"], sections["row_tf"])
+        index._idf = sections["idf"]
+        index._indptr = sections["indptr"]
+        index._posting_rows = sections["posting_rows"]
+        index._posting_values = sections["posting_values"]
+        index._category_codes = sections["category_codes"]
+        index._price_buckets = sections["price_buckets"]
+        index._live = np.ones(len(ids), dtype=bool)
+        index.version = version
+        return index
+
+    # Queries
+
+    def related(self, product_id: str, limit: int = 8) -> List[Tuple[str, float]]:
+        """``(product_id, score)`` of the ``limit`` most similar products, best first."""
+        if self._cache_version != self.version:
+            self._cache.clear()
+            self._cache_version = self.version
+        key = (product_id, limit)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached
+        row = self._rows.get(product_id)
+        if row is None:
+            return []
+        row_count = len(self._ids)
+        term_ids, weights = self._vector(row)
+
+        text = np.zeros(row_count, dtype=np.float32)
+        built = len(self._indptr) - 1
+        for term, weight in zip(term_ids.tolist(), weights.tolist()):
+            if not weight:
+                continue
+            if term < built:
+                start, end = self._indptr[term], self._indptr[term + 1]
+                # A term's postings name each row once, so fancy-index += is exact
+                text[self._posting_rows[start:end]] += self._posting_values[start:end] * weight
+            # Changed products are appended as new rows, so they have no postings to undo
+            for other, value in self._delta.get(term, {}).items():
+                text[other] += weight * value
+
+        scores = self.text_weight * text
+        scores += self.category_weight * (self._category_codes == self._category_codes[row])
+        distance = np.minimum(np.abs(self._price_buckets - self._price_buckets[row]), len(PRICE_KERNEL) - 1)
+        scores += self.price_weight * PRICE_KERNEL[distance]
+        scores[~self._live] = -np.inf
+        scores[row] = -np.inf
+
+        limit = min(limit, len(self._rows) - 1)
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.lexsort((top, -scores[top]))]
+        related = [(self._ids[other], float(scores[other])) for other in top.tolist()]
+        self._cache[key] = related
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return related
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "products": len(self._rows),
+            "terms": len(self._idf),
+            "postings": int(self._posting_rows.size),
+            "pending_rows": len(self._dirty),
+            "dead_rows": self._dead,
+            "version": self.version,
+            "builds": self.builds,
+            "patches": self.patches,
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+        }
+
+
+class _RowTerms:
+    """Per-row ``(term ids, term frequencies)`` of a mapped index, sliced from flat arrays."""
+
+    def __init__(self, indptr: np.ndarray, term_ids: np.ndarray, tf: np.ndarray):
+        self.indptr = indptr
+        self.term_ids = term_ids
+        self.tf = tf
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def __getitem__(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = int(self.indptr[row]), int(self.indptr[row + 1])
+        return self.term_ids[start:end], self.tf[start:end]
@@ -0,0 +1,524 @@
+"""In-process full-text search over the product catalog.
+
+Products are scored with BM25. Product fields are folded into one weighted
+pseudo-document (a simplified BM25F), so a term in the name counts for more
+than the same term in the description or in the specification values.
+Query and documents go through the same tokenizer and stemmer, so the
+stemmer only has to be consistent, not linguistically exact.
+
+The inverted index is stored column-wise like a CSC matrix: per term, a
+slice of ``posting_rows`` (sorted) and of ``impacts``, each posting's BM25
+contribution precomputed at build time. A query is a scatter-add of its
+terms' impacts into a dense score array. Terms are taken in order of their
+best impact (``upper``); before a long postings list is scanned the k-th
+best score so far is compared with what the remaining terms could still
+add (MaxScore). Once no unseen product can reach the top k, the long lists
+are only probed, by binary search, for the products that still can.
+
+Products changed since the last build are appended as new rows and scored
+from a small dict delta with the build's IDF and average length; once the
+delta passes ``compact_ratio`` of the catalog the arrays are rebuilt, which
+also refreshes those statistics. Changes to fields search does not read
+(stock, price, images) are skipped.
+
+``export`` hands out the query-time arrays with rows in a given product
+order and ``mapped`` serves queries from such arrays without owning them,
+so worker processes can share one index through a catalog snapshot.
+"""
+import functools
+import hashlib
+import json
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the this to with your you".split()
+)
+
+# (suffix, replacement) pairs tried longest-first; see stem()
+_SUFFIXES = (
+    ("ational", "ate"),
+    ("ization", "ize"),
+    ("fulness", "ful"),
+    ("iveness", "ive"),
+    ("ousness", "ous"),
+    ("ations", "ate"),
+    ("ation", "ate"),
+    ("ments", ""),
+    ("ment", ""),
+    ("ness", ""),
+    ("ings", ""),
+    ("ing", ""),
+    ("ies", "i"),
+    ("ied", "i"),
+    ("ers", "er"),
+    ("ed", ""),
+    ("ly", ""),
+    ("es", "e"),
+    ("s", ""),
+)
+
+_VOWEL_RE = re.compile(r"[aeiouy]")
+
+FIELD_WEIGHTS = {"name": 3.0, "description": 1.0, "specifications": 1.0}
+
+# Scores closer than this count as tied and are ordered by id
+TIE_WINDOW = 1e-7
+# Starting score of rows a filter excludes, far below anything a query adds up to
+EXCLUDED = -1e9
+
+# A binary-search probe costs about this many postings scanned
+PROBE_COST = 16
+
+# Everything the index reads from a product
+INDEXED_FIELDS = ("name", "description", "specifications", "category", "featured")
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Light suffix-stripping stemmer (a trimmed-down Porter step 1/2)."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("ss") or word.endswith("us") or word.endswith("is"):
+        return word
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix):
+            root = word[: -len(suffix)] + replacement
+            # Keep at least three letters and one vowel so "bed" or "sing"
+            # are not reduced to nothing meaningful.
+            if len(root) >= 3 and _VOWEL_RE.search(root):
+                doubled = len(root) > 3 and root[-1] == root[-2] and root[-1] not in "lsz"
+                if suffix in ("ing", "ed", "ings") and doubled:
+                    root = root[:-1]
+                return root
+            return word
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(token) for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _spec_text(specifications: Any) -> str:
+    if isinstance(specifications, dict):
+        return " ".join(_spec_text(value) for value in specifications.values())
+    if isinstance(specifications, (list, tuple)):
+        return " ".join(_spec_text(value) for value in specifications)
+    return "" if specifications is None else str(specifications)
+
+
+def product_terms(product: Dict[str, Any]) -> Counter:
+    """Weighted term frequencies for one product document."""
+    terms: Counter = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        value = product.get(field)
+        text = _spec_text(value) if field == "specifications" else (value or "")
+        for token, count in Counter(tokenize(text)).items():
+            terms[token] += count * weight
+    return terms
+
+
+def indexed_fingerprint(product: Dict[str, Any]) -> bytes:
+    raw = json.dumps([product.get(field) for field in INDEXED_FIELDS], sort_keys=True, default=str).encode()
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+class ProductSearchIndex:
+    """BM25-ranked index of products keyed by product ``id``.
+
+    ``category`` and ``featured`` are kept per row so the listing filters
+    can be applied without a database round-trip.
+    """
+
+    def __init__(
+        self,
+        k1: float = 1.2,
+        b: float = 0.75,
+        compact_ratio: float = 0.05,
+        min_compact_rows: int = 256,
+        prune_length: int = 2048,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self.min_compact_rows = min_compact_rows
+        # Postings lists at least this long are worth a MaxScore check before scanning
+        self.prune_length = prune_length
+        self.version = 0
+        self.builds = 0
+        self.patches = 0
+        self.pruned_queries = 0
+        # Mapped indexes serve views they do not own
+        self.read_only = False
+        self.clear()
+
+    def clear(self):
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._fingerprints: Dict[str, bytes] = {}
+        self._terms: Dict[str, int] = {}
+        self._categories: Dict[Any, int] = {}
+        # Per row: term ids and weighted term frequencies, the source of every rebuild
+        self._row_terms: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._category_codes = np.zeros(0, dtype=np.int32)
+        self._featured = np.zeros(0, dtype=bool)
+        self._live = np.zeros(0, dtype=bool)
+        # Id order for tie-breaking: built rows get even ranks, rows added since odd ones between them
+        self._ranks = np.zeros(0, dtype=np.int64)
+        self._rank_scale = 0.0
+        self._sorted_ids = np.zeros(0, dtype=str)
+        self._df = np.zeros(0, dtype=np.int64)
+        self._idf = np.zeros(0, dtype=np.float32)
+        self._avg_len = 1.0
+        # Column-major BM25 impacts as of the last build
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._posting_rows = np.zeros(0, dtype=np.int32)
+        self._impacts = np.zeros(0, dtype=np.float32)
+        self._upper = np.zeros(0, dtype=np.float32)
+        # Rows added or changed since the last build: term id -> {row: impact}
+        self._delta: Dict[int, Dict[int, float]] = {}
+        self._dirty: Set[int] = set()
+        self._initial: Dict[Tuple[int, Any, Any], np.ndarray] = {}
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # Building
+
+    def build(self, products: Iterable[Dict[str, Any]]):
+        """Index ``products`` from scratch."""
+        self.clear()
+        latest = {product["id"]: product for product in products}
+        self._append([(product, indexed_fingerprint(product)) for product in latest.values()])
+        self._compact()
+
+    def _impact(self, tf: np.ndarray, length: float, idf: np.ndarray) -> np.ndarray:
+        k1 = self.k1
+        norm = k1 * (1 - self.b + self.b * length / self._avg_len)
+        return idf * tf * (k1 + 1) / (tf + norm)
+
+    def _compact(self):
+        """Rebuild the postings from live rows, renumbering them and refreshing IDF and lengths."""
+        live = np.flatnonzero(self._live)
+        self._ids = [self._ids[row] for row in live]
+        self._rows = {product_id: row for row, product_id in enumerate(self._ids)}
+        self._row_terms = [self._row_terms[row] for row in live]
+        self._lengths = self._lengths[live]
+        self._category_codes = self._category_codes[live]
+        self._featured = self._featured[live]
+        self._live = np.ones(len(live), dtype=bool)
+        order = np.argsort(np.array(self._ids, dtype=str), kind="stable")
+        self._sorted_ids = np.array(self._ids, dtype=str)[order]
+        self._ranks = np.empty(len(live), dtype=np.int64)
+        self._ranks[order] = 2 * np.arange(1, len(live) + 1)
+        self._rank_scale = TIE_WINDOW / (2 * len(live) + 2)
+        self._delta = {}
+        self._dirty = set()
+        self._dead = 0
+
+        row_count, vocabulary = len(self._ids), len(self._terms)
+        counts = np.fromiter((len(term_ids) for term_ids, _ in self._row_terms), dtype=np.int64, count=row_count)
+        if row_count:
+            term_ids = np.concatenate([term_ids for term_ids, _ in self._row_terms])
+            tf = np.concatenate([tf for _, tf in self._row_terms])
+        else:
+            term_ids, tf = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        rows = np.repeat(np.arange(row_count, dtype=np.int32), counts)
+
+        self._df = np.bincount(term_ids, minlength=vocabulary)
+        self._idf = np.log(1 + (row_count - self._df + 0.5) / (self._df + 0.5)).astype(np.float32)
+        self._avg_len = float(self._lengths.mean()) if row_count and self._lengths.any() else 1.0
+        impacts = self._impact(tf, self._lengths[rows], self._idf[term_ids]).astype(np.float32)
+
+        # Stable sort by term keeps each term's rows ascending, which probing relies on
+        order = np.argsort(term_ids, kind="stable")
+        self._posting_rows = rows[order]
+        self._impacts = impacts[order]
+        self._indptr = np.zeros(vocabulary + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=vocabulary), out=self._indptr[1:])
+        self._upper = np.zeros(vocabulary, dtype=np.float32)
+        nonempty = np.flatnonzero(np.diff(self._indptr))
+        if nonempty.size:
+            self._upper[nonempty] = np.maximum.reduceat(self._impacts, self._indptr[nonempty])
+        self.version += 1
+        self.builds += 1
+
+    # Incremental updates
+
+    def add(self, product: Dict[str, Any]):
+        """Index a product, replacing any previous version with the same id."""
+        self.update([product])
+
+    def remove(self, product_id: str):
+        self.update(removed=[product_id])
+
+    def update(self, upserted: Iterable[Dict[str, Any]] = (), removed: Iterable[str] = ()):
+        """Apply catalog changes; products whose indexed fields did not change are skipped."""
+        if self.read_only:
+            raise RuntimeError("A mapped search index is read-only")
+        changed = False
+        for product_id in removed:
+            changed |= self._remove(product_id)
+        added = []
+        for product in upserted:
+            fingerprint = indexed_fingerprint(product)
+            if self._fingerprints.get(product["id"]) == fingerprint:
+                continue
+            self._remove(product["id"])
+            added.append((product, fingerprint))
+        if not changed and not added:
+            return
+        self.patches += 1
+        rows = self._append(added)
+        pending = len(self._dirty) + len(rows) + self._dead
+        if not self.builds or pending > max(self.min_compact_rows, self.compact_ratio * len(self._rows)):
+            self._compact()
+            return
+        for row in rows:
+            self._dirty.add(row)
+            term_ids, tf = self._row_terms[row]
+            impacts = self._impact(tf, float(self._lengths[row]), self._idf[term_ids])
+            for term, impact in zip(term_ids.tolist(), impacts.tolist()):
+                self._delta.setdefault(term, {})[row] = impact
+        self.version += 1
+
+    def _remove(self, product_id: str) -> bool:
+        row = self._rows.pop(product_id, None)
+        if row is None:
+            return False
+        del self._fingerprints[product_id]
+        self._live[row] = False
+        self._dead += 1
+        if row in self._dirty:
+            self._dirty.discard(row)
+            for term in self._row_terms[row][0].tolist():
+                self._delta[term].pop(row, None)
+        return True
+
+    def _append(self, added: List[Tuple[Dict[str, Any], bytes]]) -> range:
+        """Add rows for ``added`` products (one array resize for the lot); returns their row numbers."""
+        first = len(self._ids)
+        lengths, categories, featured = [], [], []
+        for product, fingerprint in added:
+            terms = product_terms(product)
+            term_ids = np.fromiter(
+                (self._terms.setdefault(term, len(self._terms)) for term in terms), dtype=np.int32, count=len(terms)
+            )
+            tf = np.fromiter(terms.values(), dtype=np.float32, count=len(terms))
+            self._rows[product["id"]] = len(self._ids)
+            self._ids.append(product["id"])
+            self._fingerprints[product["id"]] = fingerprint
+            self._row_terms.append((term_ids, tf))
+            lengths.append(float(tf.sum()))
+            categories.append(self._categories.setdefault(product.get("category"), len(self._categories)))
+            featured.append(bool(product.get("featured", False)))
+        # Terms first seen since the last build get an IDF from the current counts
+        known = len(self._idf)
+        if len(self._terms) > known:
+            grown = len(self._terms) - known
+            self._df = np.concatenate([self._df, np.zeros(grown, dtype=np.int64)])
+            self._idf = np.concatenate([self._idf, np.zeros(grown, dtype=np.float32)])
+        for term_ids, _ in self._row_terms[first:]:
+            self._df[term_ids] += 1
+        fresh = np.arange(known, len(self._terms))
+        self._idf[fresh] = np.log(1 + (len(self._rows) - self._df[fresh] + 0.5) / (self._df[fresh] + 0.5))
+        self._lengths = np.concatenate([self._lengths, np.array(lengths, dtype=np.float32)])
+        self._category_codes = np.concatenate([self._category_codes, np.array(categories, dtype=np.int32)])
+        self._featured = np.concatenate([self._featured, np.array(featured, dtype=bool)])
+        self._live = np.concatenate([self._live, np.ones(len(added), dtype=bool)])
+        new_ids = np.array([product["id"] for product, _ in added], dtype=str)
+        self._ranks = np.concatenate([self._ranks, 2 * np.searchsorted(self._sorted_ids, new_ids) + 1])
+        return range(first, len(self._ids))
+
+    # Sharing
+
+    def export(self, ids: List[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Query-time arrays with row ``i`` holding ``ids[i]``, and the settings that go with them.
+
+        ``ids`` must name every indexed product once. Pending changes are
+        compacted first; the terms are returned as a list in id order.
+        """
+        if self._dirty or self._dead or not self.builds:
+            self._compact()
+        rows = np.fromiter((self._rows.get(product_id, -1) for product_id in ids), dtype=np.int64, count=len(ids))
+        if len(ids) != len(self._rows) or (rows < 0).any():
+            raise ValueError("ids do not match the indexed products")
+        positions = np.empty(len(rows), dtype=np.int32)
+        positions[rows] = np.arange(len(rows), dtype=np.int32)
+        posting_rows = positions[self._posting_rows]
+        # Probing needs every term's rows ascending in the new order as well
+        order = np.lexsort((posting_rows, np.repeat(np.arange(len(self._indptr) - 1), np.diff(self._indptr))))
+        sections = {
+            "terms": list(self._terms),
+            "indptr": self._indptr,
+            "posting_rows": posting_rows[order],
+            "impacts": self._impacts[order],
+            "upper": self._upper,
+            "category_codes": self._category_codes[rows],
+            "featured": self._featured[rows],
+            "ranks": self._ranks[rows],
+        }
+        categories = {category: code for category, code in self._categories.items() if isinstance(category, str)}
+        return sections, {"rank_scale": self._rank_scale, "categories": categories}
+
+    @classmethod
+    def mapped(cls, sections: Dict[str, Any], settings: Dict[str, Any], ids, version: int) -> "ProductSearchIndex":
+        """A read-only index over ``export``-ed arrays, e.g. views into a shared file.
+
+        ``ids`` maps rows to product ids by position and back with ``get``;
+        ``sections["terms"]`` maps terms to term ids with ``get``.
+        """
+        index = cls()
+        index.read_only = True
+        index._ids = index._rows = ids
+        index._terms = sections["terms"]
+        index._categories = dict(settings["categories"])
+        index._indptr = sections["indptr"]
+        index._posting_rows = sections["posting_rows"]
+        index._impacts = sections["impacts"]
+        index._upper = sections["upper"]
+        index._category_codes = sections["category_codes"]
+        index._featured = sections["featured"]
+        index._ranks = sections["ranks"]
+        index._rank_scale = settings["rank_scale"]
+        index._live = np.ones(len(ids), dtype=bool)
+        index.version = version
+        return index
+
+    # Queries
+
+    def search(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        featured: Optional[bool] = None,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[str, float]] = None,
+    ) -> List[Tuple[str, float]]:
+        """Return ``(product_id, score)`` pairs, best match first.
+
+        ``after`` is the last pair of the previous page; only products ranked
+        below it are returned, so a deep page costs what the first one does.
+        """
+        term_ids = {term_id for term_id in map(self._terms.get, tokenize(query)) if term_id is not None}
+        if not self._rows or not term_ids:
+            return []
+        if category is not None and category not in self._categories:
+            return []
+        if after is None:
+            scores, kth = self._scores(term_ids, self._initial_scores(category, featured), limit)
+        else:
+            # Rows ranked before ``after`` are only known once fully scored, so there is no pruning
+            scores, _ = self._scores(term_ids, self._initial_scores(category, featured), None)
+            self._exclude_ranked_before(scores, *after)
+            kth = self._kth_score(scores, limit) if limit else None
+        found = np.flatnonzero(scores > 0 if kth is None else scores >= kth)
+        # The rank offset already orders ties by id; the id only settles rounding collisions
+        ranked = sorted(zip(scores[found].tolist(), found.tolist()), key=lambda item: (-item[0], self._ids[item[1]]))
+        return [
+            (self._ids[row], score + int(self._ranks[row]) * self._rank_scale) for score, row in ranked[:limit]
+        ]
+
+    def _exclude_ranked_before(self, scores: np.ndarray, product_id: str, score: float):
+        """Drop the rows that ``search`` ranks at or before ``(product_id, score)``."""
+        row = self._rows.get(product_id)
+        if row is not None:
+            # Undo the rank offset that returned scores carry
+            anchor, keys = score - int(self._ranks[row]) * self._rank_scale, scores
+        else:
+            # The product is gone: compare returned scores, among which equal matches go in id order
+            anchor, keys = score, scores + self._ranks * self._rank_scale
+        # Rounding can move the anchor by an ulp or two; rows that close are ordered by id
+        close = np.flatnonzero(np.abs(keys - anchor) <= 8 * float(np.spacing(abs(anchor))))
+        kept = scores[close]
+        scores[keys > anchor] = EXCLUDED
+        for row, value in zip(close.tolist(), kept.tolist()):
+            scores[row] = EXCLUDED if self._ids[row] <= product_id else value
+
+    def _initial_scores(self, category: Optional[str], featured: Optional[bool]) -> np.ndarray:
+        """Starting scores for a query, cached per filter until the next change.
+
+        Every row starts at a distinct value: rows the filters allow just
+        below zero, offset by their id rank within ``TIE_WINDOW``, the rest
+        at ``EXCLUDED``. Ties among matches are then already broken by id,
+        and ``np.partition`` never meets the long runs of equal values that
+        make it slow.
+        """
+        key = (self.version, category, featured)
+        initial = self._initial.get(key)
+        if initial is None:
+            allowed = self._live.copy()
+            if category is not None:
+                allowed &= self._category_codes == self._categories[category]
+            if featured is not None:
+                allowed &= self._featured == bool(featured)
+            initial = np.where(allowed, self._ranks * -self._rank_scale, EXCLUDED - self._ranks)
+            if len(self._initial) >= 16 or any(cached[0] != self.version for cached in self._initial):
+                self._initial.clear()
+            self._initial[key] = initial
+        return initial.copy()
+
+    def _scores(
+        self, term_ids: Set[int], scores: np.ndarray, limit: Optional[int]
+    ) -> Tuple[np.ndarray, Optional[float]]:
+        """Accumulate BM25 scores; also returns the k-th best score when at least ``limit`` rows matched."""
+        built = len(self._indptr) - 1
+        plan = []
+        for term in term_ids:
+            start, end = (int(self._indptr[term]), int(self._indptr[term + 1])) if term < built else (0, 0)
+            delta = self._delta.get(term, {})
+            upper = max(float(self._upper[term]) if term < built else 0.0, max(delta.values(), default=0.0))
+            plan.append((upper, start, end, delta))
+        plan.sort(key=lambda item: -item[0])
+        remaining, scanned = sum(item[0] for item in plan), 0.0
+
+        candidates = None
+        for upper, start, end, delta in plan:
+            rows = self._posting_rows[start:end]
+            # No score so far exceeds ``scanned``, so nothing can be pruned before it passes ``remaining``
+            if candidates is None and limit and end - start >= self.prune_length and remaining < scanned:
+                threshold = self._kth_score(scores, limit)
+                # Rows not scored yet can reach at most ``remaining``
+                if threshold is not None and remaining < threshold:
+                    self.pruned_queries += 1
+                    candidates = np.flatnonzero(scores + remaining >= threshold)
+            if candidates is None or candidates.size * PROBE_COST > rows.size:
+                # A term's postings name each row once, so fancy-index += is exact
+                scores[rows] += self._impacts[start:end]
+            elif candidates.size and rows.size:
+                positions = np.minimum(np.searchsorted(rows, candidates), rows.size - 1)
+                hits = rows[positions] == candidates
+                scores[candidates[hits]] += self._impacts[start:end][positions[hits]]
+            # Changed products are appended as new rows, so they have no postings to undo
+            for row, impact in delta.items():
+                scores[row] += impact
+            remaining -= upper
+            scanned += upper
+        return scores, self._kth_score(scores, limit) if limit else None
+
+    @staticmethod
+    def _kth_score(scores: np.ndarray, k: int) -> Optional[float]:
+        if k > len(scores):
+            return None
+        kth = float(np.partition(scores, len(scores) - k)[len(scores) - k])
+        return kth if kth > 0 else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "products": len(self._rows),
+            "terms": len(self._terms),
+            "postings": int(self._posting_rows.size),
+            "pending_rows": len(self._dirty),
+            "dead_rows": self._dead,
+            "version": self.version,
+            "builds": self.builds,
+            "patches": self.patches,
+            "pruned_queries": self.pruned_queries,
+        }
@@ -1,30 +1,146 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, ReplaceOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import Awaitable, Callable, Iterable, List, Literal, Optional, Dict, Any, Tuple, Union
 import uuid
+import base64
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 import hashlib
 import jwt
 from passlib.context import CryptContext
 import re
+import signal
+from contextlib import asynccontextmanager
+
+try:
+    import orjson
+except ImportError:  # only needed for FAST_JSON_RESPONSES
+    orjson = None
+
+from analytics import SalesRollups, default_range
+from bulk import csv_rows, export_csv, export_ndjson, import_products, ndjson_rows
+from catalog import CatalogCache, CatalogWatcher
+from database import Database
+from idempotency import IdempotencyInProgress, IdempotencyKeyReused, IdempotencyStore, fingerprint
+from lifecycle import Lifecycle, LifecycleMiddleware
+from metrics import ConnectionPoolMetrics, EventLoopLagMonitor, MetricsMiddleware, MongoCommandMetrics, Registry
+from outbox import Outbox
+from ratelimit import (
+    MemoryBucketStore, MongoBucketStore, RateLimiter, RateLimitMiddleware, RateLimitRule, apply_overrides
+)
+from related import RelatedProductsIndex
+from search import ProductSearchIndex
+from singleflight import SingleFlight, fold_text
+from snapshot import CatalogSnapshot, SnapshotPublisher
+from tokens import KeyRing, RevocationList, parse_signing_keys
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Metrics, exposed on /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+metrics_registry = Registry()
+http_requests_total = metrics_registry.counter(
+    "http_requests_total", "HTTP requests by method, route and status.", ("method", "route", "status")
+)
+http_request_duration = metrics_registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route.", ("method", "route")
+)
+http_requests_in_flight = metrics_registry.gauge("http_requests_in_flight", "HTTP requests being handled.")
+mongodb_commands_total = metrics_registry.counter(
+    "mongodb_commands_total",
+    "Mongo commands by collection, command and outcome.",
+    ("collection", "command", "outcome"),
+)
+mongodb_command_duration = metrics_registry.histogram(
+    "mongodb_command_duration_seconds", "Mongo command latency by collection and command.", ("collection", "command")
+)
+event_loop_lag = metrics_registry.gauge("event_loop_lag_seconds", "Most recent event-loop lag measurement.")
+event_loop_lag_samples = metrics_registry.histogram(
+    "event_loop_lag_sample_seconds", "Distribution of event-loop lag."
+)
+runtime_stat = metrics_registry.gauge(
+    "app_runtime_stat", "Numeric runtime statistics of in-process components.", ("component", "stat")
+)
+mongodb_pool_wait = metrics_registry.histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting to check a connection out of the pool."
+)
+mongodb_pool_connections = metrics_registry.gauge(
+    "mongodb_pool_connections", "Pool connections by state (open, checked_out).", ("state",)
+)
+mongodb_pool_checkout_failures = metrics_registry.counter(
+    "mongodb_pool_checkout_failures_total", "Failed connection check-outs by reason.", ("reason",)
+)
+outbox_events_total = metrics_registry.counter(
+    "outbox_events_total", "Outbox events by type and outcome (delivered, retried, dead).", ("type", "outcome")
+)
+outbox_delivery_lag = metrics_registry.histogram(
+    "outbox_delivery_lag_seconds", "Time from an outbox event being written to its handlers completing."
+)
+loop_lag_monitor = EventLoopLagMonitor(event_loop_lag, event_loop_lag_samples)
+
+# MongoDB connection, opened by the lifespan (see startup) rather than at import
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "10"))
+# Fail fast instead of queueing forever when the pool is exhausted
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# Connections opened before the app reports ready
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get("MONGO_WARMUP_CONNECTIONS", str(MONGO_MIN_POOL_SIZE)))
+
+database = Database(
+    os.environ['MONGO_URL'],
+    os.environ['DB_NAME'],
+    warmup_connections=MONGO_WARMUP_CONNECTIONS,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    event_listeners=[
+        MongoCommandMetrics(mongodb_commands_total, mongodb_command_duration),
+        ConnectionPoolMetrics(mongodb_pool_wait, mongodb_pool_connections, mongodb_pool_checkout_failures),
+    ] if METRICS_ENABLED else [],
+)
+# Bound by bind_database() once the client exists
+client = None
+db = None
+
+# Health checks and shutdown
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.environ.get("HEALTH_CHECK_TIMEOUT_SECONDS", "2"))
+# /readyz fails when a Mongo ping is slower than this
+READINESS_MAX_MONGO_LATENCY_MS = float(os.environ.get("READINESS_MAX_MONGO_LATENCY_MS", "500"))
+# How long shutdown waits for in-flight requests before closing the client
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "20"))
+# After SIGTERM, fail readiness and turn new requests away for this long before the server
+# stops accepting connections, so load balancers take the instance out first (0 disables).
+# Keep grace plus drain under the orchestrator's kill timeout (30s on Kubernetes by default).
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "5"))
+lifecycle = Lifecycle()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -36,6 +152,107 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Signing keys as "kid:secret,kid2:secret2" (defaults to SECRET_KEY); JWT_ACTIVE_KID signs new tokens
+JWT_SIGNING_KEYS = parse_signing_keys(os.environ.get("JWT_SIGNING_KEYS", ""), SECRET_KEY)
+JWT_ACTIVE_KID = os.environ.get("JWT_ACTIVE_KID") or None
+# Put email/full_name/is_admin in the token so authentication needs no database lookup
+JWT_EMBED_PROFILE_CLAIMS = os.environ.get("JWT_EMBED_PROFILE_CLAIMS", "false").lower() == "true"
+TOKEN_REVOCATION_SYNC_SECONDS = float(os.environ.get("TOKEN_REVOCATION_SYNC_SECONDS", "15"))
+
+# Authenticated-user cache; the TTL bounds how long a role change or deleted user goes unnoticed.
+# Admins get a much shorter TTL, so a demoted admin loses the admin routes within seconds.
+AUTH_CACHE_MAX_SIZE = int(os.environ.get("AUTH_CACHE_MAX_SIZE", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_ADMIN_TTL_SECONDS = float(os.environ.get("AUTH_CACHE_ADMIN_TTL_SECONDS", "5"))
+
+# Priced cart views, per user; revalidated against the cart and catalog on every read
+PRICED_CART_CACHE_SIZE = int(os.environ.get("PRICED_CART_CACHE_SIZE", "10000"))
+# Upper bound on staleness when product changes cannot be observed (no catalog cache)
+PRICED_CART_TTL_SECONDS = float(os.environ.get("PRICED_CART_TTL_SECONDS", "30"))
+
+# Password hashing pool ("thread" or "process")
+PASSWORD_HASH_EXECUTOR = os.environ.get("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "32"))
+
+# Product search backend: "memory" (in-process BM25 index) or "mongo" (text index)
+PRODUCT_SEARCH_BACKEND = os.environ.get("PRODUCT_SEARCH_BACKEND", "memory")
+
+# In-memory catalog cache, kept fresh by a change stream (or polling on standalone servers)
+CATALOG_CACHE_ENABLED = os.environ.get("CATALOG_CACHE_ENABLED", "true").lower() == "true"
+CATALOG_POLL_INTERVAL_SECONDS = float(os.environ.get("CATALOG_POLL_INTERVAL_SECONDS", "10"))
+CATALOG_CHANGE_STREAMS = os.environ.get("CATALOG_CHANGE_STREAMS", "true").lower() == "true"
+# Multi-worker deployments: workers map a shared catalog snapshot from this directory
+# instead of each caching the catalog. One process publishes it, either a worker
+# with CATALOG_SNAPSHOT_PUBLISH=true or a separate `python snapshot.py`.
+CATALOG_SNAPSHOT_DIR = os.environ.get("CATALOG_SNAPSHOT_DIR") or None
+CATALOG_SNAPSHOT_PUBLISH = os.environ.get("CATALOG_SNAPSHOT_PUBLISH", "false").lower() == "true"
+CATALOG_SNAPSHOT_POLL_SECONDS = float(os.environ.get("CATALOG_SNAPSHOT_POLL_SECONDS", "1"))
+# How long a starting worker waits for the first snapshot before serving from Mongo
+CATALOG_SNAPSHOT_WAIT_SECONDS = float(os.environ.get("CATALOG_SNAPSHOT_WAIT_SECONDS", "30"))
+# With the catalog cache disabled, how often to check whether the search and related indexes need a rebuild
+CATALOG_INDEX_REFRESH_SECONDS = float(os.environ.get("CATALOG_INDEX_REFRESH_SECONDS", "60"))
+
+# "Related products" similarity index, kept in memory and patched as the catalog changes
+RELATED_PRODUCTS_ENABLED = os.environ.get("RELATED_PRODUCTS_ENABLED", "true").lower() == "true"
+
+# Identical product reads that reach Mongo at the same time share one query
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# Order placement uses multi-document transactions when the deployment supports them
+ORDER_TRANSACTIONS_ENABLED = os.environ.get("ORDER_TRANSACTIONS_ENABLED", "true").lower() == "true"
+
+# Post-order work runs from the order_events outbox. Set OUTBOX_WORKER_ENABLED=false
+# on API workers when a separate `python outbox.py` process drains it instead.
+OUTBOX_WORKER_ENABLED = os.environ.get("OUTBOX_WORKER_ENABLED", "true").lower() == "true"
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.environ.get("OUTBOX_POLL_INTERVAL_SECONDS", "1"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "10"))
+# Delivered events are kept this long for inspection, then dropped by a TTL index
+OUTBOX_RETENTION_SECONDS = int(os.environ.get("OUTBOX_RETENTION_SECONDS", str(7 * 86400)))
+
+# Hourly/daily sales rollups for admin analytics, maintained from the order outbox
+SALES_ROLLUPS_ENABLED = os.environ.get("SALES_ROLLUPS_ENABLED", "true").lower() == "true"
+# How long applied-order markers guard against redelivered events; outlive any requeue
+SALES_ROLLUP_MARKER_TTL_SECONDS = int(os.environ.get("SALES_ROLLUP_MARKER_TTL_SECONDS", str(30 * 86400)))
+
+# Idempotency-Key support on order and cart mutations; responses are replayed for this long
+IDEMPOTENCY_ENABLED = os.environ.get("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(86400)))
+# How long a retry waits for the first attempt, running in another worker, before a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "10"))
+
+# Opt-in: encode listings straight from Mongo documents with orjson, skipping
+# the Pydantic model round-trips (requires orjson)
+FAST_JSON_RESPONSES = os.environ.get("FAST_JSON_RESPONSES", "false").lower() == "true"
+if FAST_JSON_RESPONSES and orjson is None:
+    raise RuntimeError("FAST_JSON_RESPONSES requires the orjson package")
+
+# Cache-Control per public catalog route, for browsers and CDNs
+CACHE_CONTROL = {
+    "products": os.environ.get("CACHE_CONTROL_PRODUCTS", "public, max-age=30, stale-while-revalidate=300"),
+    "product": os.environ.get("CACHE_CONTROL_PRODUCT", "public, max-age=60, stale-while-revalidate=600"),
+    "categories": os.environ.get("CACHE_CONTROL_CATEGORIES", "public, max-age=3600, stale-while-revalidate=86400"),
+    "related": os.environ.get("CACHE_CONTROL_RELATED", "public, max-age=300, stale-while-revalidate=3600"),
+}
+
+# Rate limiting: token buckets per client IP (auth) or per user (cart, orders).
+# "memory" limits each worker separately; "mongo" shares buckets across workers.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")
+# Number of reverse proxies in front of the app whose X-Forwarded-For is trusted
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get("RATE_LIMIT_PROXY_HOPS", "0"))
+# First matching rule wins; rate is tokens per second, burst the bucket size.
+# Override with RATE_LIMITS="auth_login=0.2/10,cart=20/100".
+RATE_LIMIT_RULES = apply_overrides([
+    RateLimitRule("auth_login", "/api/auth/login", rate=5 / 60, burst=10, methods=frozenset({"POST"})),
+    RateLimitRule("auth_register", "/api/auth/register", rate=3 / 60, burst=5, methods=frozenset({"POST"})),
+    RateLimitRule("auth", "/api/auth/", rate=2, burst=20),
+    RateLimitRule("order_create", "/api/orders", rate=0.5, burst=10, key="user", methods=frozenset({"POST"})),
+    RateLimitRule("orders", "/api/orders", rate=5, burst=30, key="user"),
+    RateLimitRule("cart", "/api/cart", rate=10, burst=50, key="user"),
+], os.environ.get("RATE_LIMITS", ""))
+
 # Models
 class UserCreate(BaseModel):
     email: EmailStr
@@ -65,6 +282,19 @@ class Product(BaseModel):
     featured: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ProductSummary(BaseModel):
+    """A product with only the projected fields present (see ``fields=``)."""
+    id: str
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    image_url: Optional[str] = None
+    category: Optional[str] = None
+    specifications: Optional[Dict[str, Any]] = None
+    stock_quantity: Optional[int] = None
+    featured: Optional[bool] = None
+    created_at: Optional[datetime] = None
+
 class ProductCreate(BaseModel):
     name: str
     description: str
@@ -85,6 +315,35 @@ class Cart(BaseModel):
     items: List[CartItem] = []
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class PricedCartLine(BaseModel):
+    product_id: str
+    quantity: int
+    name: str
+    description: str
+    price: float
+    image_url: str
+    category: str
+    stock_quantity: int
+    line_total: float
+
+class PricedCart(BaseModel):
+    id: str
+    user_id: str
+    items: List[PricedCartLine] = []
+    # Lines whose product no longer exists; they are left out of the totals
+    unavailable_product_ids: List[str] = []
+    item_count: int = 0
+    subtotal: float = 0.0
+    updated_at: datetime
+
+class CartOperation(BaseModel):
+    action: Literal["add", "set", "remove"] = "add"
+    product_id: str
+    quantity: int = 0
+
+class CartBulkUpdate(BaseModel):
+    operations: List[CartOperation] = Field(..., min_length=1, max_length=100)
+
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -95,11 +354,46 @@ class Order(BaseModel):
     shipping_address: Dict[str, str]
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class OrderSummary(BaseModel):
+    id: str
+    created_at: datetime
+    total_amount: float
+    status: str
+    # Units across all lines
+    item_count: int
+
+class OrderStats(BaseModel):
+    order_count: int = 0
+    item_count: int = 0
+    total_spent: float = 0.0
+    first_order_at: Optional[datetime] = None
+    last_order_at: Optional[datetime] = None
+
 class OrderCreate(BaseModel):
     items: List[CartItem]
     payment_method: str
     shipping_address: Dict[str, str]
 
+PRODUCT_FIELDS = tuple(Product.model_fields)
+ORDER_FIELDS = tuple(Order.model_fields)
+ORDER_SUMMARY_FIELDS = tuple(OrderSummary.model_fields)
+
+# Fast response path
+class FastJSONResponse(JSONResponse):
+    """orjson-encoded response; UTC datetimes end in "Z" like Pydantic's output."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+def fast_json_response(response: Response, documents: Any, fields: Iterable[str]) -> FastJSONResponse:
+    """Encode raw documents limited to ``fields``, keeping headers already set on ``response``."""
+    fields = tuple(fields)
+    if isinstance(documents, list):
+        content = [{field: document[field] for field in fields if field in document} for document in documents]
+    else:
+        content = {field: documents[field] for field in fields if field in documents}
+    return FastJSONResponse(content, headers=dict(response.headers))
+
 # Auth utilities
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -107,34 +401,347 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def _timed_call(fn, *args):
+    # Runs inside the pool; time.monotonic() is system-wide, so the
+    # timestamps are comparable with the event loop's even across processes.
+    started = time.monotonic()
+    result = fn(*args)
+    return started, time.monotonic(), result
+
+class LatencyStats:
+    """Running count/total/max of durations, reported in milliseconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max * 1000,
+        }
+
+class PasswordHashPool:
+    """Runs bcrypt work off the event loop with a bounded queue.
+
+    Once ``max_pending`` calls are queued or running, new calls fail fast
+    with a 503 instead of piling up behind the workers.
+    """
+
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.wait_time = LatencyStats()
+        self.hash_time = LatencyStats()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        submitted = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            started, finished, result = await loop.run_in_executor(self._get_executor(), _timed_call, fn, *args)
+        finally:
+            self.pending -= 1
+        self.wait_time.observe(max(0.0, started - submitted))
+        self.hash_time.observe(finished - started)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "wait_time": self.wait_time.stats(),
+            "hash_time": self.hash_time.stats(),
+        }
+
+password_pool = PasswordHashPool(PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await password_pool.run(get_password_hash, password)
+
+key_ring = KeyRing(JWT_SIGNING_KEYS, JWT_ACTIVE_KID, ALGORITHM)
+revocations = RevocationList(None, sync_interval=TOKEN_REVOCATION_SYNC_SECONDS)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
+    encoded_jwt = key_ring.encode(to_encode)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    credentials_exception = HTTPException(
+def token_claims(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Claims for a user's access token.
+
+    With JWT_EMBED_PROFILE_CLAIMS the profile travels in the token, so a
+    change to it (e.g. granting admin) only shows up in newly issued tokens.
+    """
+    claims = {"sub": user["id"]}
+    if JWT_EMBED_PROFILE_CLAIMS:
+        claims.update({
+            "email": user["email"],
+            "full_name": user["full_name"],
+            "is_admin": user.get("is_admin", False),
+            "created_at": user["created_at"].isoformat(),
+        })
+    return claims
+
+class PrincipalCache:
+    """Bounded LRU cache of validated users, keyed by user id.
+
+    An entry lives for at most ``ttl`` seconds (``admin_ttl`` for admins) and
+    never past the ``exp`` of the token that loaded it. The cache is per
+    process, so code that writes to ``db.users`` must call ``invalidate`` for
+    the affected user; revoking a user's token (logout, or a revocation
+    synced from another process) invalidates the user in every process.
+    Roles changed outside the app are seen within the TTL.
+    """
+
+    def __init__(self, max_size: int, ttl: float, admin_ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.admin_ttl = ttl if admin_ttl is None else min(admin_ttl, ttl)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Optional[User]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def set(self, user: User, token_exp: Optional[float] = None):
+        ttl = self.admin_ttl if user.is_admin else self.ttl
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        self._entries[user.id] = (user, expires_at)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop one user, or the whole cache when no id is given."""
+        if user_id is None:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+        elif self._entries.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "admin_ttl_seconds": self.admin_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+user_cache = PrincipalCache(AUTH_CACHE_MAX_SIZE, AUTH_CACHE_TTL_SECONDS, AUTH_CACHE_ADMIN_TTL_SECONDS)
+revocations.subscribe(user_cache.invalidate)
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+async def get_token_payload(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
+    """Verify the bearer token; pure CPU work, no I/O."""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
+        payload = key_ring.decode(credentials.credentials)
     except jwt.PyJWTError:
-        raise credentials_exception
+        raise credentials_exception()
+    if payload.get("sub") is None or revocations.is_revoked(payload.get("jti")):
+        raise credentials_exception()
+    return payload
+
+async def get_current_user(payload: Dict[str, Any] = Depends(get_token_payload)):
+    user_id: str = payload["sub"]
+    if "email" in payload and "full_name" in payload:
+        # Profile claims embedded at issue time (JWT_EMBED_PROFILE_CLAIMS)
+        try:
+            return User(
+                id=user_id,
+                email=payload["email"],
+                full_name=payload["full_name"],
+                is_admin=payload.get("is_admin", False),
+                created_at=payload["created_at"],
+            )
+        except (KeyError, ValueError):
+            raise credentials_exception()
+    
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
     
     user = await db.users.find_one({"id": user_id})
     if user is None:
-        raise credentials_exception
-    return User(**user)
+        raise credentials_exception()
+    current_user = User(**user)
+    user_cache.set(current_user, payload.get("exp"))
+    return current_user
+
+async def get_current_admin_user(current_user: User = Depends(get_current_user)):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
+
+# Indexes backing every lookup the routes perform: collection -> [(keys, options)]
+INDEX_SPECS = {
+    "users": [
+        ([("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+        ([("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ],
+    "products": [
+        ([("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+        ([("category", ASCENDING), ("featured", ASCENDING)], {"name": "category_featured"}),
+        # Keyset pagination: one (sort key, id) index per sortable field
+        ([("created_at", ASCENDING), ("id", ASCENDING)], {"name": "created_at_id"}),
+        ([("price", ASCENDING), ("id", ASCENDING)], {"name": "price_id"}),
+        ([("name", ASCENDING), ("id", ASCENDING)], {"name": "name_id"}),
+        # The catalog's polling fallback reads the newest write from here
+        ([("updated_at", DESCENDING)], {"name": "updated_at"}),
+    ] + ([
+        # Wildcard text index so specification values are searchable too
+        ([("$**", TEXT)], {"name": "product_text", "weights": {"name": 3, "description": 1}}),
+    ] if PRODUCT_SEARCH_BACKEND == "mongo" else []),
+    "revoked_tokens": [
+        ([("jti", ASCENDING)], {"name": "jti_unique", "unique": True}),
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+        ([("revoked_at", ASCENDING)], {"name": "revoked_at"}),
+    ],
+    "carts": [
+        ([("user_id", ASCENDING)], {"name": "user_id_unique", "unique": True}),
+    ],
+    "orders": [
+        # Order history pages on (created_at, id), newest first
+        ([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "user_id_created_at_id"}),
+        ([("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ],
+    "user_order_stats": [
+        ([("user_id", ASCENDING)], {"name": "user_id_unique", "unique": True}),
+    ],
+    "order_events": [
+        # The worker's claim query: pending events that are due
+        ([("status", ASCENDING), ("available_at", ASCENDING)], {"name": "status_available_at"}),
+        ([("processed_at", ASCENDING)], {"name": "processed_at_ttl", "expireAfterSeconds": OUTBOX_RETENTION_SECONDS}),
+    ],
+    "sales_rollups": [
+        # One key's buckets over a time range, and every key's for top-N
+        (
+            [("granularity", ASCENDING), ("dimension", ASCENDING), ("key", ASCENDING), ("bucket", ASCENDING)],
+            {"name": "series"},
+        ),
+        ([("granularity", ASCENDING), ("dimension", ASCENDING), ("bucket", ASCENDING)], {"name": "dimension_bucket"}),
+        ([("bucket", ASCENDING)], {"name": "bucket"}),
+    ],
+    "sales_rollup_orders": [
+        (
+            [("applied_at", ASCENDING)],
+            {"name": "applied_at_ttl", "expireAfterSeconds": SALES_ROLLUP_MARKER_TTL_SECONDS},
+        ),
+    ],
+    "idempotency_keys": [
+        ([("created_at", ASCENDING)], {"name": "created_at_ttl", "expireAfterSeconds": IDEMPOTENCY_TTL_SECONDS}),
+    ],
+}
+if RATE_LIMIT_STORE == "mongo":
+    INDEX_SPECS["rate_limits"] = [
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ]
+
+def _index_key(keys) -> tuple:
+    return tuple((field, direction if isinstance(direction, str) else int(direction)) for field, direction in keys)
+
+async def ensure_indexes() -> Dict[str, Dict[str, List[str]]]:
+    """Create the indexes in INDEX_SPECS that are missing.
+
+    Indexes are matched on their key pattern (or name), so re-running this on every
+    startup is a no-op once they exist. Returns, per collection, which
+    indexes already existed, which were created and which failed (e.g. a
+    unique index over duplicate data).
+    """
+    report = {}
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = db[collection_name]
+        information = await collection.index_information()
+        existing = {_index_key(info["key"]) for info in information.values()}
+        result = {"existing": [], "created": [], "failed": []}
+        for keys, options in specs:
+            # Text indexes are stored under internal keys, so match them by name
+            if _index_key(keys) in existing or options["name"] in information:
+                result["existing"].append(options["name"])
+                continue
+            try:
+                await collection.create_index(keys, **options)
+                result["created"].append(options["name"])
+            except OperationFailure as exc:
+                logger.error("Could not create index %s.%s: %s", collection_name, options["name"], exc)
+                result["failed"].append(options["name"])
+        if result["created"]:
+            logger.info("Created indexes on %s: %s", collection_name, ", ".join(result["created"]))
+        report[collection_name] = result
+    return report
 
 # Initialize sample data
 async def init_sample_data():
@@ -211,8 +818,213 @@ async def init_sample_data():
                 "created_at": datetime.now(timezone.utc)
             }
         ]
+        for product in sample_products:
+            product["updated_at"] = product["created_at"]
         await db.products.insert_many(sample_products)
 
+product_search = ProductSearchIndex()
+related_products = RelatedProductsIndex()
+catalog_source = CatalogCache(
+    None, poll_interval=CATALOG_POLL_INTERVAL_SECONDS, change_streams=CATALOG_CHANGE_STREAMS
+)
+# In snapshot mode reads come from the mapped snapshot; the cache only feeds the publisher,
+# which also keeps the search and related indexes and ships them inside the snapshot
+if CATALOG_SNAPSHOT_DIR:
+    catalog = CatalogSnapshot(CATALOG_SNAPSHOT_DIR, poll_interval=CATALOG_SNAPSHOT_POLL_SECONDS)
+    snapshot_indexes = {}
+    if PRODUCT_SEARCH_BACKEND == "memory":
+        snapshot_indexes["search"] = ProductSearchIndex()
+    if RELATED_PRODUCTS_ENABLED:
+        snapshot_indexes["related"] = RelatedProductsIndex()
+    snapshot_publisher = SnapshotPublisher(catalog_source, CATALOG_SNAPSHOT_DIR, indexes=snapshot_indexes)
+else:
+    catalog = catalog_source
+    snapshot_publisher = None
+
+def catalog_available() -> bool:
+    return CATALOG_CACHE_ENABLED and catalog.ready
+
+def search_index() -> ProductSearchIndex:
+    """The index mapped from the current snapshot in snapshot mode, else this process's own."""
+    mapped = catalog.index("search") if snapshot_publisher is not None else None
+    return mapped if mapped is not None else product_search
+
+def related_index() -> RelatedProductsIndex:
+    mapped = catalog.index("related") if snapshot_publisher is not None else None
+    return mapped if mapped is not None else related_products
+
+def sync_search_index(upserted: List[Dict[str, Any]], removed: List[str]):
+    product_search.update(upserted, removed)
+
+def sync_related_index(upserted: List[Dict[str, Any]], removed: List[str]):
+    related_products.update(upserted, removed)
+
+# Search text is matched case-insensitively, so differently cased queries coalesce
+product_reads = SingleFlight(normalizers={"search": fold_text})
+
+async def coalesced(operation: str, fetch, **params):
+    """Run ``fetch()``, sharing the call with identical in-flight reads."""
+    if not SINGLE_FLIGHT_ENABLED:
+        return await fetch()
+    return await product_reads.do(product_reads.key(operation, **params), fetch)
+
+async def find_product(product_id: str) -> Optional[Dict[str, Any]]:
+    """Look a product up in the catalog cache, falling back to Mongo on a miss."""
+    if catalog_available():
+        product = catalog.get(product_id)
+        if product is not None:
+            return product
+    return await coalesced(
+        "product", lambda: db.products.find_one({"id": product_id}, {"_id": 0}), product_id=product_id
+    )
+
+async def find_products(product_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Batch lookup: catalog cache first, then one ``$in`` query for the rest."""
+    product_ids = list(dict.fromkeys(product_ids))
+    products = catalog.get_many(product_ids) if catalog_available() else {}
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        async for product in db.products.find({"id": {"$in": missing}}, {"_id": 0}):
+            products[product["id"]] = product
+    return products
+
+def set_catalog_version_header(response: Response):
+    if catalog_available():
+        response.headers["X-Catalog-Version"] = str(catalog.version)
+
+# Conditional GET
+def make_etag(*parts: Any) -> str:
+    """Strong ETag over ``parts``; equal content gives the same tag in every worker."""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return '"' + hashlib.blake2b(raw, digest_size=16).hexdigest() + '"'
+
+def request_key(request: Request) -> List[Tuple[str, str]]:
+    return sorted(request.query_params.multi_items())
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+def set_cache_headers(response: Response, etag: str, route: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL[route]
+
+def not_modified(etag: str, route: str) -> Response:
+    response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    set_cache_headers(response, etag, route)
+    set_catalog_version_header(response)
+    return response
+
+async def rebuild_search_index():
+    """Rebuild the in-memory index off the event loop and swap it in."""
+    global product_search
+    projection = {"_id": 0, "id": 1, "name": 1, "description": 1, "specifications": 1, "category": 1, "featured": 1}
+    products = [product async for product in db.products.find({}, projection)]
+    index = ProductSearchIndex()
+    await asyncio.to_thread(index.build, products)
+    product_search = index
+    logger.info("Search index built with %d products", len(index))
+
+async def rebuild_related_index():
+    """Rebuild the related-products index off the event loop and swap it in."""
+    global related_products
+    fields = ("id", "name", "description", "specifications", "category", "price")
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    products = [product async for product in db.products.find({}, projection)]
+    index = RelatedProductsIndex()
+    await asyncio.to_thread(index.build, products)
+    related_products = index
+    logger.info("Related products index built with %d products", len(index))
+
+async def rebuild_catalog_indexes():
+    if PRODUCT_SEARCH_BACKEND == "memory":
+        await rebuild_search_index()
+    if RELATED_PRODUCTS_ENABLED:
+        await rebuild_related_index()
+
+# Without the catalog cache nothing patches the indexes, so they are rebuilt when products change
+catalog_watcher = CatalogWatcher(None, rebuild_catalog_indexes, poll_interval=CATALOG_INDEX_REFRESH_SECONDS)
+
+async def search_products(
+    search: str,
+    query: Dict[str, Any],
+    limit: int,
+    after: Optional[Tuple[str, float]] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> List[Tuple[Dict[str, Any], float]]:
+    """Products matching ``search`` and the ``query`` filters with their scores, best match first.
+
+    ``after`` is the (id, score) of the previous page's last product.
+    """
+    if PRODUCT_SEARCH_BACKEND == "mongo":
+        match = {**query, "$text": {"$search": search}}
+        pipeline = [{"$match": match}, {"$addFields": {"score": {"$meta": "textScore"}}}]
+        if after:
+            product_id, score = after
+            below = [{"score": {"$lt": score}}, {"score": score, "id": {"$gt": product_id}}]
+            pipeline.append({"$match": {"$or": below}})
+        pipeline += [{"$sort": {"score": -1, "id": 1}}, {"$limit": limit}]
+        if projection:
+            pipeline.append({"$project": {**projection, "score": 1} if len(projection) > 1 else projection})
+        return [(product, product["score"]) async for product in db.products.aggregate(pipeline)]
+    ranked = search_index().search(
+        search, category=query.get("category"), featured=query.get("featured"), limit=limit, after=after
+    )
+    if not ranked:
+        return []
+    if catalog_available():
+        products = catalog.get_many(product_id for product_id, _ in ranked)
+    else:
+        matches = db.products.find({"id": {"$in": [product_id for product_id, _ in ranked]}}, projection)
+        products = {product["id"]: product async for product in matches}
+    return [(products[product_id], score) for product_id, score in ranked if product_id in products]
+
+# Product listing pagination
+PRODUCT_SORT_FIELDS = ("created_at", "price", "name")
+PRODUCT_PAGE_MAX_LIMIT = 500
+# Values a keyset cursor may carry; anything else would be spliced into the Mongo filter as-is
+CURSOR_VALUE_TYPES = (str, int, float, datetime, type(None))
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    raw = json.dumps(data, default=lambda value: {"$dt": value.isoformat()}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def valid_cursor(data: Any) -> bool:
+    """A keyset cursor: a scalar ``v`` and a string ``id``."""
+    if not isinstance(data, dict):
+        return False
+    return "v" in data and isinstance(data["v"], CURSOR_VALUE_TYPES) and isinstance(data.get("id"), str)
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    def _object_hook(value):
+        return datetime.fromisoformat(value["$dt"]) if set(value) == {"$dt"} else value
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw, object_hook=_object_hook)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not valid_cursor(data):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return data
+
+def parse_product_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = set(requested) - set(Product.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return ["id"] + [field for field in requested if field != "id"]
+
+def keyset_filter(sort: str, direction: int, after: Dict[str, Any]) -> Dict[str, Any]:
+    """Match documents strictly after ``after`` in (sort, id) order."""
+    op = "$gt" if direction == ASCENDING else "$lt"
+    return {"$or": [{sort: {op: after["v"]}}, {sort: after["v"], "id": {op: after["id"]}}]}
+
 # Routes
 @api_router.get("/")
 async def root():
@@ -227,7 +1039,7 @@ async def register(user: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     user_data = {
         "id": str(uuid.uuid4()),
         "email": user.email,
@@ -237,12 +1049,16 @@ async def register(user: UserCreate):
         "created_at": datetime.now(timezone.utc)
     }
     
-    await db.users.insert_one(user_data)
+    try:
+        await db.users.insert_one(user_data)
+    except DuplicateKeyError:
+        # A concurrent registration for the same email won the unique index
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user_data["id"]}, expires_delta=access_token_expires
+        data=token_claims(user_data), expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer", "user": User(**user_data)}
@@ -250,7 +1066,7 @@ async def register(user: UserCreate):
 @api_router.post("/auth/login")
 async def login(user: UserLogin):
     db_user = await db.users.find_one({"email": user.email})
-    if not db_user or not verify_password(user.password, db_user["hashed_password"]):
+    if not db_user or not await verify_password_async(user.password, db_user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -259,118 +1075,475 @@ async def login(user: UserLogin):
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": db_user["id"]}, expires_delta=access_token_expires
+        data=token_claims(db_user), expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer", "user": User(**db_user)}
 
+@api_router.post("/auth/logout")
+async def logout(payload: Dict[str, Any] = Depends(get_token_payload)):
+    """Revoke the presented token."""
+    if payload.get("jti") is None:
+        raise HTTPException(status_code=400, detail="Token cannot be revoked")
+    await revocations.revoke(payload["jti"], payload["exp"], payload["sub"])
+    return {"message": "Logged out"}
+
 @api_router.get("/auth/me", response_model=User)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
 
 # Product routes
-@api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[str] = None, search: Optional[str] = None, featured: Optional[bool] = None):
+@api_router.get(
+    "/products",
+    response_model=List[Union[Product, ProductSummary]],
+    response_model_exclude_none=True,
+)
+async def get_products(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    featured: Optional[bool] = None,
+    limit: int = Query(100, ge=1, le=PRODUCT_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "price", "name"] = "created_at",
+    order: Literal["asc", "desc"] = "asc",
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,price,image_url"),
+):
+    """List products a page at a time.
+
+    Pages are keyset-paginated on (``sort``, id), so fetching a page costs
+    the same wherever it is in the listing. The next page's cursor is
+    returned in the ``X-Next-Cursor`` header. Search results are ordered by
+    relevance instead, and keyset-paginated on (score, id); ``sort`` and
+    ``order`` are ignored.
+    
+    With the catalog cache loaded the ETag is known before any work is done,
+    so a matching ``If-None-Match`` is answered without touching the data.
+    """
+    etag = make_etag("products", catalog.digest, request_key(request)) if catalog_available() else None
+    if etag and etag_matches(request, etag):
+        return not_modified(etag, "products")
+    
     query = {}
     if category:
         query["category"] = category
-    if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
     if featured is not None:
         query["featured"] = featured
     
-    products = await db.products.find(query).to_list(100)
-    return [Product(**product) for product in products]
+    selected = parse_product_fields(fields)
+    projection = {"_id": 0} if FAST_JSON_RESPONSES else None
+    if selected is not None:
+        projection = {"_id": 0, **{field: 1 for field in selected}}
+        if not search:
+            projection[sort] = 1
+    after = decode_cursor(cursor) if cursor else None
+    
+    if search:
+        if after and (after.get("s") != "relevance" or not isinstance(after["v"], (int, float))):
+            raise HTTPException(status_code=400, detail="Cursor does not match this listing")
+        last = (after["id"], after["v"]) if after else None
+        scored = await coalesced(
+            "search",
+            lambda: search_products(search, query, limit + 1, last, projection),
+            search=search, query=query, limit=limit + 1, after=last, projection=projection,
+        )
+        products = [product for product, _ in scored]
+        next_cursor = {"s": "relevance", "v": scored[limit - 1][1] if len(scored) > limit else None}
+    else:
+        direction = ASCENDING if order == "asc" else DESCENDING
+        if after:
+            if after.get("s") != sort or after.get("o") != order:
+                raise HTTPException(status_code=400, detail="Cursor does not match this listing")
+        if catalog_available():
+            products = catalog.query(
+                category=query.get("category"),
+                featured=query.get("featured"),
+                sort=sort,
+                direction=direction,
+                after=(after["v"], after["id"]) if after else None,
+                limit=limit + 1,
+            )
+        else:
+            if after:
+                query.update(keyset_filter(sort, direction, after))
+            order_by = [(sort, direction), ("id", direction)]
+            products = await coalesced(
+                "list",
+                lambda: db.products.find(query, projection).sort(order_by).to_list(limit + 1),
+                query=query, projection=projection, sort=sort, direction=direction, limit=limit + 1,
+            )
+        next_cursor = {"s": sort, "o": order, "v": products[limit - 1].get(sort) if len(products) > limit else None}
+    
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor["id"] = products[-1]["id"]
+        response.headers["X-Next-Cursor"] = encode_cursor(next_cursor)
+    if etag is None:
+        etag = make_etag("products", request_key(request), products)
+        if etag_matches(request, etag):
+            return not_modified(etag, "products")
+    set_cache_headers(response, etag, "products")
+    set_catalog_version_header(response)
+    
+    if FAST_JSON_RESPONSES:
+        return fast_json_response(response, products, selected or PRODUCT_FIELDS)
+    if selected is None:
+        return [Product(**product) for product in products]
+    return [
+        ProductSummary(**{field: product[field] for field in selected if field in product}) for product in products
+    ]
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id})
+async def get_product(product_id: str, request: Request, response: Response):
+    product = await find_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    content_hash = catalog.product_hash(product_id) if catalog_available() else None
+    etag = make_etag("product", product_id, content_hash if content_hash is not None else product)
+    if etag_matches(request, etag):
+        return not_modified(etag, "product")
+    set_cache_headers(response, etag, "product")
+    set_catalog_version_header(response)
+    if FAST_JSON_RESPONSES:
+        return fast_json_response(response, product, PRODUCT_FIELDS)
     return Product(**product)
 
+RELATED_PAGE_MAX_LIMIT = 50
+
+@api_router.get("/products/{product_id}/related", response_model=List[Product])
+async def get_related_products(
+    product_id: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(8, ge=1, le=RELATED_PAGE_MAX_LIMIT),
+):
+    """Products most similar to ``product_id`` by text, category and price, best first."""
+    if not RELATED_PRODUCTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    etag = make_etag("related", catalog.digest, product_id, limit) if catalog_available() else None
+    if etag and etag_matches(request, etag):
+        return not_modified(etag, "related")
+    ranked = related_index().related(product_id, limit)
+    if not ranked and not await find_product(product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    found = await find_products(related_id for related_id, _ in ranked)
+    products = [found[related_id] for related_id, _ in ranked if related_id in found]
+    if etag is None:
+        etag = make_etag("related", product_id, products)
+        if etag_matches(request, etag):
+            return not_modified(etag, "related")
+    set_cache_headers(response, etag, "related")
+    set_catalog_version_header(response)
+    if FAST_JSON_RESPONSES:
+        return fast_json_response(response, products, PRODUCT_FIELDS)
+    return [Product(**product) for product in products]
+
+CATEGORIES = [
+    {"id": "home_automation", "name": "Home Automation", "description": "Smart robots for your home"},
+    {"id": "educational", "name": "Educational", "description": "Learning and hobby robotics"},
+    {"id": "ai_companion", "name": "AI Companions", "description": "Intelligent companion robots"}
+]
+CATEGORIES_ETAG = make_etag("categories", CATEGORIES)
+
 @api_router.get("/categories")
-async def get_categories():
-    return [
-        {"id": "home_automation", "name": "Home Automation", "description": "Smart robots for your home"},
-        {"id": "educational", "name": "Educational", "description": "Learning and hobby robotics"},
-        {"id": "ai_companion", "name": "AI Companions", "description": "Intelligent companion robots"}
-    ]
+async def get_categories(request: Request, response: Response):
+    if etag_matches(request, CATEGORIES_ETAG):
+        return not_modified(CATEGORIES_ETAG, "categories")
+    set_cache_headers(response, CATEGORIES_ETAG, "categories")
+    return CATEGORIES
 
 # Cart routes
+# Every cart mutation is a single atomic update on the cart document, so
+# concurrent requests (e.g. two browser tabs) cannot lose each other's writes.
+async def cart_upsert_line(user_id: str, product_id: str, update: Dict[str, Any], quantity: int):
+    """Apply ``update`` to an existing line, or push a new line with ``quantity``."""
+    now = datetime.now(timezone.utc)
+    while True:
+        result = await db.carts.update_one(
+            {"user_id": user_id, "items.product_id": product_id},
+            {**update, "$set": {**update.get("$set", {}), "updated_at": now}},
+        )
+        if result.matched_count or quantity <= 0:
+            return
+        try:
+            await db.carts.update_one(
+                {"user_id": user_id, "items.product_id": {"$ne": product_id}},
+                {
+                    "$push": {"items": {"product_id": product_id, "quantity": quantity}},
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {"id": str(uuid.uuid4())},
+                },
+                upsert=True,
+            )
+            return
+        except DuplicateKeyError:
+            # The line was added concurrently, so the upsert tried to create
+            # a second cart; go back and update the existing line instead.
+            continue
+
+async def cart_add_item(user_id: str, product_id: str, quantity: int):
+    """Add ``quantity`` (which may be negative) to a cart line."""
+    await cart_upsert_line(user_id, product_id, {"$inc": {"items.$.quantity": quantity}}, quantity)
+    if quantity < 0:
+        await db.carts.update_one(
+            {"user_id": user_id},
+            {"$pull": {"items": {"product_id": product_id, "quantity": {"$lte": 0}}}},
+        )
+
+async def cart_set_item(user_id: str, product_id: str, quantity: int):
+    if quantity <= 0:
+        await cart_remove_item(user_id, product_id)
+        return
+    await cart_upsert_line(user_id, product_id, {"$set": {"items.$.quantity": quantity}}, quantity)
+
+async def cart_remove_item(user_id: str, product_id: str) -> bool:
+    """Drop a cart line; returns False when the user has no cart."""
+    result = await db.carts.update_one(
+        {"user_id": user_id},
+        {"$pull": {"items": {"product_id": product_id}}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+    )
+    return result.matched_count > 0
+
+async def load_cart(user_id: str) -> Dict[str, Any]:
+    """Fetch the user's cart, creating an empty one atomically if needed."""
+    return await db.carts.find_one_and_update(
+        {"user_id": user_id},
+        {"$setOnInsert": {"id": str(uuid.uuid4()), "items": [], "updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
 @api_router.get("/cart", response_model=Cart)
 async def get_cart(current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
-        # Create empty cart
-        cart_data = {
-            "id": str(uuid.uuid4()),
-            "user_id": current_user.id,
-            "items": [],
-            "updated_at": datetime.now(timezone.utc)
+    return Cart(**await load_cart(current_user.id))
+
+class PricedCartCache:
+    """Bounded LRU of priced carts, keyed by user id.
+
+    An entry is only served while the cart it was priced from is unchanged
+    (same ``updated_at`` and lines) and, with the catalog cache loaded, while
+    none of its products has a newer catalog revision. The cart document is
+    read on every request anyway, so a mutation made by any worker
+    invalidates the entry; without the catalog, product changes are picked
+    up after ``ttl`` seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(cart: Dict[str, Any]) -> tuple:
+        lines = tuple((item["product_id"], item["quantity"]) for item in cart.get("items", []))
+        return cart.get("updated_at"), lines
+
+    @staticmethod
+    def revisions(cart: Dict[str, Any]) -> Optional[tuple]:
+        if not catalog_available():
+            return None
+        return tuple(catalog.revision(item["product_id"]) for item in cart.get("items", []))
+
+    def get(self, cart: Dict[str, Any]) -> Optional[PricedCart]:
+        entry = self._entries.get(cart["user_id"])
+        if entry is not None:
+            priced, fingerprint, revisions, expires_at = entry
+            if (
+                fingerprint == self.fingerprint(cart)
+                and revisions == self.revisions(cart)
+                and (revisions is not None or expires_at > time.time())
+            ):
+                self._entries.move_to_end(cart["user_id"])
+                self.hits += 1
+                return priced
+            del self._entries[cart["user_id"]]
+        self.misses += 1
+        return None
+
+    def set(self, cart: Dict[str, Any], priced: PricedCart):
+        if self.max_size <= 0:
+            return
+        self._entries[cart["user_id"]] = (
+            priced, self.fingerprint(cart), self.revisions(cart), time.time() + self.ttl
+        )
+        self._entries.move_to_end(cart["user_id"])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
         }
-        await db.carts.insert_one(cart_data)
-        return Cart(**cart_data)
-    return Cart(**cart)
 
-@api_router.post("/cart/add")
-async def add_to_cart(item: CartItem, current_user: User = Depends(get_current_user)):
-    # Verify product exists
-    product = await db.products.find_one({"id": item.product_id})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
+priced_carts = PricedCartCache(PRICED_CART_CACHE_SIZE, PRICED_CART_TTL_SECONDS)
+
+async def price_cart(cart: Dict[str, Any]) -> PricedCart:
+    """Denormalize cart lines with current product data in one batched lookup."""
+    products = await find_products(item["product_id"] for item in cart.get("items", []))
+    lines = []
+    unavailable = []
+    for item in cart.get("items", []):
+        product = products.get(item["product_id"])
+        if product is None:
+            unavailable.append(item["product_id"])
+            continue
+        lines.append(PricedCartLine(
+            product_id=item["product_id"],
+            quantity=item["quantity"],
+            name=product["name"],
+            description=product["description"],
+            price=product["price"],
+            image_url=product["image_url"],
+            category=product["category"],
+            stock_quantity=product["stock_quantity"],
+            line_total=product["price"] * item["quantity"],
+        ))
+    return PricedCart(
+        id=cart["id"],
+        user_id=cart["user_id"],
+        items=lines,
+        unavailable_product_ids=unavailable,
+        item_count=sum(line.quantity for line in lines),
+        subtotal=round(sum(line.line_total for line in lines), 2),
+        updated_at=cart["updated_at"],
+    )
+
+@api_router.get("/cart/priced", response_model=PricedCart)
+async def get_priced_cart(current_user: User = Depends(get_current_user)):
+    """The cart with product names, prices and totals, so clients need no per-line lookups."""
+    cart = await load_cart(current_user.id)
+    priced = priced_carts.get(cart)
+    if priced is None:
+        priced = await price_cart(cart)
+        priced_carts.set(cart, priced)
+    return priced
+
+# Idempotency keys
+idempotency = IdempotencyStore(None, wait_seconds=IDEMPOTENCY_WAIT_SECONDS)
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+async def idempotent(operation: str, user: User, key: Optional[str], payload: BaseModel, handler):
+    """Run ``handler()`` once per ``Idempotency-Key``; retries get the first response back.
+
+    Keys are scoped to the user and operation and bound to the request body.
+    Without a key the handler simply runs. HTTP errors are passed to the
+    store as responses, which replays client errors like successes and
+    releases the key on server errors so a retry runs again. Replayed
+    responses carry ``Idempotent-Replayed: true``.
+    """
+    if key is None or not IDEMPOTENCY_ENABLED:
+        return await handler()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        detail = f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+        raise HTTPException(status_code=400, detail=detail)
     
-    # Get or create cart
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
-        cart = {
-            "id": str(uuid.uuid4()),
-            "user_id": current_user.id,
-            "items": [],
-            "updated_at": datetime.now(timezone.utc)
-        }
+    async def execute():
+        try:
+            result = await handler()
+        except HTTPException as exc:
+            return exc.status_code, json.dumps({"detail": exc.detail}).encode()
+        return 200, json.dumps(jsonable_encoder(result), separators=(",", ":")).encode()
     
-    # Update or add item
-    existing_item = None
-    for i, cart_item in enumerate(cart["items"]):
-        if cart_item["product_id"] == item.product_id:
-            existing_item = i
-            break
+    try:
+        status_code, body, replayed = await idempotency.run(
+            f"{user.id}:{operation}", key, fingerprint(operation, payload.model_dump(mode="json")), execute
+        )
+    except IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    except IdempotencyInProgress:
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still in progress",
+            headers={"Retry-After": "1"},
+        )
+    response = Response(content=body, status_code=status_code, media_type="application/json")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+@api_router.post("/cart/add")
+async def add_to_cart(
+    item: CartItem,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    async def handler():
+        # Verify product exists
+        product = await find_product(item.product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        
+        await cart_add_item(current_user.id, item.product_id, item.quantity)
+        return {"message": "Item added to cart"}
     
-    if existing_item is not None:
-        cart["items"][existing_item]["quantity"] += item.quantity
-    else:
-        cart["items"].append({"product_id": item.product_id, "quantity": item.quantity})
+    return await idempotent("cart.add", current_user, idempotency_key, item, handler)
+
+@api_router.post("/cart/bulk", response_model=Cart)
+async def bulk_update_cart(
+    update: CartBulkUpdate,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """Apply many cart changes in one request and return the resulting cart.
+
+    Operations on the same product run in the order given; different
+    products are updated concurrently. Accepts an ``Idempotency-Key``.
+    """
+    return await idempotent(
+        "cart.bulk", current_user, idempotency_key, update, lambda: apply_cart_operations(update, current_user)
+    )
+
+async def apply_cart_operations(update: CartBulkUpdate, current_user: User) -> Cart:
+    needed = {op.product_id for op in update.operations if op.action != "remove"}
+    products = await find_products(needed)
+    missing = sorted(needed - set(products))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Products not found: {', '.join(missing)}")
     
-    cart["updated_at"] = datetime.now(timezone.utc)
+    by_product: Dict[str, List[CartOperation]] = {}
+    for op in update.operations:
+        by_product.setdefault(op.product_id, []).append(op)
     
-    await db.carts.replace_one({"user_id": current_user.id}, cart, upsert=True)
-    return {"message": "Item added to cart"}
+    async def apply(operations: List[CartOperation]):
+        for op in operations:
+            if op.action == "add":
+                await cart_add_item(current_user.id, op.product_id, op.quantity)
+            elif op.action == "set":
+                await cart_set_item(current_user.id, op.product_id, op.quantity)
+            else:
+                await cart_remove_item(current_user.id, op.product_id)
+    
+    await asyncio.gather(*(apply(operations) for operations in by_product.values()))
+    return Cart(**await load_cart(current_user.id))
 
 @api_router.delete("/cart/remove/{product_id}")
 async def remove_from_cart(product_id: str, current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
+    if not await cart_remove_item(current_user.id, product_id):
         raise HTTPException(status_code=404, detail="Cart not found")
-    
-    cart["items"] = [item for item in cart["items"] if item["product_id"] != product_id]
-    cart["updated_at"] = datetime.now(timezone.utc)
-    
-    await db.carts.replace_one({"user_id": current_user.id}, cart)
     return {"message": "Item removed from cart"}
 
 # Order routes
-@api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
-    # Calculate total amount
+async def price_order_items(items: List[CartItem]) -> Tuple[List[Dict[str, Any]], float]:
+    """Validate and price order lines with a single batched product lookup."""
+    if not items:
+        raise HTTPException(status_code=400, detail="Order has no items")
+    products = await find_products(item.product_id for item in items)
+    
     total_amount = 0
     order_items = []
-    
-    for item in order_data.items:
-        product = await db.products.find_one({"id": item.product_id})
+    for item in items:
+        if item.quantity <= 0:
+            raise HTTPException(status_code=400, detail=f"Quantity for product {item.product_id} must be positive")
+        product = products.get(item.product_id)
         if not product:
             raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
         
@@ -380,10 +1553,178 @@ async def create_order(order_data: OrderCreate, current_user: User = Depends(get
         order_items.append({
             "product_id": item.product_id,
             "product_name": product["name"],
+            "category": product.get("category"),
             "price": product["price"],
             "quantity": item.quantity,
             "total": item_total
         })
+    return order_items, total_amount
+
+_transactions_supported: Optional[bool] = None
+
+async def transactions_supported() -> bool:
+    """Whether the server is a replica set member or mongos (checked once)."""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await client.admin.command("hello")
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except (PyMongoError, NotImplementedError):
+            _transactions_supported = False
+        logger.info(
+            "Order transactions %s", "available" if _transactions_supported else "unavailable; using compensation"
+        )
+    return ORDER_TRANSACTIONS_ENABLED and _transactions_supported
+
+async def release_stock(quantities: Dict[str, int], session=None):
+    for product_id, quantity in quantities.items():
+        await db.products.update_one(
+            {"id": product_id},
+            {"$inc": {"stock_quantity": quantity}, "$currentDate": {"updated_at": True}},
+            session=session,
+        )
+
+async def reserve_stock(quantities: Dict[str, int], session=None):
+    """Atomically decrement stock for every product, or for none of them.
+
+    Each product is decremented with a conditional ``$inc`` that only matches
+    while ``stock_quantity`` covers the quantity, so concurrent buyers can
+    never oversell. Inside a transaction the caller's abort undoes partial
+    work; without one, successful decrements are compensated here.
+    """
+    async def reserve(product_id: str, quantity: int) -> bool:
+        result = await db.products.update_one(
+            {"id": product_id, "stock_quantity": {"$gte": quantity}},
+            {"$inc": {"stock_quantity": -quantity}, "$currentDate": {"updated_at": True}},
+            session=session,
+        )
+        return result.modified_count == 1
+    
+    if session is not None:
+        # Operations in one session must not run concurrently
+        for product_id, quantity in quantities.items():
+            if not await reserve(product_id, quantity):
+                raise HTTPException(status_code=409, detail=f"Insufficient stock for product {product_id}")
+        return
+    
+    product_ids = list(quantities)
+    results = await asyncio.gather(
+        *(reserve(product_id, quantities[product_id]) for product_id in product_ids), return_exceptions=True
+    )
+    reserved = {
+        product_id: quantities[product_id] for product_id, result in zip(product_ids, results) if result is True
+    }
+    if len(reserved) == len(product_ids):
+        return
+    await release_stock(reserved)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    short = next(product_id for product_id, result in zip(product_ids, results) if result is False)
+    raise HTTPException(status_code=409, detail=f"Insufficient stock for product {short}")
+
+async def record_order_stats(order: Dict[str, Any], session=None):
+    """Fold one new order into the user's ``user_order_stats`` rollup."""
+    await db.user_order_stats.update_one(
+        {"user_id": order["user_id"]},
+        {
+            "$inc": {"order_count": 1, "item_count": order["item_count"], "total_spent": order["total_amount"]},
+            "$min": {"first_order_at": order["created_at"]},
+            "$max": {"last_order_at": order["created_at"]},
+        },
+        upsert=True,
+        session=session,
+    )
+
+outbox = Outbox(
+    None,
+    batch_size=OUTBOX_BATCH_SIZE,
+    poll_interval=OUTBOX_POLL_INTERVAL_SECONDS,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    lag=outbox_delivery_lag if METRICS_ENABLED else None,
+    events=outbox_events_total if METRICS_ENABLED else None,
+)
+
+async def place_order(order: Dict[str, Any]):
+    """Reserve stock, write the order and its ``order.created`` event and clear the cart as one unit.
+
+    Everything else that follows an order is an outbox handler, run after
+    the response has been sent.
+    """
+    quantities: Dict[str, int] = {}
+    for item in order["items"]:
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    event = outbox.event("order.created", order["id"], dict(order))
+    
+    if await transactions_supported():
+        async def write(session):
+            await reserve_stock(quantities, session=session)
+            await db.orders.insert_one(order, session=session)
+            await db.order_events.insert_one(event, session=session)
+            await db.carts.delete_one({"user_id": order["user_id"]}, session=session)
+            await record_order_stats(order, session=session)
+        
+        async with await client.start_session() as session:
+            await session.with_transaction(write)
+        outbox.notify()
+        return
+    
+    await reserve_stock(quantities)
+    try:
+        await db.orders.insert_one(order)
+        try:
+            await db.order_events.insert_one(event)
+        except BaseException:
+            await db.orders.delete_one({"id": order["id"]})
+            raise
+    except BaseException:
+        await release_stock(quantities)
+        raise
+    outbox.notify()
+    await db.carts.delete_one({"user_id": order["user_id"]})
+    try:
+        await record_order_stats(order)
+    except PyMongoError:
+        # The order stands; rebuild_order_stats() repairs the rollup
+        logger.exception("Failed to update order stats for user %s", order["user_id"])
+
+sales_rollups = SalesRollups(None, None, None)
+
+async def roll_up_order_sales(event: Dict[str, Any]):
+    """Outbox handler: fold a new order into the sales rollups."""
+    order = event["payload"]
+    # Orders placed before lines carried their category
+    missing = [item["product_id"] for item in order["items"] if not item.get("category")]
+    if missing:
+        products = await find_products(missing)
+        for item in order["items"]:
+            if not item.get("category") and item["product_id"] in products:
+                item["category"] = products[item["product_id"]].get("category")
+    if await transactions_supported():
+        async def write(session):
+            await sales_rollups.apply_order(order, session=session)
+        
+        async with await client.start_session() as session:
+            await session.with_transaction(write)
+        return
+    await sales_rollups.apply_order(order)
+
+if SALES_ROLLUPS_ENABLED:
+    outbox.register("order.created", roll_up_order_sales, name="sales_rollups")
+
+@api_router.post("/orders", response_model=Order)
+async def create_order(
+    order_data: OrderCreate,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """Price and place an order. Send an ``Idempotency-Key`` so retries cannot place it twice."""
+    return await idempotent(
+        "orders.create", current_user, idempotency_key, order_data, lambda: place_new_order(order_data, current_user)
+    )
+
+async def place_new_order(order_data: OrderCreate, current_user: User) -> Order:
+    order_items, total_amount = await price_order_items(order_data.items)
     
     # Create order
     order = {
@@ -394,32 +1735,339 @@ async def create_order(order_data: OrderCreate, current_user: User = Depends(get
         "payment_method": order_data.payment_method,
         "status": "pending",
         "shipping_address": order_data.shipping_address,
-        "created_at": datetime.now(timezone.utc)
+        "created_at": datetime.now(timezone.utc),
+        "item_count": sum(item["quantity"] for item in order_items),
     }
     
-    await db.orders.insert_one(order)
-    
-    # Clear cart
-    await db.carts.delete_one({"user_id": current_user.id})
+    await place_order(order)
     
     return Order(**order)
 
-@api_router.get("/orders", response_model=List[Order])
-async def get_user_orders(current_user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user.id}).sort("created_at", -1).to_list(50)
+ORDER_PAGE_MAX_LIMIT = 200
+
+@api_router.get("/orders", response_model=List[Union[Order, OrderSummary]])
+async def get_user_orders(
+    response: Response,
+    limit: int = Query(50, ge=1, le=ORDER_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    view: Literal["full", "summary"] = "full",
+    current_user: User = Depends(get_current_user),
+):
+    """The user's orders, newest first, a page at a time.
+
+    Pages are keyset-paginated on (``created_at``, id); the next page's
+    cursor is returned in the ``X-Next-Cursor`` header. ``view=summary``
+    returns only id, date, total, status and item count per order; the
+    full order is at ``/orders/{order_id}``.
+    """
+    query: Dict[str, Any] = {"user_id": current_user.id}
+    if cursor:
+        after = decode_cursor(cursor)
+        query.update(keyset_filter("created_at", DESCENDING, after))
+    order_by = [("created_at", DESCENDING), ("id", DESCENDING)]
+    
+    if view == "summary":
+        summary = {"_id": 0, **{field: 1 for field in ORDER_SUMMARY_FIELDS}}
+        # Orders placed before item_count was stored get it computed from their lines
+        summary["item_count"] = {"$ifNull": ["$item_count", {"$sum": "$items.quantity"}]}
+        pipeline = [{"$match": query}, {"$sort": dict(order_by)}, {"$limit": limit + 1}, {"$project": summary}]
+        orders = await db.orders.aggregate(pipeline).to_list(limit + 1)
+        fields = ORDER_SUMMARY_FIELDS
+    else:
+        projection = {"_id": 0, **{field: 1 for field in ORDER_FIELDS}}
+        orders = await db.orders.find(query, projection).sort(order_by).to_list(limit + 1)
+        fields = ORDER_FIELDS
+    
+    if len(orders) > limit:
+        orders = orders[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor({"v": orders[-1]["created_at"], "id": orders[-1]["id"]})
+    if FAST_JSON_RESPONSES:
+        return fast_json_response(response, orders, fields)
+    if view == "summary":
+        return [OrderSummary(**order) for order in orders]
     return [Order(**order) for order in orders]
 
+@api_router.get("/orders/stats", response_model=OrderStats)
+async def get_user_order_stats(current_user: User = Depends(get_current_user)):
+    """Order count, units and spend for the user, read from the precomputed rollup."""
+    stats = await db.user_order_stats.find_one({"user_id": current_user.id}, {"_id": 0, "user_id": 0})
+    if stats is None:
+        # No rollup yet: either no orders, or orders predating the rollup
+        stats = await aggregate_order_stats({"user_id": current_user.id})
+        stats = stats[0] if stats else {}
+    return OrderStats(**stats)
+
+@api_router.get("/orders/{order_id}", response_model=Order)
+async def get_order(order_id: str, response: Response, current_user: User = Depends(get_current_user)):
+    query: Dict[str, Any] = {"id": order_id}
+    if not current_user.is_admin:
+        query["user_id"] = current_user.id
+    order = await db.orders.find_one(query, {"_id": 0, **{field: 1 for field in ORDER_FIELDS}})
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if FAST_JSON_RESPONSES:
+        return fast_json_response(response, order, ORDER_FIELDS)
+    return Order(**order)
+
+async def aggregate_order_stats(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Compute ``user_order_stats`` documents from the orders themselves."""
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$user_id",
+            "order_count": {"$sum": 1},
+            "item_count": {"$sum": {"$ifNull": ["$item_count", {"$sum": "$items.quantity"}]}},
+            "total_spent": {"$sum": "$total_amount"},
+            "first_order_at": {"$min": "$created_at"},
+            "last_order_at": {"$max": "$created_at"},
+        }},
+    ]
+    stats = await db.orders.aggregate(pipeline).to_list(None)
+    for document in stats:
+        document["user_id"] = document.pop("_id")
+    return stats
+
+async def rebuild_order_stats() -> int:
+    """Recompute every user's rollup from ``orders``; returns the number of users.
+
+    Needed once for orders placed before the rollup existed, and to repair
+    it after a failed update. Orders placed while it runs may be counted
+    twice or not at all, so run it when order traffic is quiet.
+    """
+    stats = await aggregate_order_stats({})
+    for start in range(0, len(stats), 1000):
+        batch = stats[start:start + 1000]
+        await db.user_order_stats.bulk_write(
+            [ReplaceOne({"user_id": document["user_id"]}, document, upsert=True) for document in batch],
+            ordered=False,
+        )
+    return len(stats)
+
+# Admin routes
+def runtime_stats() -> Dict[str, Any]:
+    return {
+        "auth_cache": user_cache.stats(),
+        "password_pool": password_pool.stats(),
+        "indexes": getattr(app.state, "index_report", None),
+        "catalog": catalog.stats(),
+        "catalog_snapshot_publisher": snapshot_publisher.stats() if snapshot_publisher else None,
+        "token_revocations": revocations.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "single_flight": product_reads.stats(),
+        "priced_carts": priced_carts.stats(),
+        "product_search": search_index().stats(),
+        "related_products": related_index().stats(),
+        "catalog_watcher": catalog_watcher.stats() if not CATALOG_CACHE_ENABLED else None,
+        "database": database.stats(),
+        "lifecycle": lifecycle.stats(),
+        "outbox": outbox.stats(),
+        "sales_rollups": sales_rollups.stats(),
+        "idempotency": idempotency.stats(),
+    }
+
+@api_router.get("/admin/stats")
+async def get_runtime_stats(current_user: User = Depends(get_current_admin_user)):
+    return runtime_stats()
+
+@api_router.post("/admin/products/import")
+async def import_products_route(
+    request: Request,
+    file_format: Optional[Literal["ndjson", "csv"]] = Query(None, alias="format"),
+    chunk_size: int = Query(1000, ge=1, le=10000),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Upsert products from a streamed NDJSON or CSV request body, keyed by ``id``.
+
+    The format defaults from the Content-Type (``text/csv`` or NDJSON). Rows
+    are validated against ProductCreate; rows without an ``id`` are
+    inserted under a new one. Invalid rows are reported and skipped, the
+    rest are written.
+    """
+    if file_format is None:
+        file_format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    parse = csv_rows if file_format == "csv" else ndjson_rows
+    report = await import_products(parse(request.stream()), db.products, ProductCreate, chunk_size=chunk_size)
+    if report["inserted"] or report["updated"]:
+        logger.info("Imported products: %d inserted, %d updated", report["inserted"], report["updated"])
+        if catalog_source.ready and catalog_source.mode == "polling":
+            # A change stream picks the writes up by itself
+            await catalog_source.load()
+        catalog_watcher.wake()
+    return report
+
+@api_router.get("/admin/products/export")
+async def export_products_route(
+    file_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Stream every product as NDJSON or CSV, in the formats the import accepts."""
+    cursor = db.products.find({}, {"_id": 0}).sort("id", ASCENDING).batch_size(1000)
+    if file_format == "csv":
+        body, media_type = export_csv(cursor), "text/csv; charset=utf-8"
+    else:
+        body, media_type = export_ndjson(cursor), "application/x-ndjson"
+    return StreamingResponse(
+        body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="products.{file_format}"'}
+    )
+
+@api_router.post("/admin/order-stats/rebuild")
+async def rebuild_order_stats_route(current_user: User = Depends(get_current_admin_user)):
+    return {"users": await rebuild_order_stats()}
+
+@api_router.post("/admin/outbox/requeue")
+async def requeue_outbox_route(current_user: User = Depends(get_current_admin_user)):
+    """Retry order events parked after exhausting their delivery attempts."""
+    return {"requeued": await outbox.requeue_failed()}
+
+# Longest range one analytics query may span, in buckets
+ANALYTICS_MAX_BUCKETS = {"hour": 24 * 93, "day": 3 * 366}
+
+def analytics_range(
+    granularity: str, start: Optional[datetime], end: Optional[datetime]
+) -> Tuple[datetime, datetime]:
+    default_start, default_end = default_range(granularity)
+    start = start or default_start
+    end = end or default_end
+    start, end = [value if value.tzinfo else value.replace(tzinfo=timezone.utc) for value in (start, end)]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    span = (end - start) / (timedelta(hours=1) if granularity == "hour" else timedelta(days=1))
+    limit = ANALYTICS_MAX_BUCKETS[granularity]
+    if span > limit:
+        raise HTTPException(status_code=400, detail=f"Range spans more than {limit} {granularity} buckets")
+    return start, end
+
+@api_router.get("/admin/analytics/sales")
+async def get_sales_series(
+    granularity: Literal["hour", "day"] = "day",
+    dimension: Literal["total", "category", "product"] = "total",
+    key: str = Query("all", description="Category or product id; \"all\" for the store total"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Orders, units and revenue per bucket in [start, end); buckets without sales are omitted.
+
+    Defaults to the last 48 hours or 30 days. Reads one rollup document per bucket.
+    """
+    start, end = analytics_range(granularity, start, end)
+    return await sales_rollups.series(granularity, dimension, key, start, end)
+
+@api_router.get("/admin/analytics/top")
+async def get_top_sellers(
+    dimension: Literal["category", "product"] = "product",
+    granularity: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Categories or products by revenue in [start, end), from the rollups."""
+    start, end = analytics_range(granularity, start, end)
+    top = await sales_rollups.top(granularity, dimension, start, end, limit)
+    if dimension == "product":
+        products = await find_products(entry["key"] for entry in top)
+        for entry in top:
+            entry["name"] = products.get(entry["key"], {}).get("name")
+    return top
+
+@api_router.post("/admin/analytics/rebuild")
+async def rebuild_sales_rollups_route(current_user: User = Depends(get_current_admin_user)):
+    """Recompute every rollup before the current UTC day from ``orders`` (pandas backfill)."""
+    if catalog_available():
+        categories = {product["id"]: product.get("category") for product in catalog.products()}
+    else:
+        cursor = db.products.find({}, {"_id": 0, "id": 1, "category": 1})
+        categories = {product["id"]: product.get("category") async for product in cursor}
+    return await sales_rollups.backfill(db.orders, categories)
+
+def _numeric_stats(stats: Dict[str, Any], prefix: str = ""):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _numeric_stats(value, f"{prefix}{key}_")
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{key}", float(value)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition; served outside /api so it stays off the public ingress."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    for component, stats in runtime_stats().items():
+        if isinstance(stats, dict) and component != "indexes":
+            for stat, value in _numeric_stats(stats):
+                runtime_stat.set(value, component, stat)
+    return PlainTextResponse(metrics_registry.expose(), media_type="text/plain; version=0.0.4")
+
+# Probes hit the app in bursts from every load balancer; share one ping between them
+health_checks = SingleFlight()
+
+async def mongo_health() -> Dict[str, Any]:
+    if database.client is None:
+        return {"ok": False, "error": "not connected"}
+    return await health_checks.do("mongo", lambda: database.check(HEALTH_CHECK_TIMEOUT_SECONDS))
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process and its event loop respond. Mongo is reported, not required."""
+    return {"status": "ok", "mongo": await mongo_health(), **lifecycle.stats()}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: started, not draining, and Mongo answering within READINESS_MAX_MONGO_LATENCY_MS."""
+    mongo = await mongo_health()
+    ready = (
+        lifecycle.ready
+        and not lifecycle.draining
+        and mongo["ok"]
+        and mongo["latency_ms"] <= READINESS_MAX_MONGO_LATENCY_MS
+    )
+    body = {"status": "ready" if ready else "unavailable", "mongo": mongo, **lifecycle.stats()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+def token_subject(token: str) -> Optional[str]:
+    """Verified ``sub`` of a bearer token, for per-user rate limit buckets."""
+    try:
+        return key_ring.decode(token).get("sub")
+    except jwt.PyJWTError:
+        return None
+
+rate_limiter = RateLimiter(
+    RATE_LIMIT_RULES,
+    store=MongoBucketStore(None) if RATE_LIMIT_STORE == "mongo" else MemoryBucketStore(),
+    subject=token_subject,
+    proxy_hops=RATE_LIMIT_PROXY_HOPS,
+)
+
+# Inside CORS so that 429 responses still carry CORS headers
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Catalog-Version", "Retry-After", "Idempotent-Replayed"],
 )
 
+app.add_middleware(
+    LifecycleMiddleware, lifecycle=lifecycle, exempt_paths=frozenset({"/healthz", "/readyz", "/metrics"})
+)
+
+# Added last so it is outermost and times the whole stack
+if METRICS_ENABLED:
+    app.add_middleware(
+        MetricsMiddleware,
+        requests=http_requests_total,
+        latency=http_request_duration,
+        in_flight=http_requests_in_flight,
+    )
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -427,10 +2075,89 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-async def startup_event():
+def bind_database():
+    """Point module state at the connected database."""
+    global client, db
+    db = database.connect()
+    client = database.client
+    catalog_source.collection = db.products
+    catalog_watcher.collection = db.products
+    revocations.collection = db.revoked_tokens
+    outbox.collection = db.order_events
+    sales_rollups.collection = db.sales_rollups
+    sales_rollups.applied = db.sales_rollup_orders
+    sales_rollups.state = db.analytics_state
+    idempotency.collection = db.idempotency_keys
+    if isinstance(rate_limiter.store, MongoBucketStore):
+        rate_limiter.store.collection = db.rate_limits
+
+async def startup():
+    """Connect, warm the pool and load in-memory state; only then report ready."""
+    bind_database()
+    if METRICS_ENABLED:
+        loop_lag_monitor.start()
+    await database.warmup()
+    app.state.index_report = await ensure_indexes()
+    await revocations.sync()
+    revocations.start()
     await init_sample_data()
+    if CATALOG_CACHE_ENABLED:
+        if snapshot_publisher is None:
+            if PRODUCT_SEARCH_BACKEND == "memory":
+                catalog.subscribe(sync_search_index)
+            if RELATED_PRODUCTS_ENABLED:
+                catalog.subscribe(sync_related_index)
+            await catalog.load()
+        else:
+            if CATALOG_SNAPSHOT_PUBLISH:
+                await catalog_source.load()
+                catalog_source.start()
+                await snapshot_publisher.publish()
+                snapshot_publisher.start()
+            await catalog.load(wait=CATALOG_SNAPSHOT_WAIT_SECONDS)
+        catalog.start()
+    elif PRODUCT_SEARCH_BACKEND == "memory" or RELATED_PRODUCTS_ENABLED:
+        # Record the signature first, so writes during the build trigger the next refresh
+        await catalog_watcher.changed()
+        await rebuild_catalog_indexes()
+        catalog_watcher.start()
+    if OUTBOX_WORKER_ENABLED:
+        outbox.start()
+    lifecycle.draining = False
+    lifecycle.ready = True
+    if SHUTDOWN_GRACE_SECONDS > 0:
+        lifecycle.drain_on_sigterm(SHUTDOWN_GRACE_SECONDS)
+
+async def shutdown():
+    """Fail readiness, let in-flight requests finish, then release resources."""
+    await lifecycle.drain(SHUTDOWN_DRAIN_SECONDS)
+    await outbox.stop()
+    if snapshot_publisher is not None:
+        await snapshot_publisher.stop()
+        await catalog_source.stop()
+    await catalog.stop()
+    await catalog_watcher.stop()
+    await revocations.stop()
+    await loop_lag_monitor.stop()
+    database.close()
+    password_pool.shutdown()
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+def run_standalone(name: str, start: Callable[[], Awaitable[Any]], stop: Callable[[], Awaitable[Any]]):
+    """Run one component as its own process next to the API workers (``python outbox.py``, ``python snapshot.py``).
+
+    Connects to Mongo, awaits ``start``, runs until SIGINT or SIGTERM, then awaits ``stop`` and disconnects.
+    """
+    async def run():
+        bind_database()
+        await database.warmup()
+        await start()
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        logger.info("%s started", name)
+        await stopping.wait()
+        await stop()
+        database.close()
+    
+    asyncio.run(run())
@@ -0,0 +1,79 @@
+"""Coalesce identical concurrent reads into one database call.
+
+The first caller for a key starts the fetch; callers arriving while it is
+in flight await the same result instead of issuing their own query. Nothing
+is cached: once the fetch finishes the key is forgotten, so the next call
+goes to the database again.
+
+Every caller receives the same result object, so results must be treated
+as read-only (as documents from the catalog cache already are).
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+def freeze(value: Any) -> Hashable:
+    """A hashable, order-independent form of a query value."""
+    if isinstance(value, dict):
+        return tuple(sorted((str(key), freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(freeze(item) for item in value))
+    return value
+
+
+def fold_text(value: str) -> str:
+    """Case- and whitespace-insensitive form for free-text parameters."""
+    return " ".join(value.lower().split())
+
+
+class SingleFlight:
+    """In-flight request de-duplication keyed by normalized parameters.
+
+    ``normalizers`` maps a parameter name to a function applied to its value
+    before it becomes part of the key, e.g. folding case for search text.
+    Parameters that are ``None`` are left out of the key.
+    """
+
+    def __init__(self, normalizers: Optional[Dict[str, Callable[[Any], Any]]] = None):
+        self.normalizers = normalizers or {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.executions = 0
+
+    def key(self, operation: str, **params: Any) -> Hashable:
+        normalized = {
+            name: self.normalizers[name](value) if name in self.normalizers else value
+            for name, value in params.items()
+            if value is not None
+        }
+        return operation, freeze(normalized)
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is None:
+            self.executions += 1
+            # A task of its own, so a cancelled caller does not cancel the others
+            future = asyncio.ensure_future(fetch())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(future)
+
+    def _finished(self, key: Hashable, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # Mark the exception retrieved even if every caller went away
+            future.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        coalesced = self.calls - self.executions
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": coalesced,
+            "coalesced_ratio": coalesced / self.calls if self.calls else 0.0,
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,962 @@
+"""Catalog snapshots shared by worker processes through a memory-mapped file.
+
+With several API workers each ``CatalogCache`` would hold its own copy of
+every product, so memory and Mongo load grow with the worker count. In
+snapshot mode one process (``SnapshotPublisher``, in a worker started with
+``CATALOG_SNAPSHOT_PUBLISH=true`` or in ``python snapshot.py``) keeps the
+cache fresh and writes it out as a versioned file; every worker maps the
+current file read-only with ``CatalogSnapshot``, so the pages live once in
+the OS page cache however many workers read them.
+
+A snapshot file is a small JSON header followed by 8-byte aligned sections:
+the products as concatenated BSON documents, their ids, and fixed-width
+numpy columns (id hashes, content hashes, revisions, category codes,
+``featured`` flags and one row order per listing sort). Columns are viewed
+in place with ``np.frombuffer``; a product is only decoded when it is read.
+
+The publisher also keeps the search and related-products indexes and
+writes their query-time arrays into the same file, with rows in snapshot
+row order. Workers serve queries from read-only views of those sections
+(``ProductSearchIndex.mapped``), so the indexes too exist once per host
+instead of once per worker.
+
+Publishing writes ``catalog-<version>.snap`` next to the current one and
+then swaps the ``CURRENT`` pointer with ``os.replace``. Readers poll the
+pointer and switch to the new file between requests. Old files are
+unlinked after ``keep`` newer ones exist; a worker that still maps one
+keeps reading it until it swaps.
+
+Most catalog writes only move stock (and ``updated_at`` with it), so those
+fields (``LIVE_FIELDS``) are not part of the BSON documents but int64
+columns, overlaid when a document is decoded. When nothing else changed
+the publisher overwrites these columns, the content hashes and revisions
+of the changed rows in the current file, and then its ``state`` section
+(version and digest) under a sequence counter that readers check, as in a
+seqlock. Readers see such a patch at once, between or during requests;
+everything else about a product only changes with a new file. Rewrites
+are spaced out by their own cost, see ``SnapshotPublisher``.
+"""
+import asyncio
+import bisect
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import bson
+import numpy as np
+from pymongo import ASCENDING
+
+from catalog import CatalogCache, ChangeListener, _sort_key
+from related import RelatedProductsIndex
+from search import ProductSearchIndex
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RHCATSNP"
+FORMAT_VERSION = 3
+POINTER = "CURRENT"
+LOCK = ".publish.lock"
+ALIGNMENT = 8
+# Listing sorts the snapshot keeps a precomputed row order for
+SORT_FIELDS = ("created_at", "price", "name")
+FEATURED_CODES = {True: 1, False: 0}
+# Fields stored in fixed-width columns the publisher can patch in place
+LIVE_FIELDS = ("stock_quantity", "updated_at")
+# Live column entry of a product without the field
+MISSING = int(np.iinfo(np.int64).min)
+EPOCH = datetime(1970, 1, 1)
+# Reads of the state section retried while a patch is being written
+STATE_READ_ATTEMPTS = 100
+_HALF = (1 << 64) - 1
+# Indexes a snapshot may carry, by section prefix
+INDEX_TYPES = {"search": ProductSearchIndex, "related": RelatedProductsIndex}
+
+
+def key_hash(product_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(product_id.encode(), digest_size=8).digest(), "little")
+
+
+def snapshot_name(version: int) -> str:
+    return f"catalog-{version:012d}.snap"
+
+
+def snapshot_version(name: str) -> Optional[int]:
+    if not (name.startswith("catalog-") and name.endswith(".snap")):
+        return None
+    try:
+        return int(name[len("catalog-"):-len(".snap")])
+    except ValueError:
+        return None
+
+
+def live_value(field: str, value: Any) -> Optional[int]:
+    """``value`` as its live column entry, or None if it has to stay in the document."""
+    if field == "updated_at":
+        if not isinstance(value, datetime):
+            return None
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        # BSON keeps milliseconds, and decodes to naive UTC
+        return (value - EPOCH) // timedelta(milliseconds=1)
+    if isinstance(value, int) and not isinstance(value, bool) and MISSING < value < 1 << 63:
+        return value
+    return None
+
+
+def decode_live(field: str, value: int) -> Any:
+    return EPOCH + timedelta(milliseconds=value) if field == "updated_at" else value
+
+
+def split_live(product: Dict[str, Any]) -> Tuple[bytes, Dict[str, int]]:
+    """The BSON document of ``product`` without its live fields, and their column entries."""
+    document, values = dict(product), {}
+    for field in LIVE_FIELDS:
+        value = live_value(field, document[field]) if field in document else None
+        if value is None:
+            values[field] = MISSING
+        else:
+            values[field] = value
+            del document[field]
+    return bson.encode(document), values
+
+
+def string_sections(strings: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """UTF-8 bytes, offsets and sorted order of ``strings``, for ``MappedStrings``."""
+    encoded = [string.encode() for string in strings]
+    return (
+        np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        np.concatenate(([0], np.cumsum([len(string) for string in encoded]))).astype(np.uint64),
+        np.array(sorted(range(len(strings)), key=strings.__getitem__), dtype=np.int32),
+    )
+
+
+def write_snapshot(
+    directory: str,
+    version: int,
+    products: List[Dict[str, Any]],
+    hashes: List[int],
+    revisions: List[int],
+    digest: int,
+    indexes: Optional[Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]]] = None,
+) -> str:
+    """Write ``products`` as snapshot ``version`` and return its path; the pointer is not moved.
+
+    ``indexes`` maps an ``INDEX_TYPES`` name to the ``export`` of that
+    index over ``products`` in this order.
+    """
+    count = len(products)
+    documents, live = [], {field: [] for field in LIVE_FIELDS}
+    document_sizes = []
+    for product in products:
+        document, values = split_live(product)
+        documents.append(document)
+        document_sizes.append(len(document))
+        for field, value in values.items():
+            live[field].append(value)
+    ids = [product["id"].encode() for product in products]
+    categories = sorted({product["category"] for product in products if isinstance(product.get("category"), str)})
+    category_codes = {category: code for code, category in enumerate(categories)}
+    keys = np.fromiter((key_hash(product["id"]) for product in products), dtype=np.uint64, count=count)
+    key_rows = np.argsort(keys, kind="stable").astype(np.int32)
+    sections = {
+        # Patched in place: sequence (odd while a patch is written), version, digest
+        "state": np.array([0, version, digest >> 64, digest & _HALF], dtype=np.uint64),
+        "documents": np.frombuffer(b"".join(documents), dtype=np.uint8),
+        "document_offsets": np.concatenate(([0], np.cumsum(document_sizes))).astype(np.uint64),
+        "ids": np.frombuffer(b"".join(ids), dtype=np.uint8),
+        "id_offsets": np.concatenate(([0], np.cumsum([len(product_id) for product_id in ids]))).astype(np.uint64),
+        "keys": keys[key_rows],
+        "key_rows": key_rows,
+        "hashes": np.array([(value >> 64, value & _HALF) for value in hashes], dtype=np.uint64).reshape(count, 2),
+        "revisions": np.array(revisions, dtype=np.int64),
+        "category": np.array(
+            [category_codes.get(product.get("category"), -1) for product in products], dtype=np.int32
+        ),
+        "featured": np.array(
+            [FEATURED_CODES.get(product.get("featured"), -1) for product in products], dtype=np.int8
+        ),
+        **{f"live.{field}": np.array(values, dtype=np.int64) for field, values in live.items()},
+    }
+    for field in SORT_FIELDS:
+        ordered = sorted(range(count), key=lambda row: (_sort_key(products[row].get(field)), products[row]["id"]))
+        sections[f"order_{field}"] = np.array(ordered, dtype=np.int32)
+    index_headers = {}
+    for name, (index_sections, settings) in (indexes or {}).items():
+        strings = []
+        for key, value in index_sections.items():
+            if isinstance(value, list):
+                strings.append(key)
+                (sections[f"{name}.{key}"], sections[f"{name}.{key}.offsets"],
+                 sections[f"{name}.{key}.order"]) = string_sections(value)
+            else:
+                sections[f"{name}.{key}"] = np.ascontiguousarray(value)
+        index_headers[name] = {"settings": settings, "strings": strings}
+
+    layout, offset = {}, 0
+    for name, array in sections.items():
+        layout[name] = [offset, array.dtype.str, list(array.shape)]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({
+        "format": FORMAT_VERSION,
+        "version": version,
+        "count": count,
+        "digest": f"{digest:032x}",
+        "categories": categories,
+        "indexes": index_headers,
+        "live_fields": list(LIVE_FIELDS),
+        "published_at": time.time(),
+        "sections": layout,
+    }, separators=(",", ":")).encode()
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % ALIGNMENT)
+
+    path = os.path.join(directory, snapshot_name(version))
+    partial = path + ".partial"
+    with open(partial, "wb") as file:
+        file.write(MAGIC + len(header).to_bytes(4, "little") + header)
+        for array in sections.values():
+            data = array.tobytes()
+            file.write(data + b"\0" * (-len(data) % ALIGNMENT))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial, path)
+    return path
+
+
+def read_pointer(directory: str) -> Optional[str]:
+    """File name of the current snapshot, or None if nothing has been published."""
+    try:
+        with open(os.path.join(directory, POINTER)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish_pointer(directory: str, name: str):
+    path = os.path.join(directory, POINTER)
+    with open(path + ".partial", "w") as file:
+        file.write(name)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".partial", path)
+
+
+class Snapshot:
+    """One mapped snapshot file; columns are views into the mapping, writable only for the publisher."""
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        with open(path, "r+b" if writable else "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        header_length = int.from_bytes(self._map[len(MAGIC):len(MAGIC) + 4], "little")
+        start = len(MAGIC) + 4
+        header = json.loads(self._map[start:start + header_length])
+        if header["format"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has snapshot format {header['format']}, expected {FORMAT_VERSION}")
+        # The version the file was written at; patches move ``version`` past it
+        self.base_version: int = header["version"]
+        self.count: int = header["count"]
+        self.published_at: float = header["published_at"]
+        self.category_codes = {category: code for code, category in enumerate(header["categories"])}
+        self.indexes: Dict[str, Dict[str, Any]] = header["indexes"]
+        data_start = start + header_length
+        self.columns: Dict[str, np.ndarray] = {}
+        for name, (offset, dtype, shape) in header["sections"].items():
+            dtype = np.dtype(dtype)
+            self.columns[name] = np.frombuffer(
+                self._map, dtype=dtype, count=int(np.prod(shape)), offset=data_start + offset
+            ).reshape(shape)
+        self._documents = memoryview(self._map)[data_start + header["sections"]["documents"][0]:]
+        self._ids = memoryview(self._map)[data_start + header["sections"]["ids"][0]:]
+        # Point lookups index these per request; memoryviews yield plain ints far cheaper than numpy scalars
+        self._document_offsets = memoryview(self.columns["document_offsets"])
+        self._id_offsets = memoryview(self.columns["id_offsets"])
+        self._keys = memoryview(self.columns["keys"])
+        self._key_rows = memoryview(self.columns["key_rows"])
+        self._live = [(field, memoryview(self.columns[f"live.{field}"])) for field in header["live_fields"]]
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def size(self) -> int:
+        return len(self._map)
+
+    def state(self) -> Tuple[int, int]:
+        """``(version, digest)`` as of the last complete patch."""
+        state = self.columns["state"]
+        for _ in range(STATE_READ_ATTEMPTS):
+            sequence = int(state[0])
+            version, high, low = state[1:].tolist()
+            if sequence % 2 == 0 and int(state[0]) == sequence:
+                break
+        # A publisher that died mid-patch leaves the sequence odd; its values are still whole numbers
+        return version, (high << 64) | low
+
+    @property
+    def version(self) -> int:
+        return self.state()[0]
+
+    @property
+    def digest(self) -> int:
+        return self.state()[1]
+
+    @property
+    def patching(self) -> bool:
+        """True if a patch is being written, or its writer died halfway."""
+        return int(self.columns["state"][0]) % 2 == 1
+
+    def product_id(self, row: int) -> str:
+        return bytes(self._ids[self._id_offsets[row]:self._id_offsets[row + 1]]).decode()
+
+    def document(self, row: int) -> Dict[str, Any]:
+        document = bson.decode(self._documents[self._document_offsets[row]:self._document_offsets[row + 1]])
+        for field, column in self._live:
+            value = column[row]
+            if value != MISSING:
+                document[field] = decode_live(field, value)
+        return document
+
+    def static_document(self, row: int) -> bytes:
+        """The stored BSON of ``row``, without its live fields."""
+        return bytes(self._documents[self._document_offsets[row]:self._document_offsets[row + 1]])
+
+    def patch(self, changes: List[Tuple[int, int, Dict[str, int]]], version: int, digest: int):
+        """Overwrite ``(row, content hash, live values)`` in place and move the file to ``version``."""
+        state = self.columns["state"]
+        state[0] += 1
+        for row, value, live in changes:
+            self.columns["hashes"][row] = (value >> 64, value & _HALF)
+            self.columns["revisions"][row] = version
+            for field, entry in live.items():
+                self.columns[f"live.{field}"][row] = entry
+        state[1:] = (version, digest >> 64, digest & _HALF)
+        state[0] += 1
+
+    def row(self, product_id: str) -> Optional[int]:
+        key = key_hash(product_id)
+        position = bisect.bisect_left(self._keys, key)
+        # Equal id hashes sit next to each other; the id itself settles a collision
+        while position < self.count and self._keys[position] == key:
+            row = self._key_rows[position]
+            if self.product_id(row) == product_id:
+                return row
+            position += 1
+        return None
+
+    def rows(self, product_ids: List[str]) -> Dict[str, int]:
+        if not product_ids or not self.count:
+            return {}
+        keys = np.fromiter(map(key_hash, product_ids), dtype=np.uint64, count=len(product_ids))
+        positions = np.searchsorted(self.columns["keys"], keys)
+        hits = positions < self.count
+        hits[hits] = self.columns["keys"][positions[hits]] == keys[hits]
+        found = {}
+        for index in np.flatnonzero(hits).tolist():
+            product_id = product_ids[index]
+            row = self._key_rows[int(positions[index])]
+            if self.product_id(row) != product_id:
+                row = self.row(product_id)
+            if row is not None:
+                found[product_id] = row
+        return found
+
+    def index_sections(self, name: str) -> Dict[str, Any]:
+        """The ``export``-ed sections of index ``name``, as views into the mapping."""
+        prefix = f"{name}."
+        sections = {key[len(prefix):]: column for key, column in self.columns.items() if key.startswith(prefix)}
+        for key in self.indexes[name]["strings"]:
+            sections[key] = MappedStrings(
+                sections[key], sections.pop(f"{key}.offsets"), sections.pop(f"{key}.order")
+            )
+        return sections
+
+    def content_hash(self, row: int) -> int:
+        high, low = self.columns["hashes"][row].tolist()
+        return (high << 64) | low
+
+    def revision(self, row: int) -> int:
+        return int(self.columns["revisions"][row])
+
+
+class MappedStrings:
+    """Strings packed by ``string_sections``: read by position, found with ``get``."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, order: np.ndarray):
+        self._data = memoryview(data)
+        self._offsets = memoryview(offsets)
+        self._order = memoryview(order)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __getitem__(self, position: int) -> str:
+        return bytes(self._data[self._offsets[position]:self._offsets[position + 1]]).decode()
+
+    def get(self, value: str) -> Optional[int]:
+        found = bisect.bisect_left(self._order, value, key=self.__getitem__)
+        if found < len(self._order) and self[self._order[found]] == value:
+            return self._order[found]
+        return None
+
+
+class _ProductKeys:
+    """Row <-> product id of a snapshot, in the shape mapped indexes expect."""
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self) -> int:
+        return self.snapshot.count
+
+    def __getitem__(self, row: int) -> str:
+        return self.snapshot.product_id(row)
+
+    def get(self, product_id: str) -> Optional[int]:
+        return self.snapshot.row(product_id)
+
+
+class _SortKeys:
+    """Lazy (sort key, id) sequence over a row order, for bisecting a keyset cursor."""
+
+    def __init__(self, snapshot: Snapshot, order: np.ndarray, field: str):
+        self.snapshot = snapshot
+        self.order = order
+        self.field = field
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __getitem__(self, position: int) -> Tuple:
+        row = int(self.order[position])
+        return (_sort_key(self.snapshot.document(row).get(self.field)), self.snapshot.product_id(row))
+
+
+class CatalogSnapshot:
+    """Read side of snapshot mode, with the read interface of ``CatalogCache``.
+
+    ``version`` is the published snapshot version, the same in every worker.
+    Listeners are called with the products that changed between the mapped
+    version and the next one, as with ``CatalogCache``. ``index`` returns the
+    search or related-products index published with the mapped snapshot.
+    """
+
+    def __init__(self, directory: str, poll_interval: float = 1.0):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        # Set by bind_database like the cache's; snapshots never query it
+        self.collection = None
+        self.mode = "snapshot"
+        self.swaps = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._indexes: Dict[str, Any] = {}
+        self._pointer: Optional[Tuple[int, int]] = None
+        self._listeners: List[ChangeListener] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version if self._snapshot is not None else 0
+
+    @property
+    def digest(self) -> int:
+        return self._snapshot.digest if self._snapshot is not None else 0
+
+    def __len__(self) -> int:
+        return len(self._snapshot) if self._snapshot is not None else 0
+
+    def subscribe(self, listener: ChangeListener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def index(self, name: str):
+        """The mapped ``INDEX_TYPES[name]`` of the current snapshot, or None if it has none."""
+        return self._indexes.get(name)
+
+    # Reads
+
+    def get(self, product_id: str) -> Optional[Dict[str, Any]]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        row = snapshot.row(product_id)
+        return snapshot.document(row) if row is not None else None
+
+    def get_many(self, product_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {}
+        return {product_id: snapshot.document(row) for product_id, row in snapshot.rows(list(product_ids)).items()}
+
+    def product_hash(self, product_id: str) -> Optional[int]:
+        snapshot = self._snapshot
+        row = snapshot.row(product_id) if snapshot is not None else None
+        return snapshot.content_hash(row) if row is not None else None
+
+    def revision(self, product_id: str) -> int:
+        snapshot = self._snapshot
+        row = snapshot.row(product_id) if snapshot is not None else None
+        return snapshot.revision(row) if row is not None else 0
+
+    def products(self) -> List[Dict[str, Any]]:
+        snapshot = self._snapshot
+        return [snapshot.document(row) for row in range(len(snapshot))] if snapshot is not None else []
+
+    def query(
+        self,
+        category: Optional[str] = None,
+        featured: Optional[bool] = None,
+        sort: str = "created_at",
+        direction: int = ASCENDING,
+        after: Optional[Tuple[Any, str]] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """Products matching the filters in (sort, id) order, after ``after``."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        order = snapshot.columns.get(f"order_{sort}")
+        if order is None:
+            raise ValueError(f"Snapshots are not ordered by {sort!r}")
+        ascending = direction == ASCENDING
+        if after is not None:
+            pivot = (_sort_key(after[0]), after[1])
+            keys = _SortKeys(snapshot, order, sort)
+            order = order[bisect.bisect_right(keys, pivot):] if ascending else order[:bisect.bisect_left(keys, pivot)]
+        if not ascending:
+            order = order[::-1]
+        code = None
+        if category is not None:
+            code = snapshot.category_codes.get(category)
+            if code is None:
+                return []
+        # Filter a chunk at a time so an early page does not scan the whole catalog
+        rows: List[int] = []
+        chunk = max(limit * 4, 1024)
+        for start in range(0, len(order), chunk):
+            candidates = order[start:start + chunk]
+            if code is not None:
+                candidates = candidates[snapshot.columns["category"][candidates] == code]
+            if featured is not None:
+                candidates = candidates[snapshot.columns["featured"][candidates] == FEATURED_CODES[bool(featured)]]
+            rows.extend(candidates[:limit - len(rows)].tolist())
+            if len(rows) >= limit:
+                break
+        return [snapshot.document(row) for row in rows]
+
+    # Swapping
+
+    def refresh(self) -> bool:
+        """Map the published snapshot if the pointer moved; True when it swapped."""
+        try:
+            status = os.stat(os.path.join(self.directory, POINTER))
+        except FileNotFoundError:
+            return False
+        pointer = (status.st_ino, status.st_mtime_ns)
+        if pointer == self._pointer:
+            return False
+        name = read_pointer(self.directory)
+        if name is None:
+            return False
+        try:
+            snapshot = Snapshot(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            # Pruned between reading the pointer and opening it; a newer one is already published
+            return False
+        self._pointer = pointer
+        previous = self._snapshot
+        if previous is not None and snapshot.version <= previous.version:
+            return False
+        upserted, removed = self._changes(previous, snapshot) if self._listeners else ([], [])
+        keys = _ProductKeys(snapshot)
+        self._indexes = {
+            name: INDEX_TYPES[name].mapped(snapshot.index_sections(name), header["settings"], keys, snapshot.version)
+            for name, header in snapshot.indexes.items()
+            if name in INDEX_TYPES
+        }
+        self._snapshot = snapshot
+        self.swaps += 1
+        self._notify(upserted, removed)
+        logger.info("Catalog snapshot %d mapped (%d products)", snapshot.version, len(snapshot))
+        return True
+
+    async def load(self, wait: float = 0.0):
+        """Map the current snapshot, waiting up to ``wait`` seconds for one to be published."""
+        deadline = time.monotonic() + wait
+        while not self.refresh() and not self.ready and time.monotonic() < deadline:
+            await asyncio.sleep(min(self.poll_interval, 0.1))
+        if not self.ready:
+            logger.warning("No catalog snapshot in %s yet; reads go to Mongo until one is published", self.directory)
+
+    @staticmethod
+    def _changes(previous: Optional[Snapshot], current: Snapshot) -> Tuple[List[Dict[str, Any]], List[str]]:
+        if previous is None:
+            return [current.document(row) for row in range(len(current))], []
+        # Both key columns are sorted, so matching rows line up with one searchsorted each way
+        old_keys, new_keys = previous.columns["keys"], current.columns["keys"]
+        old_rows, new_rows = previous.columns["key_rows"], current.columns["key_rows"]
+        positions = np.minimum(np.searchsorted(old_keys, new_keys), max(len(old_keys) - 1, 0))
+        if len(old_keys):
+            matched = old_keys[positions] == new_keys
+            same_hash = previous.columns["hashes"][old_rows[positions]] == current.columns["hashes"][new_rows]
+            unchanged = matched & same_hash.all(axis=1)
+        else:
+            unchanged = np.zeros(len(new_keys), dtype=bool)
+        positions = np.minimum(np.searchsorted(new_keys, old_keys), max(len(new_keys) - 1, 0))
+        kept = new_keys[positions] == old_keys if len(new_keys) else np.zeros(len(old_keys), dtype=bool)
+        upserted = [current.document(int(row)) for row in new_rows[~unchanged]]
+        removed = [previous.product_id(int(row)) for row in old_rows[~kept]]
+        return upserted, removed
+
+    def _notify(self, upserted: List[Dict[str, Any]], removed: List[str]):
+        for listener in self._listeners:
+            try:
+                listener(upserted, removed)
+            except Exception:
+                logger.exception("Catalog change listener failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="catalog-snapshot")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except (OSError, ValueError):
+                logger.exception("Catalog snapshot refresh failed")
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "ready": self.ready,
+            "mode": self.mode,
+            "version": self.version,
+            "digest": f"{self.digest:032x}",
+            "products": len(self),
+            "file": os.path.basename(snapshot.path) if snapshot is not None else None,
+            "mapped_bytes": snapshot.size if snapshot is not None else 0,
+            "age_seconds": round(time.time() - snapshot.published_at, 3) if snapshot is not None else None,
+            "swaps": self.swaps,
+        }
+
+
+class SnapshotPublisher:
+    """Publishes ``cache`` as snapshots whenever it changes.
+
+    A batch of changes that only moved ``LIVE_FIELDS`` of existing products
+    (stock updates during a sale) is patched into the current file in
+    place, which costs about as much as the changed rows. Anything else
+    writes a new file. Changes are coalesced by waiting ``debounce``
+    seconds after the first one, and once a rewrite is due for at least
+    ``rewrite_spacing`` times as long as the last rewrite took, so rewrites
+    never keep the publisher busy for more than a fraction of the time.
+    Several publishers may share a directory; an exclusive lock serializes
+    them and versions keep rising.
+
+    ``indexes`` (``INDEX_TYPES`` name -> empty index) are owned by the
+    publisher: each rewrite patches them with the products whose content
+    changed and writes them into the snapshot.
+    """
+
+    def __init__(
+        self,
+        cache: CatalogCache,
+        directory: str,
+        debounce: float = 0.5,
+        keep: int = 3,
+        indexes: Optional[Dict[str, Any]] = None,
+        rewrite_spacing: float = 4.0,
+    ):
+        self.cache = cache
+        self.directory = directory
+        self.debounce = debounce
+        self.keep = keep
+        self.indexes = indexes or {}
+        self.rewrite_spacing = rewrite_spacing
+        self.version = 0
+        self.published = 0
+        self.rewrites = 0
+        self.patches = 0
+        self.last_publish_seconds = 0.0
+        self.last_rewrite_seconds = 0.0
+        self.last_size = 0
+        self._hashes: Dict[str, int] = {}
+        self._revisions: Dict[str, int] = {}
+        self._resumed = False
+        self._published_digest: Optional[int] = None
+        # The published file, mapped writable for patches; None when the next publish must rewrite
+        self._current: Optional[Snapshot] = None
+        self._rewrite_due = False
+        self._rewritten_at = 0.0
+        # Per index: (index version, row ids, export) of the last publish
+        self._exports: Dict[str, Tuple[int, List[str], Tuple[Dict[str, Any], Dict[str, Any]]]] = {}
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        cache.subscribe(self._changed)
+
+    def _changed(self, upserted: List[Dict[str, Any]], removed: List[str]):
+        current = self._current
+        if removed or current is None or not all(self._patchable(current, product) for product in upserted):
+            self._rewrite_due = True
+        self._dirty.set()
+
+    @staticmethod
+    def _patchable(current: Snapshot, product: Dict[str, Any]) -> Optional[Tuple[int, Dict[str, int]]]:
+        """``(row, live values)`` if only live fields of ``product`` differ from ``current``."""
+        row = current.row(product["id"])
+        if row is None:
+            return None
+        document, values = split_live(product)
+        return (row, values) if document == current.static_document(row) else None
+
+    def _resume(self):
+        """Continue from the published snapshot so versions and revisions carry over."""
+        name = read_pointer(self.directory)
+        if name is None:
+            return
+        try:
+            snapshot = Snapshot(os.path.join(self.directory, name), writable=True)
+        except (OSError, ValueError):
+            logger.exception("Could not read the published catalog snapshot; starting a new series")
+            return
+        self.version = snapshot.version
+        for row in range(len(snapshot)):
+            product_id = snapshot.product_id(row)
+            self._hashes[product_id] = snapshot.content_hash(row)
+            self._revisions[product_id] = snapshot.revision(row)
+        self._published_digest = snapshot.digest
+        # A patch cut short leaves rows half written; only a rewrite repairs them
+        self._current = None if snapshot.patching else snapshot
+
+    async def publish(self, force: bool = False) -> Optional[int]:
+        """Publish the cache's current contents; returns the new version, or None if unchanged.
+
+        ``force`` writes a new file even if nothing or only live fields changed.
+        """
+        if not self.cache.ready:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        # Taken on the loop so the thread sees one consistent catalog while changes keep arriving
+        products = self.cache.products()
+        hashes = [self.cache.product_hash(product["id"]) for product in products]
+        return await asyncio.to_thread(self._publish, products, hashes, self.cache.digest, force)
+
+    def _publish(self, products: List[Dict[str, Any]], hashes: List[int], digest: int, force: bool) -> Optional[int]:
+        started = time.perf_counter()
+        with open(os.path.join(self.directory, LOCK), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not self._resumed:
+                self._resume()
+                self._resumed = True
+            if digest == self._published_digest and not force:
+                return None
+            pointer = read_pointer(self.directory)
+            current = self._current
+            if current is not None and pointer != os.path.basename(current.path):
+                # Another publisher moved the pointer since
+                current = self._current = None
+            version = max(self.version, self._pointer_version(pointer) if current is None else 0) + 1
+            changes = None if force or current is None else self._patch_changes(current, products, hashes)
+            if changes is not None:
+                current.patch(changes, version, digest)
+                for product, value in zip(products, hashes):
+                    if self._hashes.get(product["id"]) != value:
+                        self._hashes[product["id"]] = value
+                        self._revisions[product["id"]] = version
+            else:
+                path = self._rewrite(version, products, hashes, digest)
+        self._published_digest = digest
+        self.version = version
+        self.published += 1
+        self.last_publish_seconds = time.perf_counter() - started
+        if changes is not None:
+            self.patches += 1
+            logger.debug("Patched %d products into catalog snapshot %d", len(changes), version)
+            return version
+        self.rewrites += 1
+        self.last_rewrite_seconds = self.last_publish_seconds
+        self._rewritten_at = time.monotonic()
+        self.last_size = os.path.getsize(path)
+        logger.info(
+            "Published catalog snapshot %d (%d products, %.1f MB) in %.2fs",
+            version, len(products), self.last_size / 1e6, self.last_publish_seconds,
+        )
+        return version
+
+    def _pointer_version(self, pointer: Optional[str]) -> int:
+        """Version of the published file, patches included."""
+        if pointer is None:
+            return 0
+        try:
+            return Snapshot(os.path.join(self.directory, pointer)).version
+        except (OSError, ValueError):
+            return snapshot_version(pointer) or 0
+
+    def _patch_changes(
+        self, current: Snapshot, products: List[Dict[str, Any]], hashes: List[int]
+    ) -> Optional[List[Tuple[int, int, Dict[str, int]]]]:
+        """The in-place changes that turn ``current`` into ``products``, or None if it needs a rewrite."""
+        if len(products) != current.count:
+            return None
+        changes = []
+        for product, value in zip(products, hashes):
+            if self._hashes.get(product["id"]) == value:
+                continue
+            patchable = self._patchable(current, product)
+            if patchable is None:
+                return None
+            row, values = patchable
+            changes.append((row, value, values))
+        return changes
+
+    def _rewrite(self, version: int, products: List[Dict[str, Any]], hashes: List[int], digest: int) -> str:
+        revisions = []
+        for product, value in zip(products, hashes):
+            if self._hashes.get(product["id"]) != value:
+                self._revisions[product["id"]] = version
+            revisions.append(self._revisions[product["id"]])
+        indexes = self._export_indexes(products, hashes)
+        path = write_snapshot(self.directory, version, products, hashes, revisions, digest, indexes)
+        publish_pointer(self.directory, os.path.basename(path))
+        self._prune()
+        self._hashes = {product["id"]: value for product, value in zip(products, hashes)}
+        self._revisions = {product["id"]: self._revisions[product["id"]] for product in products}
+        self._current = Snapshot(path, writable=True)
+        return path
+
+    def _export_indexes(
+        self, products: List[Dict[str, Any]], hashes: List[int]
+    ) -> Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Bring the indexes up to ``products`` and export them in that row order."""
+        if not self.indexes:
+            return {}
+        ids = [product["id"] for product in products]
+        present = set(ids)
+        changed = [product for product, value in zip(products, hashes) if self._hashes.get(product["id"]) != value]
+        removed = [product_id for product_id in self._hashes if product_id not in present]
+        exported = {}
+        for name, index in self.indexes.items():
+            if index.builds:
+                index.update(changed, removed)
+            else:
+                index.build(products)
+            cached = self._exports.get(name)
+            if cached is not None and cached[0] == index.version and cached[1] == ids:
+                exported[name] = cached[2]
+                continue
+            try:
+                exported[name] = index.export(ids)
+            except ValueError:
+                # Out of step with the catalog (e.g. resumed from another publisher's snapshot)
+                index.build(products)
+                exported[name] = index.export(ids)
+            self._exports[name] = (index.version, ids, exported[name])
+        return exported
+
+    def _prune(self):
+        """Unlink all but the newest ``keep`` files.
+
+        Counted in files rather than versions: patches move the version
+        without writing a file, so a version window could leave only the
+        current file behind for readers that have not swapped yet.
+        """
+        files = sorted(
+            (version, name) for name in os.listdir(self.directory)
+            if (version := snapshot_version(name)) is not None
+        )
+        for _, name in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="catalog-snapshot-publisher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _delay(self) -> float:
+        """Seconds to let changes gather before the next publish."""
+        if not self._rewrite_due:
+            return self.debounce
+        spacing = self.rewrite_spacing * self.last_rewrite_seconds - (time.monotonic() - self._rewritten_at)
+        return max(self.debounce, spacing)
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self._delay())
+            self._dirty.clear()
+            self._rewrite_due = False
+            try:
+                await self.publish()
+            except (OSError, ValueError):
+                logger.exception("Catalog snapshot publish failed")
+                self._dirty.set()
+                await asyncio.sleep(self.debounce)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "version": self.version,
+            "published": self.published,
+            "rewrites": self.rewrites,
+            "patches": self.patches,
+            "last_publish_seconds": round(self.last_publish_seconds, 3),
+            "last_rewrite_seconds": round(self.last_rewrite_seconds, 3),
+            "last_size_bytes": self.last_size,
+        }
+
+
+def main():
+    """Run only the catalog loader and publisher, next to API workers that read its snapshots."""
+    import server
+
+    if not server.CATALOG_SNAPSHOT_DIR:
+        raise SystemExit("Set CATALOG_SNAPSHOT_DIR to publish catalog snapshots")
+
+    async def start():
+        await server.catalog_source.load()
+        server.catalog_source.start()
+        await server.snapshot_publisher.publish()
+        server.snapshot_publisher.start()
+
+    async def stop():
+        await server.snapshot_publisher.stop()
+        await server.catalog_source.stop()
+
+    server.run_standalone(f"Catalog snapshot publisher for {server.CATALOG_SNAPSHOT_DIR}", start, stop)
+
+
+if __name__ == "__main__":
+    main()
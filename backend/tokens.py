@@ -0,0 +1,156 @@
+"""JWT signing keys and the in-memory token revocation list.
+
+Tokens carry the ``kid`` of the key that signed them, so keys can be rotated
+by adding a new key, making it active, and dropping the old one once its
+tokens have expired. Revoked token ids (``jti``) live in Mongo and are
+mirrored into a process-local set by a periodic sync, so checking a token on
+the request path never does I/O.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import jwt
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Key id assumed for tokens issued before key ids existed
+LEGACY_KID = "default"
+
+
+def parse_signing_keys(spec: str, fallback_secret: str) -> Dict[str, str]:
+    """Parse ``"kid1:secret1,kid2:secret2"``; an empty spec yields the legacy key."""
+    keys = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        kid, separator, secret = entry.partition(":")
+        if not separator or not kid or not secret:
+            raise ValueError(f"Malformed JWT signing key entry: {entry!r}")
+        keys[kid] = secret
+    return keys or {LEGACY_KID: fallback_secret}
+
+
+class KeyRing:
+    """Signs with the active key and verifies with whichever key a token names."""
+
+    def __init__(self, keys: Dict[str, str], active_kid: Optional[str] = None, algorithm: str = "HS256"):
+        if not keys:
+            raise ValueError("At least one signing key is required")
+        self.keys = keys
+        self.active_kid = active_kid or next(iter(keys))
+        if self.active_kid not in keys:
+            raise ValueError(f"Active JWT key {self.active_kid!r} is not configured")
+        self.algorithm = algorithm
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        return jwt.encode(
+            claims, self.keys[self.active_kid], algorithm=self.algorithm, headers={"kid": self.active_kid}
+        )
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """Verify ``token``; raises ``jwt.PyJWTError`` when it is not valid."""
+        kid = jwt.get_unverified_header(token).get("kid", LEGACY_KID)
+        key = self.keys.get(kid)
+        if key is None:
+            raise jwt.InvalidKeyError(f"Unknown key id {kid!r}")
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+
+class RevocationList:
+    """Revoked ``jti`` values, mirrored from a Mongo collection.
+
+    Documents look like ``{"jti", "user_id", "expires_at", "revoked_at"}``;
+    a TTL index on ``expires_at`` lets Mongo drop them once the token could
+    no longer be used anyway. Revocations made in this process apply
+    immediately; those made elsewhere apply after the next sync. Subscribers
+    are told the ``user_id`` of every revocation either way, so per-user
+    caches can drop the user.
+    """
+
+    def __init__(self, collection, sync_interval: float = 15.0):
+        self.collection = collection
+        self.sync_interval = sync_interval
+        self._revoked: Dict[str, float] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._synced_until: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.syncs = 0
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        return jti is not None and jti in self._revoked
+
+    def subscribe(self, listener: Callable[[str], None]):
+        """Call ``listener(user_id)`` for each revocation that names a user."""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _notify(self, user_id: Optional[str]):
+        if user_id is None:
+            return
+        for listener in self._listeners:
+            try:
+                listener(user_id)
+            except Exception:
+                logger.exception("Token revocation listener failed")
+
+    async def revoke(self, jti: str, expires_at: float, user_id: Optional[str] = None):
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({
+                "jti": jti,
+                "user_id": user_id,
+                "expires_at": datetime.fromtimestamp(expires_at, timezone.utc),
+                "revoked_at": now,
+            })
+        except DuplicateKeyError:
+            pass
+        self._revoked[jti] = expires_at
+        self._notify(user_id)
+
+    async def sync(self):
+        """Pull revocations recorded since the last sync and drop expired ones."""
+        query = {"expires_at": {"$gt": datetime.now(timezone.utc)}}
+        if self._synced_until is not None:
+            query["revoked_at"] = {"$gte": self._synced_until}
+        started = datetime.now(timezone.utc)
+        async for document in self.collection.find(query, {"_id": 0, "jti": 1, "user_id": 1, "expires_at": 1}):
+            expires_at = document["expires_at"]
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            if document["jti"] not in self._revoked:
+                self._notify(document.get("user_id"))
+            self._revoked[document["jti"]] = expires_at.timestamp()
+        # Overlap the next window to tolerate clock skew between writers
+        self._synced_until = started - timedelta(seconds=5)
+        now = time.time()
+        self._revoked = {jti: expires_at for jti, expires_at in self._revoked.items() if expires_at > now}
+        self.syncs += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="token-revocations")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except PyMongoError:
+                logger.exception("Token revocation sync failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"revoked": len(self._revoked), "syncs": self.syncs, "sync_interval_seconds": self.sync_interval}
@@ -0,0 +1,74 @@
+"""Throughput of concurrent cart mutations on one cart.
+
+    python benchmarks/cart_concurrency.py [--requests 200] [--mongo-url ...]
+
+Fires ``--requests`` concurrent single adds at one cart line, plus the same
+number of bulk requests that each add one unit to two lines, then checks
+the final quantities. Exits non-zero on any lost update; the same check
+runs in the test suite (tests/test_cart.py), this script adds the timings
+and can run against a real mongod.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from harness import booted_app, make_product, register_user, summarize
+
+
+async def main(requests: int, mongo_url: str = None) -> dict:
+    async with booted_app(mongo_url) as (server, http):
+        products = [make_product(index) for index in range(3)]
+        await server.db.products.insert_many([dict(product) for product in products])
+        if server.catalog_available():
+            await server.catalog.load()
+        headers = await register_user(http)
+        first, second, third = (product["id"] for product in products)
+
+        async def timed(coroutine):
+            started = time.perf_counter()
+            response = await coroutine
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        single = [
+            timed(http.post("/api/cart/add", json={"product_id": first, "quantity": 1}, headers=headers))
+            for _ in range(requests)
+        ]
+        bulk = [
+            timed(http.post(
+                "/api/cart/bulk",
+                json={"operations": [
+                    {"action": "add", "product_id": second, "quantity": 1},
+                    {"action": "add", "product_id": third, "quantity": 1},
+                ]},
+                headers=headers,
+            ))
+            for _ in range(requests)
+        ]
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*single, *bulk)
+        elapsed = time.perf_counter() - started
+
+        cart = (await http.get("/api/cart", headers=headers)).json()
+        quantities = {item["product_id"]: item["quantity"] for item in cart["items"]}
+        expected = {first: requests, second: requests, third: requests}
+        return {
+            "requests": len(latencies),
+            "throughput_per_s": len(latencies) / elapsed,
+            "latency": summarize(latencies),
+            "lines": len(cart["items"]),
+            "lost_updates": sum(expected[product_id] - quantities.get(product_id, 0) for product_id in expected),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--mongo-url", default=None, help="run against a real mongod instead of mongomock")
+    args = parser.parse_args()
+    result = asyncio.run(main(args.requests, args.mongo_url))
+    print(json.dumps(result, indent=2))
+    if result["lost_updates"] or result["lines"] != 3:
+        sys.exit(1)
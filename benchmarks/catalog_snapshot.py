@@ -0,0 +1,179 @@
+"""Catalog snapshot mode: total worker memory and read latency against per-worker caches.
+
+    python benchmarks/catalog_snapshot.py [--products 100000] [--workers 1,2,4,8] [--reads 20000]
+
+Publishes one snapshot of synthetic products, with the search and
+related-products indexes, and times both a full write and the in-place
+patch that a burst of stock changes gets. Then it starts N worker
+processes for each mode. A
+"cache" worker holds its own CatalogCache and builds both indexes, as every
+API worker does without snapshots; a "snapshot" worker maps the shared file
+and queries the indexes in it. Each worker does random ``get`` reads, a
+filtered listing page, searches and related-products lookups, waits for
+the others to get that far, and then reports its RSS and PSS from
+/proc/self/smaps_rollup (Linux only). The totals are summed over workers:
+RSS counts the shared pages in every worker that maps them, PSS splits
+them between those workers, so PSS totals are what the host actually holds.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from harness import summarize  # noqa: E402
+from product_search import CATEGORIES, random_query  # noqa: E402
+from related_products import synthetic_product  # noqa: E402
+from catalog import CatalogCache  # noqa: E402
+from related import RelatedProductsIndex  # noqa: E402
+from search import ProductSearchIndex  # noqa: E402
+from snapshot import CatalogSnapshot, SnapshotPublisher  # noqa: E402
+
+
+def memory_bytes() -> dict:
+    totals = {"Rss": 0, "Pss": 0}
+    with open("/proc/self/smaps_rollup") as file:
+        for line in file:
+            field = line.split(":")[0]
+            if field in totals:
+                totals[field] = int(line.split()[1]) * 1024
+    return totals
+
+
+def worker(mode: str, directory: str, product_ids: list, reads: int, seed: int, barrier, results):
+    snapshot = CatalogSnapshot(directory)
+    snapshot.refresh()
+    if mode == "snapshot":
+        catalog, search, related = snapshot, snapshot.index("search"), snapshot.index("related")
+    else:
+        products = snapshot.products()
+        catalog = CatalogCache(None)
+        catalog.apply(upserted=[dict(product, _id=index) for index, product in enumerate(products)])
+        search, related = ProductSearchIndex(), RelatedProductsIndex()
+        search.build(products)
+        related.build(products)
+        snapshot = products = None
+    rng = random.Random(seed)
+    samples = []
+    for product_id in rng.choices(product_ids, k=reads):
+        started = time.perf_counter()
+        catalog.get(product_id)
+        samples.append(time.perf_counter() - started)
+    # The cache sorts lazily on its first listing; time the page after that
+    catalog.query(category="educational", sort="price", limit=100)
+    started = time.perf_counter()
+    catalog.query(category="educational", sort="price", limit=100)
+    listing_seconds = time.perf_counter() - started
+    search_samples, related_samples = [], []
+    for product_id in rng.sample(product_ids, min(200, len(product_ids))):
+        query = random_query(rng)
+        started = time.perf_counter()
+        search.search(query["query"], category=query["category"], limit=20)
+        search_samples.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        related.related(product_id, 8)
+        related_samples.append(time.perf_counter() - started)
+    # Measured while every worker holds its state, so shared pages are split between all of them
+    barrier.wait()
+    memory = memory_bytes()
+    barrier.wait()
+    results.put({
+        "rss_mb": memory["Rss"] / 1e6,
+        "pss_mb": memory["Pss"] / 1e6,
+        "get": summarize(samples),
+        "filtered_page_ms": listing_seconds * 1000,
+        "search": summarize(search_samples),
+        "related": summarize(related_samples),
+    })
+
+
+def run_workers(context, count: int, mode: str, directory: str, product_ids: list, reads: int, seed: int) -> list:
+    barrier, results = context.Barrier(count), context.Queue()
+    processes = [
+        context.Process(target=worker, args=(mode, directory, product_ids, reads, seed + index, barrier, results))
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return reports
+
+
+async def publish(products: list, directory: str, rng: random.Random) -> SnapshotPublisher:
+    cache = CatalogCache(None)
+    cache.apply(upserted=[dict(product, _id=index) for index, product in enumerate(products)])
+    cache.ready = True
+    publisher = SnapshotPublisher(
+        cache, directory, indexes={"search": ProductSearchIndex(), "related": RelatedProductsIndex()}
+    )
+    await publisher.publish()
+    # A burst of orders moves stock only, which is patched into the file in place
+    for index in rng.sample(range(len(products)), min(200, len(products))):
+        cache.apply(upserted=[dict(products[index], _id=index, stock_quantity=rng.randint(0, 50))])
+    await publisher.publish()
+    return publisher
+
+
+def main(product_count: int, worker_counts: list, reads: int, seed: int):
+    rng = random.Random(seed)
+    products = []
+    for index in range(product_count):
+        product = synthetic_product(index, rng)
+        product["category"] = rng.choice(CATEGORIES)
+        products.append(product)
+    product_ids = [product["id"] for product in products]
+    results = {"products": product_count, "runs": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        publisher = asyncio.run(publish(products, directory, rng))
+        results["publish_seconds"] = publisher.last_rewrite_seconds
+        results["stock_patch_seconds"] = publisher.last_publish_seconds
+        results["snapshot_mb"] = publisher.last_size / 1e6
+        print(f"publish      {publisher.last_rewrite_seconds:7.2f} s   {results['snapshot_mb']:.1f} MB file")
+        patch_ms = publisher.last_publish_seconds * 1000
+        print(f"stock patch  {patch_ms:7.2f} ms  (200 products, {publisher.patches} patch)")
+        context = multiprocessing.get_context("spawn")
+        for count in worker_counts:
+            for mode in ("cache", "snapshot"):
+                reports = run_workers(context, count, mode, directory, product_ids, reads, seed)
+
+                def median(values):
+                    return sorted(values)[len(reports) // 2]
+
+                run = {
+                    "rss_mb_total": sum(report["rss_mb"] for report in reports),
+                    "pss_mb_total": sum(report["pss_mb"] for report in reports),
+                    "get_p50_ms": median(report["get"]["p50_ms"] for report in reports),
+                    "filtered_page_ms": median(report["filtered_page_ms"] for report in reports),
+                    "search_p50_ms": median(report["search"]["p50_ms"] for report in reports),
+                    "related_p50_ms": median(report["related"]["p50_ms"] for report in reports),
+                }
+                results["runs"][f"{mode}:{count}"] = run
+                print(
+                    f"{count:>2} workers  {mode:<8}  RSS {run['rss_mb_total']:8.1f} MB"
+                    f"  PSS {run['pss_mb_total']:8.1f} MB total"
+                    f" ({run['pss_mb_total'] / count:7.1f} per worker)   get p50 {run['get_p50_ms'] * 1000:6.1f} us"
+                    f"   page {run['filtered_page_ms']:6.2f} ms   search p50 {run['search_p50_ms']:5.2f} ms"
+                    f"   related p50 {run['related_p50_ms']:5.2f} ms"
+                )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts")
+    parser.add_argument("--reads", type=int, default=20_000, help="random product reads per worker")
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    results = main(args.products, [int(count) for count in args.workers.split(",")], args.reads, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,93 @@
+"""Boot backend/server.py in-process for benchmarks.
+
+The app is driven through httpx's ASGI transport, so no network or uvicorn
+is involved. By default the database is mongomock-motor; pass a
+``mongo_url`` to run against a real mongod instead.
+"""
+import contextlib
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of ``samples`` (0 for an empty list)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples: List[float]) -> dict:
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples, default=0.0) * 1000,
+    }
+
+
+def make_product(index: int, **overrides) -> dict:
+    product = {
+        "id": str(uuid.uuid4()),
+        "name": f"Bench Robot {index}",
+        "description": f"Synthetic benchmark robot number {index} with sensors and wheels",
+        "price": round(10 + (index % 500) * 1.37, 2),
+        "image_url": "https://example.com/robot.png",
+        "category": ("home_automation", "educational", "ai_companion")[index % 3],
+        "specifications": {"battery_life": f"{60 + index % 120} minutes", "sensors": "lidar, camera"},
+        "stock_quantity": 1_000_000,
+        "featured": index % 10 == 0,
+        "created_at": datetime.now(timezone.utc),
+    }
+    product.update(overrides)
+    return product
+
+
+@contextlib.asynccontextmanager
+async def booted_app(mongo_url: str = None, db_name: str = None):
+    """Yield ``(server, http_client)`` with startup and shutdown hooks run."""
+    import httpx
+
+    if mongo_url is None:
+        # mongomock has no change streams
+        os.environ.setdefault("CATALOG_CHANGE_STREAMS", "false")
+    # Every virtual user shares one client address
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    import server
+
+    if mongo_url is None:
+        from mongomock_motor import AsyncMongoMockClient
+
+        server.database.client_factory = AsyncMongoMockClient
+    else:
+        server.database.url = mongo_url
+        server.database.client_factory = None
+    db_name = db_name or f"bench_{uuid.uuid4().hex[:8]}"
+    server.database.name = db_name
+    async with server.app.router.lifespan_context(server.app):
+        try:
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+                yield server, http
+        finally:
+            if mongo_url is not None:
+                await server.database.client.drop_database(db_name)
+
+
+async def register_user(http, email: str = None, password: str = "bench-password") -> dict:
+    """Register a user and return request headers carrying its bearer token."""
+    email = email or f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    body = {"email": email, "password": password, "full_name": "Bench"}
+    response = await http.post("/api/auth/register", json=body)
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
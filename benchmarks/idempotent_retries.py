@@ -0,0 +1,74 @@
+"""Checkout under a client retry storm, with and without Idempotency-Key.
+
+    python benchmarks/idempotent_retries.py [--orders 50] [--retries 5] [--mongo-url mongodb://localhost:27017]
+
+Every logical checkout is sent ``--retries`` times at once, as a mobile
+client does when its first attempt times out, then once more after the
+first has finished. Without a key each copy prices and places its own
+order; with one only the first runs and the copies get its response.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from harness import booted_app, make_product, register_user, summarize
+
+
+async def main(orders: int, retries: int, mongo_url: str = None):
+    async with booted_app(mongo_url) as (server, http):
+        product = make_product(0)
+        await server.db.products.insert_one(dict(product))
+        if server.catalog_available():
+            await server.catalog.load()
+        headers = await register_user(http)
+        body = {
+            "items": [{"product_id": product["id"], "quantity": 1}],
+            "payment_method": "card",
+            "shipping_address": {"street": "1 Bench St", "city": "Testville"},
+        }
+
+        results = {}
+        for label, keyed in (("no key", False), ("idempotency key", True)):
+            before = await server.db.orders.count_documents({})
+            executed = server.idempotency.executed
+            samples = []
+            started = time.perf_counter()
+            for _ in range(orders):
+                attempt_headers = dict(headers, **{"Idempotency-Key": uuid.uuid4().hex}) if keyed else headers
+
+                async def attempt():
+                    attempt_started = time.perf_counter()
+                    response = await http.post("/api/orders", json=body, headers=attempt_headers)
+                    samples.append(time.perf_counter() - attempt_started)
+                    response.raise_for_status()
+
+                await asyncio.gather(*(attempt() for _ in range(retries)))
+                await attempt()
+            elapsed = time.perf_counter() - started
+            created = await server.db.orders.count_documents({}) - before
+            results[label] = {
+                "requests": orders * (retries + 1),
+                "orders_created": created,
+                "handler_runs": server.idempotency.executed - executed if keyed else created,
+                "seconds": elapsed,
+                "latency": summarize(samples),
+            }
+            print(
+                f"{label:<16} {orders * (retries + 1):>5} requests -> {created:>5} orders"
+                f"   p50 {results[label]['latency']['p50_ms']:7.2f} ms   total {elapsed:6.2f} s"
+            )
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=50, help="logical checkouts")
+    parser.add_argument("--retries", type=int, default=5, help="concurrent copies of each checkout")
+    parser.add_argument("--mongo-url", default=None, help="benchmark against a real mongod instead of mongomock")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    results = asyncio.run(main(args.orders, args.retries, args.mongo_url))
+    if args.json:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,211 @@
+"""Replay a realistic shopping mix against the app and report per-route latency.
+
+    python benchmarks/load_test.py [--users 50] [--duration 20] [--products 2000]
+                                   [--output results.json] [--baseline previous.json]
+
+Each virtual user registers once and then runs scenarios back to back,
+picked by weight: browsing (a listing page, the next page, a product),
+searching, adding to the cart and checking out. Everything runs in one
+process through the harness (mongomock by default, ``--mongo-url`` for a
+real mongod), so numbers are comparable between commits on the same
+machine, not with production. mongomock has no indexes and scans the
+collection for every query, so write-heavy routes look slower there than
+they are; use a real mongod when the database side matters.
+
+The JSON written by ``--output`` records the commit and the settings with
+per-route counts, errors, throughput and p50/p95/p99/max. Passing an
+earlier file as ``--baseline`` prints the p50/p99 change for every route.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from harness import booted_app, make_product, register_user, summarize
+
+SCENARIO_WEIGHTS = {"browse": 55, "search": 20, "add_to_cart": 17, "checkout": 8}
+
+SEARCH_TERMS = ("robot", "sensors", "wheels", "battery", "synthetic robot", "lidar camera", "companion")
+
+CATEGORIES = (None, None, "home_automation", "educational", "ai_companion")
+
+
+class Recorder:
+    """Latency samples and error counts per route label."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, http, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+        except Exception:
+            self.errors[route] += 1
+            raise
+        self.samples[route].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+
+async def browse(http, recorder: Recorder, rng: random.Random, headers: dict):
+    params = {"limit": 20}
+    category = rng.choice(CATEGORIES)
+    if category:
+        params["category"] = category
+    page = await recorder.call(http, "GET /api/products", "GET", "/api/products", params=params)
+    cursor = page.headers.get("X-Next-Cursor")
+    if cursor and rng.random() < 0.5:
+        next_page = {**params, "cursor": cursor}
+        page = await recorder.call(http, "GET /api/products?cursor", "GET", "/api/products", params=next_page)
+    products = page.json()
+    if products:
+        product_id = rng.choice(products)["id"]
+        await recorder.call(http, "GET /api/products/{id}", "GET", f"/api/products/{product_id}")
+
+
+async def search(http, recorder: Recorder, rng: random.Random, headers: dict):
+    params = {"search": rng.choice(SEARCH_TERMS), "limit": 20}
+    await recorder.call(http, "GET /api/products?search", "GET", "/api/products", params=params)
+
+
+async def add_to_cart(http, recorder: Recorder, rng: random.Random, headers: dict, product_ids: List[str]):
+    item = {"product_id": rng.choice(product_ids), "quantity": rng.randint(1, 3)}
+    await recorder.call(http, "POST /api/cart/add", "POST", "/api/cart/add", json=item, headers=headers)
+    await recorder.call(http, "GET /api/cart", "GET", "/api/cart", headers=headers)
+
+
+async def checkout(http, recorder: Recorder, rng: random.Random, headers: dict, product_ids: List[str]):
+    cart = (await recorder.call(http, "GET /api/cart", "GET", "/api/cart", headers=headers)).json()
+    items = [{"product_id": item["product_id"], "quantity": item["quantity"]} for item in cart.get("items", [])]
+    if not items:
+        items = [{"product_id": rng.choice(product_ids), "quantity": 1}]
+    order = {
+        "items": items,
+        "payment_method": "card",
+        "shipping_address": {"street": "1 Bench St", "city": "Testville"},
+    }
+    # Placing the order also empties the cart
+    await recorder.call(http, "POST /api/orders", "POST", "/api/orders", json=order, headers=headers)
+    await recorder.call(http, "GET /api/orders", "GET", "/api/orders", headers=headers)
+
+
+async def virtual_user(http, recorder: Recorder, rng: random.Random, product_ids: List[str], deadline: float):
+    headers = await register_user(http)
+    names = list(SCENARIO_WEIGHTS)
+    weights = list(SCENARIO_WEIGHTS.values())
+    completed = 0
+    while time.perf_counter() < deadline:
+        scenario = rng.choices(names, weights)[0]
+        try:
+            if scenario == "browse":
+                await browse(http, recorder, rng, headers)
+            elif scenario == "search":
+                await search(http, recorder, rng, headers)
+            elif scenario == "add_to_cart":
+                await add_to_cart(http, recorder, rng, headers, product_ids)
+            else:
+                await checkout(http, recorder, rng, headers, product_ids)
+        except Exception:
+            # Already counted as an error; keep the user going
+            pass
+        completed += 1
+    return completed
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def main(users: int, duration: float, products: int, seed: int, mongo_url: str = None) -> dict:
+    async with booted_app(mongo_url) as (server, http):
+        documents = [make_product(index) for index in range(products)]
+        await server.db.products.insert_many([dict(document) for document in documents])
+        if server.catalog_available():
+            # The catalog's change listener also feeds the search index
+            await server.catalog.load()
+        else:
+            await server.rebuild_search_index()
+        product_ids = [document["id"] for document in documents]
+
+        recorder = Recorder()
+        started = time.perf_counter()
+        deadline = started + duration
+        scenarios = await asyncio.gather(*(
+            virtual_user(http, recorder, random.Random(seed + index), product_ids, deadline) for index in range(users)
+        ))
+        elapsed = time.perf_counter() - started
+
+    routes = {}
+    for route in sorted(recorder.samples):
+        samples = recorder.samples[route]
+        routes[route] = {**summarize(samples), "errors": recorder.errors.get(route, 0), "rps": len(samples) / elapsed}
+    everything = [sample for samples in recorder.samples.values() for sample in samples]
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "database": "mongod" if mongo_url else "mongomock",
+            "users": users,
+            "duration_s": duration,
+            "products": products,
+            "seed": seed,
+            "weights": SCENARIO_WEIGHTS,
+        },
+        "total": {
+            **summarize(everything),
+            "errors": sum(recorder.errors.values()),
+            "rps": len(everything) / elapsed,
+            "scenarios": sum(scenarios),
+            "elapsed_s": elapsed,
+        },
+        "routes": routes,
+    }
+
+
+def print_report(results: dict, baseline: dict = None):
+    previous = dict((baseline or {}).get("routes", {}), total=(baseline or {}).get("total", {}))
+
+    def change(route: str, stats: dict, key: str) -> str:
+        before = previous.get(route, {}).get(key)
+        return f"({(stats[key] - before) / before * 100:+.0f}%)" if before else ""
+
+    print(f"{'route':<34} {'count':>7} {'err':>5} {'rps':>8} {'p50 ms':>16} {'p95 ms':>9} {'p99 ms':>16}")
+    for route, stats in list(results["routes"].items()) + [("total", results["total"])]:
+        print(
+            f"{route:<34} {stats['count']:>7} {stats['errors']:>5} {stats['rps']:>8.1f} "
+            f"{stats['p50_ms']:>8.2f} {change(route, stats, 'p50_ms'):>7} {stats['p95_ms']:>9.2f} "
+            f"{stats['p99_ms']:>8.2f} {change(route, stats, 'p99_ms'):>7}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run the mix for")
+    parser.add_argument("--products", type=int, default=2000, help="catalog size to seed")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the scenario mix")
+    parser.add_argument("--mongo-url", default=None, help="benchmark against a real mongod instead of mongomock")
+    parser.add_argument("--output", type=Path, default=None, help="write the results JSON here")
+    parser.add_argument("--baseline", type=Path, default=None, help="earlier results JSON to compare against")
+    args = parser.parse_args()
+    results = asyncio.run(main(args.users, args.duration, args.products, args.seed, args.mongo_url))
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print_report(results, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
@@ -0,0 +1,79 @@
+"""Per-request cost of the metrics middleware and the Mongo command listener.
+
+    python benchmarks/metrics_overhead.py [--rounds 50000]
+
+Both are timed in isolation: the middleware around a trivial ASGI app that
+answers immediately, against the same app unwrapped, and the listener's
+``started``/``succeeded`` pair against synthetic command events. The numbers
+are what every request and every query pays on top of its real work.
+"""
+import argparse
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import harness  # noqa: F401  (puts backend/ on sys.path)
+from metrics import MetricsMiddleware, MongoCommandMetrics, Registry
+
+ROUTE = SimpleNamespace(path="/api/products/{product_id}")
+
+
+async def trivial_app(scope, receive, send):
+    scope["route"] = ROUTE
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def time_app(app, rounds: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await app({"type": "http", "method": "GET", "path": "/api/products/abc"}, receive, send)
+    return (time.perf_counter() - started) / rounds
+
+
+def time_listener(listener: MongoCommandMetrics, rounds: int) -> float:
+    start_event = SimpleNamespace(
+        command_name="find", command={"find": "products"}, request_id=1, connection_id=("db", 27017)
+    )
+    end_event = SimpleNamespace(command_name="find", request_id=1, connection_id=("db", 27017), duration_micros=850)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        listener.started(start_event)
+        listener.succeeded(end_event)
+    return (time.perf_counter() - started) / rounds
+
+
+def main(rounds: int) -> dict:
+    registry = Registry()
+    middleware = MetricsMiddleware(
+        trivial_app,
+        requests=registry.counter("requests", "", ("method", "route", "status")),
+        latency=registry.histogram("latency", "", ("method", "route")),
+        in_flight=registry.gauge("in_flight", ""),
+    )
+    listener = MongoCommandMetrics(
+        registry.counter("commands", "", ("collection", "command", "outcome")),
+        registry.histogram("command_latency", "", ("collection", "command")),
+    )
+    bare = asyncio.run(time_app(trivial_app, rounds))
+    wrapped = asyncio.run(time_app(middleware, rounds))
+    return {
+        "rounds": rounds,
+        "middleware_overhead_us": (wrapped - bare) * 1e6,
+        "listener_overhead_us": time_listener(listener, rounds) * 1e6,
+        "exposition_bytes": len(registry.expose()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=50000)
+    args = parser.parse_args()
+    print(json.dumps(main(args.rounds), indent=2))
@@ -0,0 +1,53 @@
+"""Order placement latency against the number of line items.
+
+    python benchmarks/order_latency.py [--orders 200] [--mongo-url mongodb://localhost:27017]
+
+Set CATALOG_CACHE_ENABLED=false to measure the batched ``$in`` lookup
+instead of the in-memory catalog.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from harness import booted_app, make_product, register_user, summarize
+
+LINE_COUNTS = (1, 5, 10, 20, 40)
+
+
+async def main(orders: int, mongo_url: str = None):
+    async with booted_app(mongo_url) as (server, http):
+        products = [make_product(index) for index in range(max(LINE_COUNTS))]
+        await server.db.products.insert_many([dict(product) for product in products])
+        if server.catalog_available():
+            await server.catalog.load()
+        headers = await register_user(http)
+
+        results = {}
+        for line_count in LINE_COUNTS:
+            body = {
+                "items": [{"product_id": product["id"], "quantity": 1} for product in products[:line_count]],
+                "payment_method": "card",
+                "shipping_address": {"street": "1 Bench St", "city": "Testville"},
+            }
+            samples = []
+            for _ in range(orders):
+                started = time.perf_counter()
+                response = await http.post("/api/orders", json=body, headers=headers)
+                samples.append(time.perf_counter() - started)
+                response.raise_for_status()
+            results[line_count] = summarize(samples)
+            summary = results[line_count]
+            print(f"{line_count:>3} lines  p50 {summary['p50_ms']:7.2f} ms  p99 {summary['p99_ms']:7.2f} ms")
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=200, help="orders per line-item count")
+    parser.add_argument("--mongo-url", default=None, help="benchmark against a real mongod instead of mongomock")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    results = asyncio.run(main(args.orders, args.mongo_url))
+    if args.json:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,71 @@
+"""Checkout latency and outbox delivery lag against the number of order consumers.
+
+    python benchmarks/outbox_latency.py [--orders 100] [--handler-ms 20] [--mongo-url mongodb://localhost:27017]
+
+Each consumer is an ``order.created`` handler that sleeps ``--handler-ms``,
+standing in for an email or inventory call. Checkout latency should not
+move as consumers are added; only the delivery lag does.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from harness import booted_app, make_product, register_user, summarize
+
+CONSUMER_COUNTS = (0, 1, 5, 20)
+
+
+async def main(orders: int, handler_ms: float, mongo_url: str = None):
+    async with booted_app(mongo_url) as (server, http):
+        product = make_product(0)
+        await server.db.products.insert_one(dict(product))
+        if server.catalog_available():
+            await server.catalog.load()
+        headers = await register_user(http)
+        body = {
+            "items": [{"product_id": product["id"], "quantity": 1}],
+            "payment_method": "card",
+            "shipping_address": {"street": "1 Bench St", "city": "Testville"},
+        }
+
+        async def consumer(event):
+            await asyncio.sleep(handler_ms / 1000)
+
+        results = {}
+        for count in CONSUMER_COUNTS:
+            server.outbox.handlers.clear()
+            for index in range(count):
+                server.outbox.register("order.created", consumer, f"bench-consumer-{index}")
+            delivered = server.outbox.delivered
+            samples = []
+            for _ in range(orders):
+                started = time.perf_counter()
+                response = await http.post("/api/orders", json=body, headers=headers)
+                samples.append(time.perf_counter() - started)
+                response.raise_for_status()
+            drain_started = time.perf_counter()
+            while server.outbox.delivered < delivered + orders:
+                await asyncio.sleep(0.01)
+            results[count] = {
+                "checkout": summarize(samples),
+                "drain_after_last_order_ms": (time.perf_counter() - drain_started) * 1000,
+            }
+            checkout = results[count]["checkout"]
+            print(
+                f"{count:>3} consumers  checkout p50 {checkout['p50_ms']:7.2f} ms  p99 {checkout['p99_ms']:7.2f} ms"
+                f"  outbox drained {results[count]['drain_after_last_order_ms']:8.1f} ms after the last order"
+            )
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=100, help="orders per consumer count")
+    parser.add_argument("--handler-ms", type=float, default=20.0, help="time each consumer takes per event")
+    parser.add_argument("--mongo-url", default=None, help="benchmark against a real mongod instead of mongomock")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    results = asyncio.run(main(args.orders, args.handler_ms, args.mongo_url))
+    if args.json:
+        print(json.dumps(results, indent=2))
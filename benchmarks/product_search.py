@@ -0,0 +1,115 @@
+"""Product search index: build time and query latency at catalog scale.
+
+    python benchmarks/product_search.py [--products 100000] [--queries 2000] [--limit 20] [--target-ms 5]
+
+Runs the BM25 index directly (no HTTP or database) over the synthetic
+products of related_products.py. Queries are one to four words drawn from
+the same vocabulary, so they include terms found in nearly every product
+("robot") as well as rare ones, and a share of them filter by category or
+ask for a later page. Exits non-zero if the p99 misses ``--target-ms``.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from harness import summarize  # noqa: E402
+from related_products import KINDS, PARTS, USES, synthetic_product  # noqa: E402
+from search import ProductSearchIndex  # noqa: E402
+
+BRANDS = ("nova", "astra", "iron", "pico", "terra")
+CATEGORIES = ("home_automation", "educational", "ai_companion", "industrial")
+
+
+def random_query(rng: random.Random) -> dict:
+    words = rng.sample(KINDS + PARTS + USES + BRANDS + ("robot",), rng.randint(1, 4))
+    return {
+        "query": " ".join(words),
+        "terms": len(words),
+        "category": rng.choice(CATEGORIES) if rng.random() < 0.25 else None,
+        "page": rng.choice((0, 0, 0, 1, 2)),
+    }
+
+
+def main(product_count: int, queries: int, limit: int, target_ms: float, seed: int):
+    rng = random.Random(seed)
+    products = []
+    for index in range(product_count):
+        product = synthetic_product(index, rng)
+        product["category"] = rng.choice(CATEGORIES)
+        products.append(product)
+    index = ProductSearchIndex()
+
+    started = time.perf_counter()
+    index.build(products)
+    build_seconds = time.perf_counter() - started
+    stats = index.stats()
+    print(f"build        {build_seconds:8.2f} s   {stats['postings']} postings, {stats['terms']} terms,"
+          f" {len(index)} products")
+
+    workload = [random_query(rng) for _ in range(queries)]
+
+    def cursor(item: dict):
+        """The previous page's last result, which the API's cursor carries; None on the first page."""
+        after = None
+        for _ in range(item["page"]):
+            page = index.search(item["query"], category=item["category"], limit=limit, after=after)
+            if not page:
+                break
+            after = page[-1]
+        return after
+
+    def measure(label: str) -> dict:
+        samples, by_terms = [], {}
+        for item in workload:
+            after = cursor(item)
+            started = time.perf_counter()
+            index.search(item["query"], category=item["category"], limit=limit, after=after)
+            elapsed = time.perf_counter() - started
+            samples.append(elapsed)
+            by_terms.setdefault(item["terms"], []).append(elapsed)
+        summary = summarize(samples)
+        print(f"{label:<12} p50 {summary['p50_ms']:6.2f} ms   p99 {summary['p99_ms']:6.2f} ms")
+        for terms, term_samples in sorted(by_terms.items()):
+            term_summary = summarize(term_samples)
+            print(f"  {terms} term{'s' if terms > 1 else ' '}    p50 {term_summary['p50_ms']:6.2f} ms"
+                  f"   p99 {term_summary['p99_ms']:6.2f} ms")
+        return summary
+
+    results = {"products": product_count, "build_seconds": build_seconds, "query": measure("query")}
+
+    # Edits below the compaction threshold are scored from the delta
+    edited = rng.sample(range(product_count), min(500, product_count))
+    started = time.perf_counter()
+    for position in edited:
+        product = dict(products[position], name=products[position]["name"] + " Pro")
+        products[position] = product
+        index.update([product])
+    results["update_ms_per_product"] = (time.perf_counter() - started) / len(edited) * 1000
+    pending = index.stats()["pending_rows"]
+    print(f"update       {results['update_ms_per_product']:8.3f} ms per changed product ({pending} pending)")
+    results["query_with_delta"] = measure("query+delta")
+
+    worst = max(results["query"]["p99_ms"], results["query_with_delta"]["p99_ms"])
+    results["target_met"] = worst <= target_ms
+    print(f"target       p99 <= {target_ms} ms: {'met' if results['target_met'] else 'MISSED'} ({worst:.2f} ms)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=20, help="page size")
+    parser.add_argument("--target-ms", type=float, default=5.0, help="p99 latency budget per query")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    results = main(args.products, args.queries, args.limit, args.target_ms, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    sys.exit(0 if results["target_met"] else 1)
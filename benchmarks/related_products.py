@@ -0,0 +1,93 @@
+"""Related-products index: build time, query latency and incremental refresh at catalog scale.
+
+    python benchmarks/related_products.py [--products 100000] [--queries 1000] [--limit 8]
+
+Runs the index directly (no HTTP or database) over synthetic products
+whose names, descriptions and specifications are drawn from a shared
+vocabulary, so term postings have realistic lengths.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from harness import make_product, summarize  # noqa: E402
+from related import RelatedProductsIndex  # noqa: E402
+
+KINDS = ("rover", "arm", "drone", "humanoid", "hexapod", "vacuum", "tutor", "companion", "sorter", "welder")
+PARTS = (
+    "lidar", "camera", "servo", "gripper", "wheels", "tracks", "propeller", "gyroscope", "microphone", "speaker",
+    "touchscreen", "battery", "solar", "gps", "ultrasonic", "infrared", "bluetooth", "wifi", "python", "scratch",
+)
+USES = ("warehouse", "classroom", "garden", "kitchen", "hospital", "factory", "living room", "laboratory")
+
+
+def synthetic_product(index: int, rng: random.Random) -> dict:
+    kind = rng.choice(KINDS)
+    parts = rng.sample(PARTS, 4)
+    return make_product(
+        index,
+        name=f"{rng.choice(('Nova', 'Astra', 'Iron', 'Pico', 'Terra'))} {kind.title()} {index}",
+        description=f"A {kind} robot for the {rng.choice(USES)} with {', '.join(parts[:3])} and {parts[3]}",
+        specifications={"sensors": ", ".join(parts[:2]), "model": f"{kind[:3].upper()}-{index % 997}"},
+        price=round(rng.lognormvariate(5, 1), 2),
+    )
+
+
+def main(product_count: int, queries: int, limit: int, seed: int):
+    rng = random.Random(seed)
+    products = [synthetic_product(index, rng) for index in range(product_count)]
+    index = RelatedProductsIndex()
+
+    started = time.perf_counter()
+    index.build(products)
+    build_seconds = time.perf_counter() - started
+    print(f"build        {build_seconds:8.2f} s   {index.stats()['postings']} postings, {len(index)} products")
+
+    def measure(label: str) -> dict:
+        samples = []
+        for product in rng.sample(products, min(queries, len(products))):
+            started = time.perf_counter()
+            index.related(product["id"], limit)
+            samples.append(time.perf_counter() - started)
+        summary = summarize(samples)
+        print(f"{label:<12} p50 {summary['p50_ms']:6.2f} ms   p99 {summary['p99_ms']:6.2f} ms")
+        return summary
+
+    results = {"products": product_count, "build_seconds": build_seconds, "query": measure("query")}
+
+    # A trickle of edits stays in the delta; timing covers feature extraction and patching
+    edited = rng.sample(range(product_count), min(200, product_count))
+    started = time.perf_counter()
+    for position in edited:
+        product = dict(products[position], description=products[position]["description"] + " upgraded")
+        products[position] = product
+        index.update([product])
+    results["update_ms_per_product"] = (time.perf_counter() - started) / len(edited) * 1000
+    pending = index.stats()["pending_rows"]
+    print(f"update       {results['update_ms_per_product']:8.3f} ms per changed product ({pending} pending)")
+    results["query_with_delta"] = measure("query+delta")
+
+    # Stock-only changes do not touch the features and cost a fingerprint
+    started = time.perf_counter()
+    index.update([dict(product, stock_quantity=0) for product in products[:1000]])
+    results["unchanged_update_us_per_product"] = (time.perf_counter() - started) / 1000 * 1e6
+    print(f"stock-only   {results['unchanged_update_us_per_product']:8.1f} us per product")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    results = main(args.products, args.queries, args.limit, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,106 @@
+"""Sales rollups: pandas backfill throughput and dashboard reads against scanning orders.
+
+    python benchmarks/sales_rollups.py [--orders N] [--days 90] [--mongo-url mongodb://localhost:27017]
+
+Synthetic orders are spread over the last ``--days`` days. The pandas
+aggregation is timed on its own, then the full backfill including the
+rollup writes. mongomock scans the collection for every upsert, so the
+backfill grows quadratically there and is only meaningful with
+``--mongo-url``; ``--orders`` defaults to 5000 against a real mongod and
+500 against mongomock, which finishes in seconds. The dashboard
+query (30 daily store totals) is timed once from the rollups and once as
+the ``$group`` over ``orders`` it replaces.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from harness import booted_app, make_product, summarize
+
+import analytics
+
+
+async def main(order_count: int, days: int, mongo_url: str = None, seed: int = 3):
+    rng = random.Random(seed)
+    async with booted_app(mongo_url) as (server, http):
+        products = [make_product(index) for index in range(200)]
+        now = datetime.now(timezone.utc)
+        orders = []
+        for _ in range(order_count):
+            items = []
+            for product in rng.sample(products, rng.randint(1, 4)):
+                quantity = rng.randint(1, 3)
+                items.append({
+                    "product_id": product["id"],
+                    "price": product["price"],
+                    "quantity": quantity,
+                    "total": product["price"] * quantity,
+                })
+            orders.append({
+                "id": str(uuid.uuid4()),
+                "user_id": "bench",
+                "items": items,
+                "total_amount": sum(item["total"] for item in items),
+                "status": "pending",
+                "created_at": now - timedelta(seconds=rng.uniform(86400, days * 86400)),
+            })
+        for start in range(0, len(orders), 10000):
+            await server.db.orders.insert_many(orders[start:start + 10000])
+        categories = {product["id"]: product["category"] for product in products}
+
+        started = time.perf_counter()
+        analytics.combine([analytics.aggregate_orders(orders, categories)])
+        aggregate_seconds = time.perf_counter() - started
+        rate = order_count / aggregate_seconds
+        print(f"aggregate    {aggregate_seconds:7.2f} s   ({rate:,.0f} orders/s, in memory)")
+
+        started = time.perf_counter()
+        report = await server.sales_rollups.backfill(server.db.orders, categories)
+        backfill_seconds = time.perf_counter() - started
+        print(f"backfill     {backfill_seconds:7.2f} s   {report['orders']} orders -> {report['rollups']} rollups"
+              f"   ({report['orders'] / backfill_seconds:,.0f} orders/s)")
+
+        start, end = now - timedelta(days=30), now
+        rollup_samples, scan_samples = [], []
+        for _ in range(20):
+            started = time.perf_counter()
+            await server.sales_rollups.series("day", "total", "all", start, end)
+            rollup_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await server.db.orders.aggregate([
+                {"$match": {"created_at": {"$gte": start, "$lt": end}}},
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                    "orders": {"$sum": 1},
+                    "revenue": {"$sum": "$total_amount"},
+                }},
+            ]).to_list(None)
+            scan_samples.append(time.perf_counter() - started)
+        results = {
+            "orders": order_count,
+            "aggregate_seconds": aggregate_seconds,
+            "backfill_seconds": backfill_seconds,
+            "rollups": report["rollups"],
+            "dashboard_from_rollups": summarize(rollup_samples),
+            "dashboard_from_orders": summarize(scan_samples),
+        }
+        print(f"30-day view  rollups p50 {results['dashboard_from_rollups']['p50_ms']:8.2f} ms"
+              f"   orders scan p50 {results['dashboard_from_orders']['p50_ms']:8.2f} ms")
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=None, help="default 5000, or 500 against mongomock")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--mongo-url", default=None, help="benchmark against a real mongod instead of mongomock")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    order_count = args.orders or (5_000 if args.mongo_url else 500)
+    results = asyncio.run(main(order_count, args.days, args.mongo_url))
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
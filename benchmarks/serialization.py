@@ -0,0 +1,71 @@
+"""Response encoding cost for a product listing: Pydantic path vs orjson fast path.
+
+    python benchmarks/serialization.py [--items 100] [--rounds 300]
+
+The "model" path mirrors what FastAPI does for ``response_model=List[Product]``
+when a handler returns ``[Product(**doc) ...]``: build the models, dump them,
+validate the dumps against the response model, serialize in JSON mode and
+encode with the stdlib. The "fast" path is FAST_JSON_RESPONSES: documents
+projected without ``_id`` and encoded by orjson in one call.
+"""
+import argparse
+import json
+import time
+from typing import List
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from harness import make_product
+
+import server
+
+
+def model_path(documents: list, adapter: TypeAdapter) -> bytes:
+    models = [server.Product(**document) for document in documents]
+    validated = adapter.validate_python([model.model_dump() for model in models])
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def fast_path(documents: list) -> bytes:
+    fields = server.PRODUCT_FIELDS
+    content = [{field: document[field] for field in fields if field in document} for document in documents]
+    return server.FastJSONResponse(content).body
+
+
+def measure(fn, rounds: int) -> List[float]:
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main(items: int, rounds: int) -> dict:
+    # What Mongo hands back: full documents, with _id on the model path
+    documents = [make_product(index) for index in range(items)]
+    with_ids = [{"_id": ObjectId(), **document} for document in documents]
+    adapter = TypeAdapter(List[server.Product])
+
+    model_samples = measure(lambda: model_path(with_ids, adapter), rounds)
+    fast_samples = measure(lambda: fast_path(documents), rounds)
+    model_ms = sorted(model_samples)[len(model_samples) // 2] * 1000
+    fast_ms = sorted(fast_samples)[len(fast_samples) // 2] * 1000
+    return {
+        "items": items,
+        "model_p50_ms": model_ms,
+        "fast_p50_ms": fast_ms,
+        "speedup": model_ms / fast_ms if fast_ms else None,
+        "model_bytes": len(model_path(with_ids, adapter)),
+        "fast_bytes": len(fast_path(documents)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=300)
+    args = parser.parse_args()
+    print(json.dumps(main(args.items, args.rounds), indent=2))
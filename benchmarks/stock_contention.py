@@ -0,0 +1,73 @@
+"""Concurrent checkouts against scarce stock: throughput and oversell check.
+
+    python benchmarks/stock_contention.py [--buyers 200] [--stock 50] [--products 4]
+
+Every buyer orders one unit of one of ``--products`` products, each of which
+starts with ``--stock`` units. The run fails if more units are sold than
+existed or if any stock level goes negative.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from harness import booted_app, make_product, register_user, summarize
+
+USERS = 8
+
+
+async def main(buyers: int, stock: int, product_count: int, mongo_url: str = None) -> dict:
+    async with booted_app(mongo_url) as (server, http):
+        products = [make_product(index, stock_quantity=stock) for index in range(product_count)]
+        await server.db.products.insert_many([dict(product) for product in products])
+        users = [await register_user(http) for _ in range(USERS)]
+
+        async def buy(buyer: int):
+            body = {
+                "items": [{"product_id": products[buyer % product_count]["id"], "quantity": 1}],
+                "payment_method": "card",
+                "shipping_address": {"street": "1 Bench St", "city": "Testville"},
+            }
+            started = time.perf_counter()
+            response = await http.post("/api/orders", json=body, headers=users[buyer % USERS])
+            return response.status_code, time.perf_counter() - started
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(buy(buyer) for buyer in range(buyers)))
+        elapsed = time.perf_counter() - started
+
+        sold = sum(1 for code, _ in outcomes if code == 200)
+        rejected = sum(1 for code, _ in outcomes if code == 409)
+        remaining = {
+            product["id"]: product["stock_quantity"]
+            async for product in server.db.products.find({"id": {"$in": [p["id"] for p in products]}})
+        }
+        orders = await server.db.orders.count_documents({})
+        expected_sold = min(buyers, stock * product_count)
+        return {
+            "buyers": buyers,
+            "sold": sold,
+            "rejected": rejected,
+            "other": buyers - sold - rejected,
+            "orders_written": orders,
+            "remaining_stock": sum(remaining.values()),
+            "negative_stock": any(quantity < 0 for quantity in remaining.values()),
+            "oversold": sold > stock * product_count or orders != sold,
+            "expected_sold": expected_sold,
+            "throughput_per_s": buyers / elapsed,
+            "latency": summarize([latency for _, latency in outcomes]),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--buyers", type=int, default=200)
+    parser.add_argument("--stock", type=int, default=50, help="starting units per product")
+    parser.add_argument("--products", type=int, default=4)
+    parser.add_argument("--mongo-url", default=None, help="benchmark against a real mongod instead of mongomock")
+    args = parser.parse_args()
+    result = asyncio.run(main(args.buyers, args.stock, args.products, args.mongo_url))
+    print(json.dumps(result, indent=2))
+    if result["oversold"] or result["negative_stock"] or result["sold"] != result["expected_sold"]:
+        sys.exit(1)
@@ -19,19 +19,13 @@ export const Cart = () => {
 
   const fetchCart = async () => {
     try {
-      const cartResponse = await axios.get(`${API}/cart`);
+      const cartResponse = await axios.get(`${API}/cart/priced`);
       setCart(cartResponse.data);
       
-      // Fetch product details for each item in cart
-      const productPromises = cartResponse.data.items.map(item =>
-        axios.get(`${API}/products/${item.product_id}`)
-      );
-      
-      const productResponses = await Promise.all(productPromises);
+      // Lines come back priced, so no per-product requests are needed
       const productsMap = {};
-      
-      productResponses.forEach(response => {
-        productsMap[response.data.id] = response.data;
+      cartResponse.data.items.forEach(line => {
+        productsMap[line.product_id] = { id: line.product_id, ...line };
       });
       
       setProducts(productsMap);
@@ -31,7 +31,7 @@ export const Checkout = () => {
 
   const fetchCart = async () => {
     try {
-      const cartResponse = await axios.get(`${API}/cart`);
+      const cartResponse = await axios.get(`${API}/cart/priced`);
       if (!cartResponse.data || cartResponse.data.items.length === 0) {
         toast.error('Your cart is empty');
         navigate('/cart');
@@ -40,16 +40,10 @@ export const Checkout = () => {
       
       setCart(cartResponse.data);
       
-      // Fetch product details
-      const productPromises = cartResponse.data.items.map(item =>
-        axios.get(`${API}/products/${item.product_id}`)
-      );
-      
-      const productResponses = await Promise.all(productPromises);
+      // Lines come back priced, so no per-product requests are needed
       const productsMap = {};
-      
-      productResponses.forEach(response => {
-        productsMap[response.data.id] = response.data;
+      cartResponse.data.items.forEach(line => {
+        productsMap[line.product_id] = { id: line.product_id, ...line };
       });
       
       setProducts(productsMap);
@@ -94,7 +88,7 @@ export const Checkout = () => {
 
     try {
       const orderData = {
-        items: cart.items,
+        items: cart.items.map(({ product_id, quantity }) => ({ product_id, quantity })),
         payment_method: paymentMethod,
         shipping_address: shippingAddress
       };
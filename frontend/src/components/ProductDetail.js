@@ -16,9 +16,11 @@ export const ProductDetail = () => {
   const [loading, setLoading] = useState(true);
   const [quantity, setQuantity] = useState(1);
   const [selectedImage, setSelectedImage] = useState(0);
+  const [related, setRelated] = useState([]);
 
   useEffect(() => {
     fetchProduct();
+    fetchRelated();
   }, [id]);
 
   const fetchProduct = async () => {
@@ -34,6 +36,17 @@ export const ProductDetail = () => {
     }
   };
 
+  const fetchRelated = async () => {
+    try {
+      const response = await axios.get(`${API}/products/${id}/related`, { params: { limit: 4 } });
+      setRelated(response.data);
+    } catch (error) {
+      // Recommendations are optional; the page works without them
+      console.error('Error fetching related products:', error);
+      setRelated([]);
+    }
+  };
+
   const addToCart = async () => {
     if (!user) {
       toast.error('Please login to add items to cart');
@@ -264,6 +277,32 @@ export const ProductDetail = () => {
             </div>
           </div>
         </div>
+
+        {/* Related Products */}
+        {related.length > 0 && (
+          <div className="mt-16">
+            <h2 className="text-2xl font-bold mb-6">You May Also Like</h2>
+            <div className="grid grid-cols-2 md:grid-cols-4 gap-6">
+              {related.map((item) => (
+                <button
+                  key={item.id}
+                  onClick={() => {
+                    setSelectedImage(0);
+                    setQuantity(1);
+                    navigate(`/product/${item.id}`);
+                  }}
+                  className="text-left glass-effect rounded-xl overflow-hidden border border-transparent hover:border-[#8af3ff]/50 transition-all"
+                >
+                  <img src={item.image_url} alt={item.name} className="w-full h-40 object-cover" />
+                  <div className="p-4">
+                    <h3 className="font-semibold mb-2">{item.name}</h3>
+                    <span className="text-[#8af3ff] font-bold">${item.price}</span>
+                  </div>
+                </button>
+              ))}
+            </div>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -0,0 +1,88 @@
+"""Boot backend/server.py in-process against mongomock-motor.
+
+Each test gets a fresh database and runs the app's startup and shutdown
+hooks; requests go through httpx's ASGI transport. Async tests are marked
+``pytest.mark.anyio`` and run on asyncio.
+"""
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "robotics_test")
+# mongomock has no change streams
+os.environ.setdefault("CATALOG_CHANGE_STREAMS", "false")
+# Every test client shares one address
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def event_loop_lease():
+    # anyio keeps its event loop while an async fixture is alive. The app's components
+    # are module-level and bind to the loop they first run on, so every test shares one.
+    yield
+
+
+@pytest.fixture
+async def server(event_loop_lease):
+    import server as app_module
+    from mongomock_motor import AsyncMongoMockClient
+
+    app_module.database.client_factory = AsyncMongoMockClient
+    app_module.database.name = f"test_{uuid.uuid4().hex[:8]}"
+    async with app_module.app.router.lifespan_context(app_module.app):
+        yield app_module
+
+
+@pytest.fixture
+async def client(server):
+    import httpx
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        yield http
+
+
+async def register(client, email: str = None) -> dict:
+    """Register a user and return its Authorization header."""
+    response = await client.post(
+        "/api/auth/register",
+        json={"email": email or f"{uuid.uuid4().hex[:10]}@example.com", "password": "pw-123456", "full_name": "Test"},
+    )
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def make_product(index: int, **overrides) -> dict:
+    product = {
+        "id": str(uuid.uuid4()),
+        "name": f"Test Robot {index}",
+        "description": f"Test robot number {index}",
+        "price": 10.0 + index,
+        "image_url": "https://example.com/robot.png",
+        "category": "educational",
+        "specifications": {},
+        "stock_quantity": 100,
+        "featured": False,
+        "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=index),
+    }
+    product.update(overrides)
+    return product
+
+
+async def add_products(server, products: list):
+    """Insert ``products`` and refresh the catalog cache, as the change feed would."""
+    await server.db.products.insert_many([dict(product) for product in products])
+    if server.catalog_available():
+        await server.catalog.load()
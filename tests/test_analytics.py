@@ -0,0 +1,96 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import BulkWriteError, NetworkTimeout
+
+from analytics import SalesRollups
+
+pytestmark = pytest.mark.anyio
+
+
+class FailingRollups:
+    """A rollups collection whose next ``bulk_write`` fails, before or after applying."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.failure = None
+
+    async def bulk_write(self, operations, **kwargs):
+        failure, self.failure = self.failure, None
+        if failure == "rejected":
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 2, "errmsg": "rejected"}],
+                                  "nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0})
+        result = await self.collection.bulk_write(operations, **kwargs)
+        if failure == "timeout":
+            # The server applied the increments but the acknowledgement was lost
+            raise NetworkTimeout("timed out")
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+@pytest.fixture
+def rollups():
+    from mongomock_motor import AsyncMongoMockClient
+
+    db = AsyncMongoMockClient()[f"test_{uuid.uuid4().hex[:8]}"]
+    return SalesRollups(FailingRollups(db.sales_rollups), db.sales_rollup_orders, db.analytics_state), db
+
+
+def make_order(created_at: datetime) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "created_at": created_at,
+        "items": [{"product_id": "p1", "category": "educational", "quantity": 2, "total": 20.0}],
+    }
+
+
+async def total_orders(db, bucket: datetime) -> int:
+    document = await db.sales_rollups.find_one({"_id": f"day|total|all|{bucket.strftime('%Y-%m-%dT%H')}"})
+    return document["orders"] if document else 0
+
+
+async def test_redelivered_order_is_counted_once(rollups):
+    store, db = rollups
+    order = make_order(datetime.now(timezone.utc))
+
+    assert await store.apply_order(order)
+    assert not await store.apply_order(order)
+    marker = await db.sales_rollup_orders.find_one({"_id": order["id"]})
+    assert "pending" not in marker
+    assert await total_orders(db, order["created_at"].replace(hour=0, minute=0, second=0, microsecond=0)) == 1
+
+
+async def test_failure_that_applied_nothing_is_retried(rollups):
+    store, db = rollups
+    order = make_order(datetime.now(timezone.utc))
+
+    store.collection.failure = "rejected"
+    with pytest.raises(BulkWriteError):
+        await store.apply_order(order)
+    assert await db.sales_rollup_orders.count_documents({}) == 0
+    assert await store.apply_order(order)
+    assert await total_orders(db, order["created_at"].replace(hour=0, minute=0, second=0, microsecond=0)) == 1
+
+
+async def test_ambiguous_failure_is_not_counted_twice(rollups):
+    store, db = rollups
+    now = datetime.now(timezone.utc)
+    order = make_order(now - timedelta(days=1))
+    day = order["created_at"].replace(hour=0, minute=0, second=0, microsecond=0)
+
+    store.collection.failure = "timeout"
+    with pytest.raises(NetworkTimeout):
+        await store.apply_order(order)
+    # The outbox retry skips it rather than adding the increments again
+    assert not await store.apply_order(order)
+    assert store.stats()["unconfirmed"] == 1
+    assert (await db.sales_rollup_orders.find_one({"_id": order["id"]}))["pending"] is True
+    assert await total_orders(db, day) == 1
+
+    await db.orders.insert_one(dict(order))
+    result = await store.backfill(db.orders, {}, now=now)
+    assert result["reconciled"] == 1
+    assert await total_orders(db, day) == 1
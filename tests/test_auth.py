@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+import pytest
+
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_saturated_hash_pool_answers_503(server, client, monkeypatch):
+    release = threading.Event()
+    hash_password = server.get_password_hash
+
+    def slow_hash(password):
+        release.wait(5)
+        return hash_password(password)
+
+    monkeypatch.setattr(server, "get_password_hash", slow_hash)
+    monkeypatch.setattr(server.password_pool, "max_pending", 2)
+    rejected = server.password_pool.rejected
+
+    first = [asyncio.create_task(register(client)) for _ in range(2)]
+    while server.password_pool.pending < 2:
+        await asyncio.sleep(0.01)
+    busy = await client.post(
+        "/api/auth/register", json={"email": "busy@example.com", "password": "pw-123456", "full_name": "Busy"}
+    )
+    assert busy.status_code == 503
+    assert busy.headers["retry-after"] == "1"
+    assert server.password_pool.rejected == rejected + 1
+
+    release.set()
+    await asyncio.gather(*first)
+    assert server.password_pool.pending == 0
+    await register(client, "busy@example.com")
@@ -0,0 +1,157 @@
+import json
+import uuid
+
+import pytest
+
+from tests.conftest import add_products, make_product, register
+
+pytestmark = pytest.mark.anyio
+
+NDJSON = {"Content-Type": "application/x-ndjson"}
+CSV = {"Content-Type": "text/csv"}
+
+
+async def admin(server, client) -> dict:
+    email = f"{uuid.uuid4().hex[:10]}@example.com"
+    headers = await register(client, email)
+    await server.db.users.update_one({"email": email}, {"$set": {"is_admin": True}})
+    user = await server.db.users.find_one({"email": email})
+    server.user_cache.invalidate(user["id"])
+    return headers
+
+
+def ndjson(*rows) -> bytes:
+    return "\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows).encode() + b"\n"
+
+
+def row(index: int, **overrides) -> dict:
+    product = make_product(index, **overrides)
+    product["created_at"] = product["created_at"].isoformat()
+    return product
+
+
+async def test_import_and_export_require_an_admin(server, client):
+    headers = await register(client)
+    count = await server.db.products.count_documents({})
+    response = await client.post("/api/admin/products/import", content=ndjson(row(0)), headers={**headers, **NDJSON})
+    assert response.status_code == 403
+    assert (await client.get("/api/admin/products/export", headers=headers)).status_code == 403
+    assert (await client.get("/api/admin/products/export")).status_code in (401, 403)
+    assert await server.db.products.count_documents({}) == count
+
+
+async def test_ndjson_import_reports_row_errors_and_counts(server, client):
+    headers = await admin(server, client)
+    existing = make_product(0)
+    await add_products(server, [existing])
+    count = await server.db.products.count_documents({})
+    body = ndjson(
+        {**row(1), "id": existing["id"], "price": 99.0},
+        row(2),
+        "{not json",
+        {**row(3), "price": "free"},
+        [1, 2],
+        {**row(4), "id": ""},
+        "",
+        {key: value for key, value in row(5).items() if key != "id"},
+    )
+    response = await client.post("/api/admin/products/import", content=body, headers={**headers, **NDJSON})
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert (report["rows"], report["valid"], report["failed"]) == (7, 3, 4)
+    assert (report["inserted"], report["updated"], report["unchanged"]) == (2, 1, 0)
+    assert [error["row"] for error in report["errors"]] == [3, 4, 5, 6]
+    assert "price" in report["errors"][1]["errors"][0]
+    assert report["errors"][2]["errors"] == ["row must be an object"]
+    assert report["errors"][3]["errors"] == ["id must be a non-empty string"]
+
+    stored = await server.db.products.find_one({"id": existing["id"]})
+    assert stored["price"] == 99.0 and stored["name"] == "Test Robot 1"
+    assert await server.db.products.count_documents({}) == count + 2
+    assert (await client.get(f"/api/products/{existing['id']}")).json()["price"] == 99.0
+
+    # Re-importing writes only the row without an id, which gets a new one each time
+    response = await client.post("/api/admin/products/import", content=body, headers={**headers, **NDJSON})
+    report = response.json()
+    assert (report["inserted"], report["updated"], report["unchanged"]) == (1, 0, 2)
+
+
+async def test_csv_import_handles_quoted_newlines_and_bad_rows(server, client):
+    headers = await admin(server, client)
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    body = (
+        "id,name,description,price,image_url,category,specifications,stock_quantity,featured\n"
+        f'{first},Arm,"Two\nlines, one ""quote""",19.5,'
+        'https://example.com/a.png,industrial,"{""axes"": 6}",4,true\n'
+        f"{second},Rover,Wheels,not-a-price,https://example.com/b.png,educational,{{}},1,false\n"
+        f"{second},Rover,Wheels,7,https://example.com/b.png,educational,not-json,1,false\n"
+        "short,row\n"
+    ).encode()
+    response = await client.post("/api/admin/products/import", content=body, headers={**headers, **CSV})
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert (report["rows"], report["valid"], report["failed"], report["inserted"]) == (4, 1, 3, 1)
+    assert [(error["row"], error["id"]) for error in report["errors"]] == [(4, second), (5, None), (6, None)]
+    assert report["errors"][1]["errors"] == ["specifications must be a JSON object"]
+    assert report["errors"][2]["errors"] == ["Expected 9 columns, got 2"]
+
+    stored = await server.db.products.find_one({"id": first}, {"_id": 0})
+    assert stored["description"] == 'Two\nlines, one "quote"'
+    assert stored["specifications"] == {"axes": 6}
+    assert (stored["price"], stored["stock_quantity"], stored["featured"]) == (19.5, 4, True)
+
+
+async def test_overlong_lines_and_records_are_row_errors(server):
+    from bulk import csv_rows, import_products, ndjson_rows
+
+    def chunks(body: bytes):
+        async def stream():
+            for offset in range(0, len(body), 256):
+                yield body[offset:offset + 256]
+        return stream()
+
+    body = ndjson(row(0), {**row(1), "description": "x" * 5000}, row(2))
+    rows = ndjson_rows(chunks(body), max_length=600)
+    report = await import_products(rows, server.db.products, server.ProductCreate)
+    assert (report["rows"], report["inserted"], report["failed"]) == (3, 2, 1)
+    assert report["errors"][0]["row"] == 2
+    assert report["errors"][0]["errors"] == ["Line is longer than 600 bytes"]
+
+    # A quoted field spanning many short lines is capped as a whole and skipped to its end
+    spread = "\n".join(["y" * 50] * 40)
+    body = f'id,name\na,"{spread}"\nb,Rover\n'.encode()
+    rows = [item async for item in csv_rows(chunks(body), max_length=600)]
+    assert [number for number, _ in rows] == [2, 42]
+    assert str(rows[0][1]) == "Record is longer than 600 bytes"
+    assert rows[1][1] == {"id": "b", "name": "Rover"}
+
+
+@pytest.mark.parametrize("file_format", ["ndjson", "csv"])
+async def test_export_round_trips_through_import(server, client, file_format):
+    headers = await admin(server, client)
+    products = [
+        make_product(0, specifications={"payload_kg": 2.5}, featured=True),
+        make_product(1, description='Comma, "quotes"\nand a newline'),
+        make_product(2),
+    ]
+    await server.db.products.delete_many({})
+    await add_products(server, products)
+    response = await client.get(f"/api/admin/products/export?format={file_format}", headers=headers)
+    assert response.status_code == 200
+    assert f"products.{file_format}" in response.headers["content-disposition"]
+    exported = response.content
+
+    await server.db.products.delete_many({})
+    response = await client.post(
+        f"/api/admin/products/import?format={file_format}", content=exported, headers=headers
+    )
+    report = response.json()
+    assert (report["inserted"], report["failed"]) == (3, 0), report
+
+    stored = {product["id"]: product async for product in server.db.products.find({}, {"_id": 0})}
+    for product in products:
+        restored = stored[product["id"]]
+        for field in ("name", "description", "price", "category", "specifications", "stock_quantity", "featured"):
+            assert restored[field] == product[field], field
+    second = await client.get(f"/api/admin/products/export?format={file_format}", headers=headers)
+    assert second.content.count(b"\n") == exported.count(b"\n")
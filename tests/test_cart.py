@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from tests.conftest import add_products, make_product, register
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_cart_mutations_lose_no_updates(server, client):
+    products = [make_product(index) for index in range(3)]
+    await add_products(server, products)
+    headers = await register(client)
+    first, second, third = (product["id"] for product in products)
+    requests = 50
+
+    single = [
+        client.post("/api/cart/add", json={"product_id": first, "quantity": 1}, headers=headers)
+        for _ in range(requests)
+    ]
+    bulk = [
+        client.post(
+            "/api/cart/bulk",
+            json={"operations": [
+                {"action": "add", "product_id": second, "quantity": 1},
+                {"action": "add", "product_id": third, "quantity": 1},
+            ]},
+            headers=headers,
+        )
+        for _ in range(requests)
+    ]
+    responses = await asyncio.gather(*single, *bulk)
+    assert [response.status_code for response in responses] == [200] * (2 * requests)
+
+    cart = (await client.get("/api/cart", headers=headers)).json()
+    quantities = {item["product_id"]: item["quantity"] for item in cart["items"]}
+    assert quantities == {first: requests, second: requests, third: requests}
+
+
+async def test_priced_cart_totals_follow_the_cart_and_the_catalog(server, client):
+    products = [make_product(0, price=12.5), make_product(1, price=4.0)]
+    await add_products(server, products)
+    headers = await register(client)
+    first, second = (product["id"] for product in products)
+    await client.post("/api/cart/add", json={"product_id": first, "quantity": 2}, headers=headers)
+    await client.post("/api/cart/add", json={"product_id": second, "quantity": 3}, headers=headers)
+
+    async def priced() -> dict:
+        response = await client.get("/api/cart/priced", headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    cart = await priced()
+    assert {line["product_id"]: line["line_total"] for line in cart["items"]} == {first: 25.0, second: 12.0}
+    assert cart["subtotal"] == 37.0 and cart["item_count"] == 5
+    hits = server.priced_carts.hits
+    assert await priced() == cart
+    assert server.priced_carts.hits == hits + 1
+
+    # A cart change, a price change and a stock change each drop the cached entry
+    await client.post("/api/cart/add", json={"product_id": second, "quantity": 1}, headers=headers)
+    cart = await priced()
+    assert cart["subtotal"] == 41.0 and cart["item_count"] == 6
+
+    await server.db.products.update_one({"id": first}, {"$set": {"price": 20.0}})
+    await server.catalog.load()
+    cart = await priced()
+    assert cart["subtotal"] == 56.0
+
+    await server.db.products.update_one({"id": second}, {"$set": {"stock_quantity": 1}})
+    await server.catalog.load()
+    lines = {line["product_id"]: line for line in (await priced())["items"]}
+    assert lines[second]["stock_quantity"] == 1
+    assert server.priced_carts.hits == hits + 1
+
+    await server.db.products.delete_one({"id": second})
+    await server.catalog.load()
+    cart = await priced()
+    assert cart["unavailable_product_ids"] == [second]
+    assert cart["subtotal"] == 40.0 and cart["item_count"] == 2
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from catalog import CatalogCache, CatalogWatcher
+from tests.conftest import add_products, make_product
+
+pytestmark = pytest.mark.anyio
+
+
+async def wait_for(predicate, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def test_poll_picks_up_stock_changes_and_ignores_quiet_periods(server):
+    product = make_product(0, stock_quantity=10)
+    await add_products(server, [product])
+    cache = CatalogCache(server.db.products, poll_interval=0.02, change_streams=False)
+    await cache.load()
+    cache.start()
+    try:
+        # The first poll records the signature; later ones find nothing new
+        await asyncio.sleep(0.2)
+        version = cache.version
+        await asyncio.sleep(0.2)
+        assert cache.version == version
+
+        await server.reserve_stock({product["id"]: 3})
+        await wait_for(lambda: cache.get(product["id"])["stock_quantity"] == 7)
+        await server.release_stock({product["id"]: 3})
+        await wait_for(lambda: cache.get(product["id"])["stock_quantity"] == 10)
+
+        await server.db.products.delete_one({"id": product["id"]})
+        await wait_for(lambda: cache.get(product["id"]) is None)
+    finally:
+        await cache.stop()
+
+
+async def test_watcher_refreshes_on_change_and_when_woken(server):
+    product = make_product(0, stock_quantity=10)
+    await add_products(server, [product])
+    refreshed = []
+
+    async def on_change():
+        refreshed.append(await server.db.products.count_documents({}))
+
+    watcher = CatalogWatcher(server.db.products, on_change, poll_interval=0.05)
+    assert await watcher.changed()
+    assert not await watcher.changed()
+    watcher.start()
+    try:
+        await asyncio.sleep(0.2)
+        assert refreshed == []
+
+        await server.reserve_stock({product["id"]: 1})
+        await wait_for(lambda: len(refreshed) == 1)
+
+        # Woken, it does not wait for the next poll
+        watcher.poll_interval = 60
+        await asyncio.sleep(0.1)
+        await add_products(server, [make_product(1)])
+        watcher.wake()
+        await wait_for(lambda: len(refreshed) == 2)
+        assert refreshed[1] == refreshed[0] + 1
+    finally:
+        await watcher.stop()
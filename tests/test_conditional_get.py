@@ -0,0 +1,39 @@
+import pytest
+
+from tests.conftest import add_products, make_product
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_product_etag_answers_304_until_the_product_changes(server, client):
+    product = make_product(0)
+    await add_products(server, [product])
+    path = f"/api/products/{product['id']}"
+
+    first = await client.get(path)
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and etag.startswith('"')
+
+    cached = await client.get(path, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag and cached.content == b""
+    # Weak comparison, as sent by proxies that recompress
+    assert (await client.get(path, headers={"If-None-Match": f'"other", W/{etag}'})).status_code == 304
+
+    await server.reserve_stock({product["id"]: 1})
+    if server.catalog_available():
+        await server.catalog.load()
+    changed = await client.get(path, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["stock_quantity"] == product["stock_quantity"] - 1
+
+
+async def test_listing_etag_depends_on_the_query(server, client):
+    await add_products(server, [make_product(index) for index in range(3)])
+    listing = await client.get("/api/products", params={"category": "educational"})
+    etag = listing.headers["ETag"]
+    cached = await client.get("/api/products", params={"category": "educational"}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    other = await client.get("/api/products", params={"category": "industrial"}, headers={"If-None-Match": etag})
+    assert other.status_code == 200 and other.headers["ETag"] != etag
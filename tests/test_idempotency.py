@@ -0,0 +1,113 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from tests.conftest import add_products, make_product, register
+
+pytestmark = pytest.mark.anyio
+
+
+def order_body(product_id: str, quantity: int = 1) -> dict:
+    return {
+        "items": [{"product_id": product_id, "quantity": quantity}],
+        "payment_method": "card",
+        "shipping_address": {"street": "1 Test St", "city": "Testville"},
+    }
+
+
+async def test_retried_order_is_placed_once_and_replayed(server, client):
+    product = make_product(0, stock_quantity=100)
+    await add_products(server, [product])
+    headers = dict(await register(client), **{"Idempotency-Key": uuid.uuid4().hex})
+
+    first = await client.post("/api/orders", json=order_body(product["id"]), headers=headers)
+    retry = await client.post("/api/orders", json=order_body(product["id"]), headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["id"] == first.json()["id"]
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert await server.db.orders.count_documents({}) == 1
+
+
+async def test_concurrent_retries_run_the_handler_once(server, client):
+    product = make_product(0, stock_quantity=100)
+    await add_products(server, [product])
+    headers = dict(await register(client), **{"Idempotency-Key": uuid.uuid4().hex})
+
+    responses = await asyncio.gather(
+        *(client.post("/api/orders", json=order_body(product["id"]), headers=headers) for _ in range(5))
+    )
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.json()["id"] for response in responses}) == 1
+    assert await server.db.orders.count_documents({}) == 1
+
+
+async def test_key_reused_for_a_different_request_is_rejected(server, client):
+    product = make_product(0, stock_quantity=100)
+    await add_products(server, [product])
+    headers = dict(await register(client), **{"Idempotency-Key": uuid.uuid4().hex})
+
+    assert (await client.post("/api/orders", json=order_body(product["id"]), headers=headers)).status_code == 200
+    reused = await client.post("/api/orders", json=order_body(product["id"], quantity=2), headers=headers)
+    assert reused.status_code == 422
+    assert await server.db.orders.count_documents({}) == 1
+
+
+async def test_key_reused_while_the_first_request_runs_is_rejected(server, client):
+    product = make_product(0, stock_quantity=100)
+    await add_products(server, [product])
+    headers = dict(await register(client), **{"Idempotency-Key": uuid.uuid4().hex})
+
+    responses = await asyncio.gather(
+        *(client.post("/api/orders", json=order_body(product["id"]), headers=headers) for _ in range(3)),
+        client.post("/api/orders", json=order_body(product["id"], quantity=2), headers=headers),
+    )
+    assert sorted(response.status_code for response in responses) == [200, 200, 200, 422]
+    assert await server.db.orders.count_documents({}) == 1
+
+
+async def test_client_errors_are_replayed_and_requests_without_a_key_are_not(server, client):
+    product = make_product(0, stock_quantity=1)
+    await add_products(server, [product])
+    auth = await register(client)
+    headers = dict(auth, **{"Idempotency-Key": uuid.uuid4().hex})
+
+    refused = await client.post("/api/orders", json=order_body(product["id"], quantity=5), headers=headers)
+    assert refused.status_code == 409
+    replayed = await client.post("/api/orders", json=order_body(product["id"], quantity=5), headers=headers)
+    assert replayed.status_code == 409
+    assert replayed.json() == refused.json() and replayed.headers["Idempotent-Replayed"] == "true"
+
+    # Keys are scoped per user
+    other = dict(await register(client), **{"Idempotency-Key": headers["Idempotency-Key"]})
+    assert (await client.post("/api/orders", json=order_body(product["id"]), headers=other)).status_code == 200
+    assert (await client.post("/api/orders", json=order_body(product["id"]), headers=auth)).status_code == 409
+
+
+async def test_server_errors_release_the_key_for_a_retry(server, client, monkeypatch):
+    product = make_product(0, stock_quantity=100)
+    await add_products(server, [product])
+    headers = dict(await register(client), **{"Idempotency-Key": uuid.uuid4().hex})
+    place_new_order = server.place_new_order
+    failures = [HTTPException(status_code=503, detail="Payment provider unavailable"), RuntimeError("boom")]
+
+    async def flaky(*args):
+        if failures:
+            raise failures.pop(0)
+        return await place_new_order(*args)
+
+    monkeypatch.setattr(server, "place_new_order", flaky)
+    released = server.idempotency.released
+    failed = await client.post("/api/orders", json=order_body(product["id"]), headers=headers)
+    assert failed.status_code == 503 and failed.json() == {"detail": "Payment provider unavailable"}
+    with pytest.raises(RuntimeError):
+        await client.post("/api/orders", json=order_body(product["id"]), headers=headers)
+    assert server.idempotency.released == released + 2
+
+    placed = await client.post("/api/orders", json=order_body(product["id"]), headers=headers)
+    assert placed.status_code == 200 and "Idempotent-Replayed" not in placed.headers
+    replayed = await client.post("/api/orders", json=order_body(product["id"]), headers=headers)
+    assert replayed.json()["id"] == placed.json()["id"] and replayed.headers["Idempotent-Replayed"] == "true"
+    assert await server.db.orders.count_documents({}) == 1
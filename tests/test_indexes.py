@@ -0,0 +1,25 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_ensure_indexes_reports_existing_created_and_failed(server):
+    report = server.app.state.index_report
+    assert report["users"]["created"] == ["email_unique", "id_unique"]
+    assert set(report) == set(server.INDEX_SPECS)
+
+    # Re-running is a no-op
+    again = await server.ensure_indexes()
+    for collection, specs in server.INDEX_SPECS.items():
+        names = [options["name"] for _, options in specs]
+        assert again[collection] == {"existing": names, "created": [], "failed": []}
+
+    # A unique index cannot be built over duplicates; the other indexes are unaffected
+    await server.db.users.drop_index("email_unique")
+    await server.db.users.insert_many([
+        {"id": "a", "email": "twin@example.com"},
+        {"id": "b", "email": "twin@example.com"},
+    ])
+    report = await server.ensure_indexes()
+    assert report["users"] == {"existing": ["id_unique"], "created": [], "failed": ["email_unique"]}
+    assert "email_unique" not in await server.db.users.index_information()
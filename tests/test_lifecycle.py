@@ -0,0 +1,37 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_sigterm_drains_before_handing_off_to_the_server(server, client):
+    handed_off = []
+    assert server.lifecycle.drain_on_sigterm(0.2, hand_off=lambda: handed_off.append(True))
+    assert (await client.get("/readyz")).status_code == 200
+
+    os.kill(os.getpid(), signal.SIGTERM)
+    await asyncio.sleep(0.05)
+    readiness = await client.get("/readyz")
+    assert readiness.status_code == 503 and readiness.json()["draining"] is True
+    refused = await client.get("/api/products")
+    assert refused.status_code == 503
+    assert refused.headers["connection"] == "close" and refused.headers["retry-after"] == "1"
+    assert (await client.get("/healthz")).status_code == 200
+    assert handed_off == []
+
+    await asyncio.sleep(0.3)
+    assert handed_off == [True]
+
+
+async def test_second_sigterm_hands_off_at_once(server):
+    handed_off = []
+    server.lifecycle.drain_on_sigterm(60, hand_off=lambda: handed_off.append(True))
+    os.kill(os.getpid(), signal.SIGTERM)
+    await asyncio.sleep(0.05)
+    assert server.lifecycle.draining and handed_off == []
+    os.kill(os.getpid(), signal.SIGTERM)
+    await asyncio.sleep(0.05)
+    assert handed_off == [True]
@@ -0,0 +1,42 @@
+import re
+import uuid
+
+import pytest
+
+from tests.conftest import add_products, make_product
+
+pytestmark = pytest.mark.anyio
+
+
+def sample(exposition: str, name: str, **labels) -> float:
+    """The value of one series in a Prometheus text exposition (0 when absent)."""
+    label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf"^{re.escape(name)}{{{re.escape(label_text)}}} (\S+)$", exposition, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+async def test_metrics_are_labelled_by_route_template(server, client):
+    product = make_product(0)
+    await add_products(server, [product])
+    before = (await client.get("/metrics")).text
+    missing = uuid.uuid4().hex
+
+    assert (await client.get(f"/api/products/{product['id']}")).status_code == 200
+    assert (await client.get(f"/api/products/{missing}")).status_code == 404
+    assert (await client.get(f"/api/no-such-route/{missing}")).status_code == 404
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    exposition = response.text
+    assert "# TYPE http_requests_total counter" in exposition
+    assert "# TYPE http_request_duration_seconds histogram" in exposition
+    detail = "/api/products/{product_id}"
+    for route, status in ((detail, "200"), (detail, "404"), ("unmatched", "404")):
+        labels = {"method": "GET", "route": route, "status": status}
+        counted = sample(exposition, "http_requests_total", **labels)
+        assert counted == sample(before, "http_requests_total", **labels) + 1, labels
+    # Raw paths never become labels
+    assert missing not in exposition and product["id"] not in exposition
+    assert sample(exposition, "http_request_duration_seconds_count", method="GET", route=detail)
+    assert 'app_runtime_stat{component="auth_cache",stat="hits"}' in exposition
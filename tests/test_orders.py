@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from tests.conftest import add_products, make_product, register
+
+pytestmark = pytest.mark.anyio
+
+
+def order_body(product_id: str, quantity: int = 1) -> dict:
+    return {
+        "items": [{"product_id": product_id, "quantity": quantity}],
+        "payment_method": "card",
+        "shipping_address": {"street": "1 Test St", "city": "Testville"},
+    }
+
+
+class FailingInserts:
+    """A collection whose ``insert_one`` fails."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert_one(self, document, **kwargs):
+        raise PyMongoError("insert failed")
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+class FailingOrders:
+    """The database, except that inserting an order fails."""
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def orders(self):
+        return FailingInserts(self.db.orders)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+async def test_concurrent_checkouts_never_oversell(server, client):
+    product = make_product(0, stock_quantity=3)
+    await add_products(server, [product])
+    buyers = [await register(client) for _ in range(10)]
+
+    responses = await asyncio.gather(
+        *(client.post("/api/orders", json=order_body(product["id"]), headers=headers) for headers in buyers)
+    )
+    assert sorted(response.status_code for response in responses) == [200] * 3 + [409] * 7
+    assert (await server.db.products.find_one({"id": product["id"]}))["stock_quantity"] == 0
+    assert await server.db.orders.count_documents({}) == 3
+
+
+async def test_failed_order_insert_releases_the_reserved_stock(server, monkeypatch):
+    product = make_product(0, stock_quantity=5)
+    await add_products(server, [product])
+    order = {
+        "id": "order-1",
+        "user_id": "user-1",
+        "items": [{"product_id": product["id"], "quantity": 2, "price": product["price"]}],
+        "total_amount": 2 * product["price"],
+        "created_at": product["created_at"],
+        "item_count": 2,
+    }
+    monkeypatch.setattr(server, "db", FailingOrders(server.db))
+
+    with pytest.raises(PyMongoError):
+        await server.place_order(order)
+    assert (await server.db.products.find_one({"id": product["id"]}))["stock_quantity"] == 5
+    assert await server.db.order_events.count_documents({}) == 0
+
+
+async def test_order_summary_stats_and_detail(server, client):
+    product = make_product(0, price=10.0, stock_quantity=100)
+    await add_products(server, [product])
+    headers, other = await register(client), await register(client)
+    placed = []
+    for quantity in (1, 2, 3):
+        response = await client.post("/api/orders", json=order_body(product["id"], quantity), headers=headers)
+        assert response.status_code == 200, response.text
+        placed.append(response.json())
+
+    summaries = (await client.get("/api/orders", params={"view": "summary"}, headers=headers)).json()
+    assert [summary["id"] for summary in summaries] == [order["id"] for order in reversed(placed)]
+    assert set(summaries[0]) == {"id", "created_at", "total_amount", "status", "item_count"}
+    assert [summary["item_count"] for summary in summaries] == [3, 2, 1]
+
+    stats = (await client.get("/api/orders/stats", headers=headers)).json()
+    assert stats["order_count"] == 3 and stats["item_count"] == 6 and stats["total_spent"] == 60.0
+    # Without the rollup (orders placed before it existed) the stats are aggregated from the orders
+    await server.db.user_order_stats.delete_many({})
+    assert (await client.get("/api/orders/stats", headers=headers)).json() == stats
+    assert (await client.get("/api/orders/stats", headers=other)).json()["order_count"] == 0
+
+    detail = await client.get(f"/api/orders/{placed[0]['id']}", headers=headers)
+    assert detail.status_code == 200
+    # Mongo keeps milliseconds, so compare everything but the timestamp
+    assert {**detail.json(), "created_at": None} == {**placed[0], "created_at": None}
+    assert (await client.get(f"/api/orders/{placed[0]['id']}", headers=other)).status_code == 404
+    assert (await client.get("/api/orders/no-such-order", headers=headers)).status_code == 404
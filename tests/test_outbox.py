@@ -0,0 +1,61 @@
+import pytest
+
+from outbox import Outbox
+
+pytestmark = pytest.mark.anyio
+
+
+async def drain(outbox: Outbox) -> int:
+    """Run batches until nothing is claimable; returns how many batches claimed events."""
+    batches = 0
+    while await outbox.run_once():
+        batches += 1
+    return batches
+
+
+async def test_failing_handler_is_retried_until_it_succeeds(server):
+    outbox = Outbox(server.db.outbox_retry_test, retry_base_seconds=0, max_attempts=10)
+    failures = 3
+    calls = {"flaky": 0, "steady": 0}
+
+    async def steady(event):
+        calls["steady"] += 1
+
+    async def flaky(event):
+        calls["flaky"] += 1
+        if calls["flaky"] <= failures:
+            raise RuntimeError(f"failure {calls['flaky']}")
+
+    outbox.register("order.placed", steady, name="steady")
+    outbox.register("order.placed", flaky, name="flaky")
+    event = Outbox.event("order.placed", "order-1", {"total": 10.0})
+    await outbox.collection.insert_one(event)
+
+    assert await drain(outbox) == failures + 1
+    # The handler that already succeeded is not run again on retry
+    assert calls == {"flaky": failures + 1, "steady": 1}
+    assert (outbox.retried, outbox.delivered, outbox.dead) == (failures, 1, 0)
+    stored = await outbox.collection.find_one({"_id": event["_id"]})
+    assert stored["status"] == "done" and stored["attempts"] == failures
+    assert stored["handled"] == ["steady"] and stored["last_error"] == "flaky: RuntimeError('failure 3')"
+
+
+async def test_event_is_parked_after_max_attempts(server):
+    outbox = Outbox(server.db.outbox_parked_test, retry_base_seconds=0, max_attempts=2)
+    calls = []
+
+    async def broken(event):
+        calls.append(event["_id"])
+        raise RuntimeError("down")
+
+    outbox.register("order.placed", broken, name="broken")
+    event = Outbox.event("order.placed", "order-2", {})
+    await outbox.collection.insert_one(event)
+
+    assert await drain(outbox) == 2
+    assert len(calls) == 2 and (outbox.retried, outbox.dead) == (1, 1)
+    assert (await outbox.collection.find_one({"_id": event["_id"]}))["status"] == "failed"
+
+    assert await outbox.requeue_failed() == 1
+    assert await drain(outbox) == 2
+    assert len(calls) == 4
@@ -0,0 +1,99 @@
+import base64
+import json
+
+import pytest
+
+from tests.conftest import add_products, make_product, register
+
+pytestmark = pytest.mark.anyio
+
+
+def raw_cursor(data) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+async def collect(client, path: str, params: dict, headers: dict = None) -> list:
+    """Follow X-Next-Cursor to the end and return every page's ids."""
+    pages, cursor = [], None
+    while True:
+        page_params = dict(params, **({"cursor": cursor} if cursor else {}))
+        response = await client.get(path, params=page_params, headers=headers)
+        assert response.status_code == 200, response.text
+        pages.append([item["id"] for item in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+async def test_product_pages_cover_the_listing_once(server, client):
+    # Tied prices make the id tie-breaker matter
+    await add_products(server, [make_product(index, price=float(index % 4)) for index in range(23)])
+    full = (await client.get("/api/products", params={"sort": "price", "order": "asc", "limit": 500})).json()
+    pages = await collect(client, "/api/products", {"sort": "price", "order": "asc", "limit": 5})
+    assert len(full) > 20
+    assert all(len(page) == 5 for page in pages[:-1]) and 0 < len(pages[-1]) <= 5
+    assert [product_id for page in pages for product_id in page] == [product["id"] for product in full]
+
+
+async def test_search_pages_follow_relevance_order(server, client):
+    # Equal scores make the id tie-breaker matter
+    products = [make_product(index, name=f"Sorting Gizmo {index % 3}") for index in range(11)]
+    await add_products(server, products)
+    full = (await client.get("/api/products", params={"search": "gizmo", "limit": 500})).json()
+    pages = await collect(client, "/api/products", {"search": "gizmo", "limit": 3})
+    assert [len(page) for page in pages] == [3, 3, 3, 2]
+    assert [product_id for page in pages for product_id in page] == [product["id"] for product in full]
+
+
+async def test_order_pages_cover_every_order(server, client):
+    headers = await register(client)
+    product = make_product(0, stock_quantity=1000)
+    await add_products(server, [product])
+    body = {
+        "items": [{"product_id": product["id"], "quantity": 1}],
+        "payment_method": "card",
+        "shipping_address": {"street": "1 Test St", "city": "Testville"},
+    }
+    placed = []
+    for _ in range(5):
+        response = await client.post("/api/orders", json=body, headers=headers)
+        assert response.status_code == 200, response.text
+        placed.append(response.json()["id"])
+    pages = await collect(client, "/api/orders", {"limit": 2}, headers)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sorted(product_id for page in pages for product_id in page) == sorted(placed)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "!!!",
+        raw_cursor([1, 2]),
+        raw_cursor({"offset": 3}),
+        raw_cursor({"v": 1}),
+        raw_cursor({"id": "a"}),
+        raw_cursor({"v": {"$ne": None}, "id": "a"}),
+        raw_cursor({"v": 1, "id": 2}),
+    ],
+)
+async def test_malformed_cursors_are_rejected(server, client, cursor):
+    headers = await register(client)
+    for path, params in (
+        ("/api/products", {"cursor": cursor}),
+        ("/api/products", {"cursor": cursor, "search": "robot"}),
+        ("/api/orders", {"cursor": cursor}),
+    ):
+        response = await client.get(path, params=params, headers=headers)
+        assert response.status_code == 400, (path, params, response.text)
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+async def test_cursor_from_another_listing_is_rejected(server, client):
+    await add_products(server, [make_product(index) for index in range(3)])
+    response = await client.get("/api/products", params={"sort": "price", "limit": 1})
+    keyset = response.headers["X-Next-Cursor"]
+    assert (await client.get("/api/products", params={"sort": "name", "cursor": keyset})).status_code == 400
+    assert (await client.get("/api/products", params={"search": "robot", "cursor": keyset})).status_code == 400
+    response = await client.get("/api/products", params={"search": "robot", "limit": 1})
+    relevance = response.headers["X-Next-Cursor"]
+    assert (await client.get("/api/products", params={"sort": "price", "cursor": relevance})).status_code == 400
@@ -0,0 +1,52 @@
+import httpx
+import pytest
+
+from ratelimit import RateLimiter, RateLimitMiddleware, apply_overrides
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def limited(server, client):
+    """A client whose requests pass the app's rules with small quotas, behind one trusted proxy."""
+    rules = apply_overrides(server.RATE_LIMIT_RULES, "auth_login=0.01/2,cart=0.01/3")
+    limiter = RateLimiter(rules, subject=server.token_subject, proxy_hops=1)
+    transport = httpx.ASGITransport(app=RateLimitMiddleware(server.app, limiter=limiter))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        yield http, limiter
+
+
+async def test_login_is_limited_per_client_address(server, client, limited):
+    http, limiter = limited
+    await register(client, "limited@example.com")
+    credentials = {"email": "limited@example.com", "password": "wrong-password"}
+    first = {"X-Forwarded-For": "203.0.113.1"}
+    for _ in range(2):
+        assert (await http.post("/api/auth/login", json=credentials, headers=first)).status_code == 401
+    verifications = server.password_pool.hash_time.count
+
+    refused = await http.post("/api/auth/login", json=credentials, headers=first)
+    assert refused.status_code == 429
+    assert int(refused.headers["retry-after"]) >= 1
+    assert refused.json() == {"detail": "Too many requests"}
+    # Turned away before the handler, so no bcrypt verification ran
+    assert server.password_pool.hash_time.count == verifications
+    assert limiter.stats()["rejected"]["auth_login"] == 1
+
+    second = {"X-Forwarded-For": "203.0.113.2"}
+    assert (await http.post("/api/auth/login", json=credentials, headers=second)).status_code == 401
+
+
+async def test_cart_is_limited_per_token_subject(server, client, limited):
+    http, _ = limited
+    alice, bob = await register(client), await register(client)
+    for _ in range(3):
+        assert (await http.get("/api/cart", headers=alice)).status_code == 200
+
+    refused = await http.get("/api/cart", headers=alice)
+    assert refused.status_code == 429 and "retry-after" in refused.headers
+    # The bucket follows the user, not the address
+    moved = dict(alice, **{"X-Forwarded-For": "198.51.100.7"})
+    assert (await http.get("/api/cart", headers=moved)).status_code == 429
+    assert (await http.get("/api/cart", headers=bob)).status_code == 200
@@ -0,0 +1,46 @@
+import uuid
+
+import pytest
+
+from tests.conftest import add_products, make_product
+
+pytestmark = pytest.mark.anyio
+
+
+async def related(client, product_id: str, limit: int = 8) -> list:
+    response = await client.get(f"/api/products/{product_id}/related?limit={limit}")
+    assert response.status_code == 200, response.text
+    return [product["id"] for product in response.json()]
+
+
+async def test_related_products_rank_by_category_and_follow_the_catalog(server, client):
+    await server.db.products.delete_many({})
+    words = ["gripper", "lidar", "servo", "battery", "camera", "wheel", "sonar", "torque"]
+    products = [
+        make_product(index, name=f"{word.title()} unit", description=f"A {word} module", price=50.0,
+                     category="industrial" if index < 4 else "educational")
+        for index, word in enumerate(words)
+    ]
+    await add_products(server, products)
+    target, *same_category = (product["id"] for product in products[:4])
+    others = {product["id"] for product in products[4:]}
+
+    ranked = await related(client, target)
+    assert len(ranked) == 7
+    assert set(ranked[:3]) == set(same_category) and set(ranked[3:]) == others
+    assert await related(client, target, limit=2) == ranked[:2]
+    assert len(await related(client, target, limit=50)) == 7
+
+    missing = await client.get(f"/api/products/{uuid.uuid4()}/related")
+    assert missing.status_code == 404
+    assert (await client.get(f"/api/products/{target}/related?limit=0")).status_code == 422
+
+    # A product that moves to another category drops below the target's category
+    moved, deleted, kept = same_category
+    await server.db.products.update_one({"id": moved}, {"$set": {"category": "educational"}})
+    await server.db.products.delete_one({"id": deleted})
+    await server.catalog.load()
+    ranked = await related(client, target)
+    assert deleted not in ranked and len(ranked) == 6
+    assert ranked[0] == kept and moved in ranked[1:]
+    assert await related(client, target, limit=1) == [kept]
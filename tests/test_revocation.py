@@ -0,0 +1,65 @@
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tests.conftest import register
+
+pytestmark = pytest.mark.anyio
+
+
+async def login(client, email: str) -> dict:
+    response = await client.post("/api/auth/login", json={"email": email, "password": "pw-123456"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def test_logout_revokes_only_the_presented_token(server, client):
+    email = f"{uuid.uuid4().hex[:10]}@example.com"
+    first = await register(client, email)
+    second = await login(client, email)
+
+    assert (await client.post("/api/auth/logout", headers=first)).status_code == 200
+    assert (await client.get("/api/auth/me", headers=first)).status_code == 401
+    assert (await client.get("/api/auth/me", headers=second)).status_code == 200
+    assert await server.db.revoked_tokens.count_documents({}) == 1
+
+
+async def test_sync_applies_revocations_from_other_processes_and_drops_expired(server):
+    revocations = server.revocations
+    now = datetime.now(timezone.utc)
+    await server.db.revoked_tokens.insert_many([
+        {"jti": "elsewhere", "user_id": "u", "expires_at": now + timedelta(seconds=600), "revoked_at": now},
+        {"jti": "expired", "user_id": "u", "expires_at": now - timedelta(seconds=1), "revoked_at": now},
+    ])
+    assert not revocations.is_revoked("elsewhere")
+    await revocations.sync()
+    assert revocations.is_revoked("elsewhere")
+    assert not revocations.is_revoked("expired")
+
+    await revocations.revoke("short-lived", time.time() - 1)
+    assert revocations.is_revoked("short-lived")
+    await revocations.sync()
+    assert not revocations.is_revoked("short-lived")
+
+
+async def test_revocation_drops_the_cached_principal(server, client):
+    email = f"{uuid.uuid4().hex[:10]}@example.com"
+    headers = await register(client, email)
+    await server.db.users.update_one({"email": email}, {"$set": {"is_admin": True}})
+    user = await server.db.users.find_one({"email": email})
+    server.user_cache.invalidate(user["id"])
+    assert (await client.get("/api/admin/stats", headers=headers)).status_code == 200
+
+    # Demoted, and another process revoked one of the user's tokens
+    await server.db.users.update_one({"email": email}, {"$set": {"is_admin": False}})
+    assert (await client.get("/api/admin/stats", headers=headers)).status_code == 200
+    await server.db.revoked_tokens.insert_one({
+        "jti": uuid.uuid4().hex,
+        "user_id": user["id"],
+        "expires_at": datetime.fromtimestamp(time.time() + 600, timezone.utc),
+        "revoked_at": datetime.now(timezone.utc),
+    })
+    await server.revocations.sync()
+    assert (await client.get("/api/admin/stats", headers=headers)).status_code == 403
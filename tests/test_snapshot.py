@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+from catalog import CatalogCache
+from related import RelatedProductsIndex
+from search import ProductSearchIndex
+from snapshot import CatalogSnapshot, SnapshotPublisher, snapshot_name
+from tests.conftest import make_product
+
+pytestmark = pytest.mark.anyio
+
+KINDS = ("rover", "arm", "drone", "humanoid")
+
+
+def catalog_products(count: int) -> list:
+    return [
+        make_product(
+            index,
+            name=f"{KINDS[index % 4].title()} {index}",
+            description=f"A {KINDS[index % 4]} with lidar and {KINDS[(index + 1) % 4]} parts",
+            category=("educational", "industrial")[index % 2],
+            price=float(10 + index % 37),
+            _id=index,
+        )
+        for index in range(count)
+    ]
+
+
+@pytest.fixture
+async def published(tmp_path):
+    cache = CatalogCache(None)
+    cache.apply(upserted=catalog_products(300))
+    cache.ready = True
+    publisher = SnapshotPublisher(
+        cache, str(tmp_path), indexes={"search": ProductSearchIndex(), "related": RelatedProductsIndex()}
+    )
+    await publisher.publish()
+    reader = CatalogSnapshot(str(tmp_path))
+    assert reader.refresh()
+    return cache, publisher, reader
+
+
+def local_indexes(products: list):
+    search, related = ProductSearchIndex(), RelatedProductsIndex()
+    search.build(products)
+    related.build(products)
+    return search, related
+
+
+async def test_workers_query_the_published_indexes(published):
+    cache, _, reader = published
+    search, related = local_indexes(cache.products())
+
+    for query, category in (("lidar rover", None), ("drone", "industrial"), ("humanoid parts", "educational")):
+        assert reader.index("search").search(query, category=category, limit=10) == search.search(
+            query, category=category, limit=10
+        )
+    first = search.search("lidar rover", limit=10)
+    assert reader.index("search").search("lidar rover", limit=10, after=first[-1]) == search.search(
+        "lidar rover", limit=10, after=first[-1]
+    )
+    for product in cache.products()[:20]:
+        assert reader.index("related").related(product["id"], 5) == related.related(product["id"], 5)
+    with pytest.raises(RuntimeError):
+        reader.index("search").update([make_product(999)])
+
+
+async def test_published_indexes_follow_catalog_changes(published):
+    cache, publisher, reader = published
+    renamed = dict(cache.products()[3], name="Gripper Deluxe", _id=3)
+    cache.apply(upserted=[renamed], removed_object_ids=[4])
+    await publisher.publish()
+    assert reader.refresh()
+    search, related = local_indexes(cache.products())
+
+    assert reader.index("search").search("gripper", limit=5)[0][0] == renamed["id"]
+    assert reader.index("search").search("rover arm", limit=20) == search.search("rover arm", limit=20)
+    assert reader.index("related").related(renamed["id"], 5) == related.related(renamed["id"], 5)
+
+
+async def test_stock_changes_are_patched_into_the_mapped_file(published):
+    cache, publisher, reader = published
+    product = dict(cache.products()[7], _id=7)
+    mapped_file = reader.stats()["file"]
+    cache.apply(upserted=[dict(product, stock_quantity=3)])
+    version = await publisher.publish()
+
+    # No new file: the reader sees the patch in the file it already maps
+    assert not reader.refresh()
+    assert reader.stats()["file"] == mapped_file
+    assert reader.get(product["id"])["stock_quantity"] == 3
+    assert reader.version == version
+    assert reader.revision(product["id"]) == version
+    assert reader.digest == cache.digest
+    assert reader.product_hash(product["id"]) == cache.product_hash(product["id"])
+    assert publisher.stats()["patches"] == 1
+
+    cache.apply(upserted=[dict(product, stock_quantity=3, price=99.0)])
+    await publisher.publish()
+    assert reader.refresh()
+    assert reader.get(product["id"])["price"] == 99.0
+    assert publisher.stats()["rewrites"] == 2
+
+
+async def test_old_files_are_pruned_by_rewrite_not_by_version(tmp_path):
+    cache = CatalogCache(None)
+    products = catalog_products(20)
+    cache.apply(upserted=products)
+    cache.ready = True
+    publisher = SnapshotPublisher(cache, str(tmp_path), keep=2)
+
+    def files() -> list:
+        return sorted(name for name in os.listdir(tmp_path) if name.endswith(".snap"))
+
+    rewrites = []
+    for generation in range(3):
+        cache.apply(upserted=[dict(products[0], name=f"Rover mark {generation}", _id=0)])
+        rewrites.append(snapshot_name(await publisher.publish()))
+        # Stock patches move the version well past ``keep`` without writing files
+        for stock in range(5):
+            cache.apply(upserted=[dict(products[1], stock_quantity=stock, _id=1)])
+            await publisher.publish()
+    assert publisher.stats()["patches"] == 15
+    assert files() == rewrites[-2:]